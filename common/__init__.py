@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+各实验目录共用的工具模块
+"""
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模型服务后端配置
+所有脚本通过这里创建OpenAI兼容客户端，默认连接百炼，设置环境变量 BAILIAN_BASE_URL
+可以切换到其他兼容服务，例如本地桩服务（python -m common.stub_server）做离线压测
+"""
+
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from openai import AsyncOpenAI, OpenAI, RateLimitError
+
+DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+
+def get_base_url() -> str:
+    """当前使用的服务地址，BAILIAN_BASE_URL 未设置时为百炼的兼容模式地址"""
+    return os.getenv("BAILIAN_BASE_URL") or DEFAULT_BASE_URL
+
+
+def get_sdk_max_retries() -> int:
+    """openai SDK内置的重试次数，压测时可把 BAILIAN_SDK_MAX_RETRIES 设为0，只保留脚本自身的重试便于统计"""
+    return int(os.getenv("BAILIAN_SDK_MAX_RETRIES", 2))
+
+
+def create_client(api_key: str = None) -> OpenAI:
+    """创建同步客户端，api_key为None时读取 DASHSCOPE_API_KEY"""
+    return OpenAI(
+        api_key=api_key or os.getenv("DASHSCOPE_API_KEY"),
+        base_url=get_base_url(),
+        max_retries=get_sdk_max_retries(),
+    )
+
+
+def create_async_client(api_key: str = None) -> AsyncOpenAI:
+    """创建异步客户端，参数同create_client"""
+    return AsyncOpenAI(
+        api_key=api_key or os.getenv("DASHSCOPE_API_KEY"),
+        base_url=get_base_url(),
+        max_retries=get_sdk_max_retries(),
+    )
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """解析Retry-After头，支持秒数和HTTP日期两种格式，无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """第attempt次(从0开始)调用失败后应等待的秒数
+
+    限流(429)时优先遵循服务端给出的Retry-After，没有或无法解析时按指数退避加抖动
+    """
+    if isinstance(error, RateLimitError):
+        response = getattr(error, "response", None)
+        retry_after = parse_retry_after(response.headers.get("retry-after")) if response is not None else None
+        if retry_after is not None:
+            return retry_after
+        return (2 ** attempt) * 2 + random.uniform(0, 1)
+    return 2 ** attempt + random.uniform(0, 1)
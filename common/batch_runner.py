@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批处理(Batch API)提交工具
+把所有请求写入批处理输入JSONL，上传并创建批处理任务，轮询直到完成，再逐行读回结果。
+适合上万条的离线生成任务，费用和吞吐都优于逐条同步调用
+"""
+
+import json
+import os
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchJobRunner:
+    def __init__(self, client, work_dir: str = ".", poll_interval: float = 30,
+                 completion_window: str = "24h", endpoint: str = "/v1/chat/completions"):
+        """
+        Args:
+            client: OpenAI兼容客户端（百炼兼容模式或本地桩服务）
+            work_dir: 批处理输入、输出文件的存放目录
+            poll_interval: 轮询任务状态的间隔（秒）
+            completion_window: 批处理任务的完成时限
+            endpoint: 批处理调用的接口
+        """
+        self.client = client
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.endpoint = endpoint
+
+    def write_input(self, requests: Iterable[Tuple[str, Dict]], input_path: str) -> int:
+        """把 (custom_id, 请求体) 逐条写入批处理输入文件，返回请求数"""
+        count = 0
+        with open(input_path, 'w', encoding='utf-8') as f:
+            for custom_id, body in requests:
+                f.write(json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": self.endpoint,
+                    "body": body,
+                }, ensure_ascii=False) + '\n')
+                count += 1
+        return count
+
+    def submit(self, input_path: str) -> str:
+        """上传输入文件并创建批处理任务，返回任务ID"""
+        with open(input_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.endpoint,
+            completion_window=self.completion_window,
+        )
+        print(f"批处理任务已提交: {batch.id}")
+        return batch.id
+
+    def wait(self, batch_id: str):
+        """轮询直到任务结束，返回最终的任务对象"""
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            if counts:
+                print(f"批处理状态: {batch.status} ({counts.completed}/{counts.total} 完成, {counts.failed} 失败)")
+            else:
+                print(f"批处理状态: {batch.status}")
+            if batch.status in FINAL_STATUSES:
+                return batch
+            time.sleep(self.poll_interval)
+
+    def iter_results(self, batch, output_path: str) -> Iterator[Tuple[str, Optional[str]]]:
+        """下载输出文件并逐行产出 (custom_id, 回复内容)，失败的请求内容为None"""
+        error_path = os.path.splitext(output_path)[0] + "_errors.jsonl"
+        for file_id, path in ((batch.output_file_id, output_path), (batch.error_file_id, error_path)):
+            if not file_id:
+                continue
+            self.client.files.content(file_id).write_to_file(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    yield self.parse_result_line(json.loads(line))
+
+    @staticmethod
+    def parse_result_line(result: Dict) -> Tuple[str, Optional[str]]:
+        """从一行批处理结果中取出custom_id和回复内容"""
+        response = result.get("response") or {}
+        body = response.get("body") or {}
+        choices: List[Dict] = body.get("choices") or []
+        if response.get("status_code") != 200 or not choices:
+            return result.get("custom_id"), None
+        return result.get("custom_id"), choices[0]["message"]["content"]
+
+    def run(self, requests: Iterable[Tuple[str, Dict]], name: str) -> Iterator[Tuple[str, Optional[str]]]:
+        """写入、提交、等待并逐条产出结果"""
+        os.makedirs(self.work_dir, exist_ok=True)
+        input_path = os.path.join(self.work_dir, f"{name}_batch_input.jsonl")
+        output_path = os.path.join(self.work_dir, f"{name}_batch_output.jsonl")
+
+        count = self.write_input(requests, input_path)
+        print(f"已写入 {count} 条批处理请求: {input_path}")
+        if count == 0:
+            return
+
+        batch = self.wait(self.submit(input_path))
+        if batch.status != "completed":
+            print(f"批处理任务未成功完成: {batch.status}")
+        yield from self.iter_results(batch, output_path)
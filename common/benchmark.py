@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成流程端到端吞吐基准测试
+在本地桩服务（common/stub_server.py）上按不同的并发数和延迟配置运行各生成脚本，统计吞吐、
+请求延迟的p50/p99、每条有效样本消耗的API调用、重试和解析失败，结果保存为JSON便于对比历史版本
+
+用法:
+    python -m common.benchmark --count 20 --concurrency 1,4,16 --profiles fast,flaky
+    python -m common.benchmark --compare benchmark_results/上次的结果.json
+"""
+
+import argparse
+import contextlib
+import functools
+import importlib.util
+import inspect
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from typing import Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 延迟配置，参数对应StubBehavior
+LATENCY_PROFILES = {
+    "fast": {"latency": 0.05, "jitter": 0.02},
+    "typical": {"latency": 0.8, "jitter": 0.4},
+    "flaky": {"latency": 0.3, "jitter": 0.1, "error_rate": 0.05, "rate_limit_rate": 0.05, "retry_after": 0.5},
+}
+
+
+def load_module(relative_path: str):
+    """把生成脚本复制到当前用例目录后加载
+
+    部分脚本把输出写在脚本所在目录，复制后输出落在用例目录，不会覆盖仓库中的数据文件
+    """
+    path = os.path.join(os.getcwd(), os.path.basename(relative_path))
+    shutil.copyfile(os.path.join(REPO_ROOT, relative_path), path)
+    name = "bench_" + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_enterprise(count: int, concurrency: int, record: Callable):
+    module = load_module(os.path.join("企业级", "generate_enterprise_data.py"))
+    generator = module.EnterpriseDataGenerator(os.getenv("DASHSCOPE_API_KEY"))
+    record(generator.client)
+    record(generator.async_client)
+    generator.generate_dataset(count, "output.jsonl", concurrency=concurrency, resume=False)
+
+
+def run_think(count: int, concurrency: int, record: Callable):
+    module = load_module(os.path.join("思考模式实验", "generate_think_data_with_api.py"))
+    generator = module.QwenThinkDataGenerator()
+    record(generator.client)
+    generator.generate_dataset(count, "output.jsonl")
+
+
+def run_large_fictional(count: int, concurrency: int, record: Callable):
+    module = load_module(os.path.join("虚构概念实验", "generate_large_dataset.py"))
+    generator = module.LargeFictionalDatasetGenerator()
+    record(generator.client)
+    generator.generate_large_dataset(count, batch_size=count, output_file="output.jsonl", resume=False)
+
+
+def run_minimal_fictional(count: int, concurrency: int, record: Callable):
+    module = load_module(os.path.join("虚构概念实验", "generate_minimal_data.py"))
+    generator = module.MinimalFictionalConceptGenerator()
+    record(generator.client)
+    generator.generate_batch_minimal_data(count, "output.jsonl")
+
+
+# 名称 -> (运行函数, 是否支持并发)。不支持并发的脚本只在并发数1下运行
+GENERATORS = {
+    "enterprise": (run_enterprise, True),
+    "think": (run_think, False),
+    "large_fictional": (run_large_fictional, False),
+    "minimal_fictional": (run_minimal_fictional, False),
+}
+
+
+class LatencyRecorder:
+    """包装客户端的chat.completions.create，记录每次请求的耗时（包括失败的请求）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: List[float] = []
+
+    def _add(self, elapsed: float):
+        with self.lock:
+            self.latencies.append(elapsed)
+
+    def __call__(self, client):
+        completions = client.chat.completions
+        create = completions.create
+        # SDK的create外面套了一层同步的参数检查装饰器，需要解开后判断是否为协程
+        if inspect.iscoroutinefunction(inspect.unwrap(create)):
+            @functools.wraps(create)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await create(*args, **kwargs)
+                finally:
+                    self._add(time.perf_counter() - start)
+        else:
+            @functools.wraps(create)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return create(*args, **kwargs)
+                finally:
+                    self._add(time.perf_counter() - start)
+        completions.create = timed
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def count_lines(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def run_case(name: str, count: int, concurrency: int, profile: str, work_dir: str, seed: int = 1) -> Dict:
+    """在独立的桩服务和输出目录中运行一个生成脚本，返回统计结果"""
+    from common.stub_server import StubBehavior, start_stub_server
+
+    runner, _ = GENERATORS[name]
+    server = start_stub_server(behavior=StubBehavior(seed=seed, **LATENCY_PROFILES[profile]))
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["BAILIAN_BASE_URL"] = base_url
+    case_dir = os.path.join(work_dir, f"{name}_{profile}_c{concurrency}")
+    os.makedirs(case_dir, exist_ok=True)
+
+    recorder = LatencyRecorder()
+    cwd = os.getcwd()
+    error = None
+    log = io.StringIO()
+    start = time.perf_counter()
+    try:
+        os.chdir(case_dir)
+        with contextlib.redirect_stdout(log):
+            runner(count, concurrency, recorder)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        elapsed = time.perf_counter() - start
+        os.chdir(cwd)
+        with urllib.request.urlopen(base_url + "/stub/stats") as response:
+            stats = json.load(response)
+        server.shutdown()
+        server.server_close()
+
+    accepted = count_lines(os.path.join(case_dir, "output.jsonl"))
+    api_calls = stats.get("requests", 0)
+    failed_calls = stats.get("errors", 0) + stats.get("rate_limited", 0)
+    answered = api_calls - failed_calls
+    return {
+        "generator": name,
+        "profile": profile,
+        "concurrency": concurrency,
+        "target": count,
+        "accepted": accepted,
+        "elapsed_sec": round(elapsed, 3),
+        "samples_per_sec": round(accepted / elapsed, 3) if elapsed else 0.0,
+        "api_calls": api_calls,
+        "calls_per_sample": round(api_calls / accepted, 3) if accepted else None,
+        "failed_calls": failed_calls,
+        "rate_limited": stats.get("rate_limited", 0),
+        # 返回成功却没有变成样本的调用，主要是解析失败
+        "parse_failures": max(0, answered - accepted),
+        "wasted_calls": max(0, api_calls - accepted),
+        "latency_p50_ms": round(percentile(recorder.latencies, 50) * 1000, 1),
+        "latency_p99_ms": round(percentile(recorder.latencies, 99) * 1000, 1),
+        "error": error,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results: List[Dict]):
+    print(f"\n{'生成脚本':<18}{'配置':<9}{'并发':>4}{'样本':>6}{'样本/秒':>9}{'调用/样本':>10}"
+          f"{'失败':>6}{'解析失败':>9}{'p50(ms)':>9}{'p99(ms)':>9}")
+    for r in results:
+        calls_per_sample = f"{r['calls_per_sample']:.2f}" if r["calls_per_sample"] else "-"
+        print(f"{r['generator']:<18}{r['profile']:<9}{r['concurrency']:>4}{r['accepted']:>6}"
+              f"{r['samples_per_sec']:>9.2f}{calls_per_sample:>10}{r['failed_calls']:>6}{r['parse_failures']:>9}"
+              f"{r['latency_p50_ms']:>9.0f}{r['latency_p99_ms']:>9.0f}")
+        if r["error"]:
+            print(f"  运行出错: {r['error']}")
+
+
+def compare_results(results: List[Dict], baseline_file: str):
+    """与之前保存的结果对比吞吐变化"""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["generator"], r["profile"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\n=== 与 {baseline_file} ({baseline.get('git_revision')}) 对比 ===")
+    for r in results:
+        old = previous.get((r["generator"], r["profile"], r["concurrency"]))
+        if not old or not old["samples_per_sec"]:
+            continue
+        change = (r["samples_per_sec"] - old["samples_per_sec"]) / old["samples_per_sec"] * 100
+        flag = "  <-- 下降" if change < -10 else ""
+        print(f"{r['generator']:<18}{r['profile']:<9}c{r['concurrency']:<4}"
+              f"{old['samples_per_sec']:>8.2f} -> {r['samples_per_sec']:<8.2f}({change:+.1f}%){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成流程吞吐基准测试")
+    parser.add_argument("--generators", default=",".join(GENERATORS), help="逗号分隔的生成脚本名")
+    parser.add_argument("--profiles", default="fast,flaky", help=f"逗号分隔的延迟配置，可选 {','.join(LATENCY_PROFILES)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="逗号分隔的并发数")
+    parser.add_argument("--count", type=int, default=20, help="每个用例生成的样本数")
+    parser.add_argument("--seed", type=int, default=1, help="桩服务故障注入的随机数种子，相同种子的结果可复现")
+    parser.add_argument("--output-dir", default="benchmark_results", help="结果JSON的保存目录")
+    parser.add_argument("--compare", help="与之前保存的结果JSON对比")
+    args = parser.parse_args()
+
+    # 压测桩服务时放开本地限流，关闭SDK内置重试和响应缓存，只统计脚本自身的行为
+    work_dir = tempfile.mkdtemp(prefix="bailian_bench_")
+    os.environ.update({
+        "DASHSCOPE_API_KEY": os.getenv("DASHSCOPE_API_KEY") or "benchmark",
+        "BAILIAN_RPM": "1000000",
+        "BAILIAN_TPM": "1000000000",
+        "BAILIAN_RATE_LIMIT_FILE": os.path.join(work_dir, "rate_limit.json"),
+        "BAILIAN_SDK_MAX_RETRIES": "0",
+        "BAILIAN_CACHE_DB": "",
+    })
+    sys.path.insert(0, REPO_ROOT)
+
+    results = []
+    for name in args.generators.split(","):
+        _, concurrent = GENERATORS[name]
+        levels = [int(c) for c in args.concurrency.split(",")] if concurrent else [1]
+        for profile in args.profiles.split(","):
+            for concurrency in levels:
+                print(f"运行 {name} / {profile} / 并发{concurrency} ...")
+                results.append(run_case(name, args.count, concurrency, profile, work_dir, args.seed))
+
+    print_results(results)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_file = os.path.join(args.output_dir, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "git_revision": git_revision(),
+            "count": args.count,
+            "seed": args.seed,
+            "profiles": {name: LATENCY_PROFILES[name] for name in args.profiles.split(",")},
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到: {output_file}")
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+去重用的紧凑集合
+BloomFilter 按预期容量和误判率一次性分配位数组，内存与输入规模无关；
+HashSet 只保存每条记录的64位摘要，没有误判，内存随不同记录数线性增长
+"""
+
+import hashlib
+import math
+
+
+def digest(data: bytes) -> bytes:
+    """记录的128位摘要，两种集合共用"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = 10_000_000, error_rate: float = 1e-6):
+        """
+        Args:
+            capacity: 预期的不同记录数，超过后误判率会上升
+            error_rate: 达到capacity时把新记录误判为重复的概率
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: bytes):
+        # 双重哈希：由摘要的前后两半生成num_hashes个位置
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, data: bytes) -> bool:
+        """加入一条记录，已存在（或被误判为已存在）时返回False"""
+        key = digest(data)
+        new = False
+        for pos in self._positions(key):
+            byte, bit = divmod(pos, 8)
+            if not self.bits[byte] >> bit & 1:
+                self.bits[byte] |= 1 << bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, data: bytes) -> bool:
+        key = digest(data)
+        return all(self.bits[pos // 8] >> (pos % 8) & 1 for pos in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+
+class HashSet:
+    """精确去重，每条不同的记录只保存一个64位整数"""
+
+    def __init__(self):
+        self.keys = set()
+
+    def add(self, data: bytes) -> bool:
+        """加入一条记录，已存在时返回False"""
+        key = int.from_bytes(digest(data)[:8], "little")
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def __contains__(self, data: bytes) -> bool:
+        return int.from_bytes(digest(data)[:8], "little") in self.keys
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+messages数据集的列式存储（Parquet / Arrow IPC）
+每条消息展开为一行: record（所在样本的序号）、turn（样本内的序号）、role、content、length，
+messages以外的字段（如chosen/rejected）序列化为JSON放在该样本第一条消息的extra列，
+消息只保留role和content。
+统计和过滤只读取需要的列，不必把整段对话反序列化；.arrow/.feather文件以内存映射零拷贝读取
+
+需要 pip install pyarrow，JSONL仍然是各生成脚本的默认格式
+
+用法:
+    python -m common.columnar to-columnar merged_training_data.jsonl merged.parquet
+    python -m common.columnar to-jsonl merged.parquet merged_training_data.jsonl
+    python -m common.columnar check merged_training_data.jsonl merged.arrow --batch-size 1000
+"""
+
+import argparse
+import json
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # 只有用到列式存储时才需要pyarrow
+    pa = None
+
+COLUMNAR_EXTENSIONS = (".parquet", ".arrow", ".feather")
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("列式存储需要pyarrow，请先 pip install pyarrow")
+
+
+def is_columnar(path: str) -> bool:
+    """按扩展名判断是否为列式存储文件"""
+    return path.lower().endswith(COLUMNAR_EXTENSIONS)
+
+
+def _is_ipc(path: str) -> bool:
+    return path.lower().endswith((".arrow", ".feather"))
+
+
+def message_schema() -> "pa.Schema":
+    _require_pyarrow()
+    return pa.schema([
+        ("record", pa.int64()),
+        ("turn", pa.int32()),
+        # 不用字典类型：每批的字典不同，Arrow IPC文件不允许替换字典；Parquet写入时仍会自动字典编码
+        ("role", pa.string()),
+        ("content", pa.large_string()),
+        ("length", pa.int32()),
+        ("extra", pa.large_string()),
+    ])
+
+
+def flatten_records(records: Sequence[Dict], start: int = 0) -> "pa.Table":
+    """把一批样本展开为每条消息一行的表，start是第一条样本的序号"""
+    _require_pyarrow()
+    columns = {name: [] for name in message_schema().names}
+    for offset, item in enumerate(records):
+        messages = item.get("messages") or []
+        extra = {key: value for key, value in item.items() if key != "messages"}
+        extra_json = json.dumps(extra, ensure_ascii=False) if extra else None
+        # 没有消息的样本也占一行，保证样本数量和额外字段不丢失
+        for turn, msg in enumerate(messages or [None]):
+            content = msg.get("content") if msg else None
+            columns["record"].append(start + offset)
+            columns["turn"].append(turn if msg else -1)
+            columns["role"].append(msg.get("role") if msg else None)
+            columns["content"].append(content)
+            columns["length"].append(len(content) if content else 0)
+            columns["extra"].append(extra_json if turn == 0 else None)
+    return pa.Table.from_pydict(columns, schema=message_schema())
+
+
+class ColumnarWriter:
+    """分批写入列式文件，每批是一个Parquet行组或一个Arrow记录批"""
+
+    def __init__(self, path: str, compression: str = "zstd"):
+        _require_pyarrow()
+        self.path = path
+        self.count = 0
+        schema = message_schema()
+        if _is_ipc(path):
+            # IPC文件不压缩，读取时可以直接内存映射，零拷贝
+            self._sink = pa.OSFile(path, "wb")
+            self._writer = pa.ipc.new_file(self._sink, schema)
+        else:
+            self._sink = None
+            self._writer = pq.ParquetWriter(path, schema, compression=compression)
+
+    def write(self, records: Sequence[Dict]):
+        if not records:
+            return
+        table = flatten_records(records, self.count)
+        self._writer.write_table(table)
+        self.count += len(records)
+
+    def close(self):
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def jsonl_to_columnar(jsonl_path: str, output_path: str, batch_size: int = 10000) -> int:
+    """流式把JSONL转换为Parquet/Arrow文件，返回样本数"""
+    batch = []
+    with ColumnarWriter(output_path) as writer, open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                writer.write(batch)
+                batch = []
+        writer.write(batch)
+    return writer.count
+
+
+def read_columns(path: str, columns: Optional[List[str]] = None, roles: Optional[Sequence[str]] = None) -> "pa.Table":
+    """只读取指定的列，roles不为None时只保留这些角色的消息
+
+    Parquet按列读取（未读取的列不解压），Arrow IPC通过内存映射零拷贝读取
+    """
+    _require_pyarrow()
+    needed = None if columns is None else list(dict.fromkeys(list(columns) + (["role"] if roles else [])))
+    if _is_ipc(path):
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        if needed is not None:
+            table = table.select(needed)
+    else:
+        table = pq.read_table(path, columns=needed, memory_map=True)
+    if roles:
+        table = table.filter(pc.is_in(table["role"], pa.array(list(roles))))
+        if columns is not None and "role" not in columns:
+            table = table.drop_columns(["role"])
+    return table
+
+
+def count_records(path: str) -> int:
+    """样本数（只读取record列）"""
+    records = read_columns(path, ["record"])["record"]
+    return pc.max(records).as_py() + 1 if len(records) else 0
+
+
+def count_containing(path: str, substrings: Sequence[str], turn: Optional[int] = None,
+                     roles: Optional[Sequence[str]] = None) -> int:
+    """统计content同时包含所有substrings的消息数，可以按消息序号turn或角色过滤，全部在Arrow中向量化完成"""
+    table = read_columns(path, ["turn", "content"], roles=roles)
+    if turn is not None:
+        table = table.filter(pc.equal(table["turn"], turn))
+    mask = None
+    for substring in substrings:
+        matched = pc.match_substring(table["content"], substring)
+        mask = matched if mask is None else pc.and_(mask, matched)
+    return len(table) if mask is None else pc.sum(mask).as_py() or 0
+
+
+def iter_records(path: str, batch_size: int = 65536) -> Iterator[Dict]:
+    """按顺序把列式文件还原为原来的样本，按批读取，同一样本的消息可以跨批"""
+    _require_pyarrow()
+    if _is_ipc(path):
+        reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    else:
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_size)
+
+    current: Tuple[Optional[int], Optional[Dict]] = (None, None)
+    for batch in batches:
+        for row in batch.to_pylist():
+            if row["record"] != current[0]:
+                if current[1] is not None:
+                    yield current[1]
+                item = {"messages": []}
+                if row["extra"]:
+                    item.update(json.loads(row["extra"]))
+                current = (row["record"], item)
+            if row["turn"] >= 0:
+                current[1]["messages"].append({"role": row["role"], "content": row["content"]})
+    if current[1] is not None:
+        yield current[1]
+
+
+def columnar_to_jsonl(path: str, jsonl_path: str) -> int:
+    """把Parquet/Arrow文件还原为JSONL，返回样本数"""
+    count = 0
+    with open(jsonl_path, 'w', encoding='utf-8') as f:
+        for item in iter_records(path):
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def check_roundtrip(jsonl_path: str, output_path: str, batch_size: int = 10000) -> bool:
+    """把JSONL转换为列式文件再逐条还原，检查与原数据是否一致（键的顺序不计）"""
+    jsonl_to_columnar(jsonl_path, output_path, batch_size)
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        original = (json.loads(line) for line in f if line.strip())
+        restored = iter_records(output_path)
+        for i, (expected, actual) in enumerate(zip(original, restored)):
+            expected["messages"] = [{"role": msg.get("role"), "content": msg.get("content")}
+                                    for msg in expected.get("messages") or []]
+            if expected != actual:
+                print(f"第 {i} 条样本不一致")
+                return False
+        # 两边的条数必须相同
+        if next(original, None) is not None or next(restored, None) is not None:
+            print("样本数不一致")
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="messages数据集在JSONL与Parquet/Arrow之间转换")
+    parser.add_argument("command", choices=["to-columnar", "to-jsonl", "check"],
+                        help="check: 转换为output后逐条还原，检查与输入的JSONL是否一致")
+    parser.add_argument("input", help="输入文件")
+    parser.add_argument("output", help="输出文件，列式文件按扩展名选择.parquet或.arrow")
+    parser.add_argument("--batch-size", type=int, default=10000, help="每个行组包含的样本数")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        ok = check_roundtrip(args.input, args.output, args.batch_size)
+        print("往返转换一致" if ok else "往返转换不一致")
+        raise SystemExit(0 if ok else 1)
+    if args.command == "to-columnar":
+        count = jsonl_to_columnar(args.input, args.output, args.batch_size)
+    else:
+        count = columnar_to_jsonl(args.input, args.output)
+    print(f"转换完成: {count} 条样本 -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按覆盖度抽取提示词组合、调度生成槽位
+CoverageSampler 在若干维度（如问题模板、术语、场景）的笛卡尔积上做不放回抽样：优先选择各维度中
+用得最少的取值，所有组合都用过一轮之后才开始重复，保证每次付费请求都带来新的组合。
+CoverageScheduler 在(类别, 场景)矩阵上按实时的覆盖数和成功率分配槽位，支持并发调度
+"""
+
+import itertools
+import random
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+
+
+class CoverageSampler:
+    def __init__(self, dimensions: Sequence[Sequence[Hashable]], rng: random.Random = None):
+        """
+        Args:
+            dimensions: 每个维度的取值列表，抽到的组合是各维度各取一个值组成的元组
+            rng: 随机数生成器，用于打破计数相同时的顺序，默认使用random模块
+        """
+        self.dimensions = [list(values) for values in dimensions]
+        self.rng = rng or random
+        self.value_counts = [Counter() for _ in self.dimensions]
+        self.combo_counts = Counter()
+        self.round = 0  # 当前轮次：组合被抽中的次数小于等于round时可以再次抽取
+        self.total = 1
+        for values in self.dimensions:
+            self.total *= len(values)
+
+    def _ordered(self, dim: int) -> List[Hashable]:
+        """按使用次数从少到多排列某个维度的取值，次数相同的随机排列"""
+        counts = self.value_counts[dim]
+        return sorted(self.dimensions[dim], key=lambda value: (counts[value], self.rng.random()))
+
+    def mark(self, combo: Tuple):
+        """记录一个已经使用的组合（例如断点续跑时清单中已完成的组合）"""
+        for dim, value in enumerate(combo):
+            self.value_counts[dim][value] += 1
+        self.combo_counts[combo] += 1
+
+    def draw(self, exclude: Iterable[Tuple] = None) -> Tuple:
+        """抽取一个组合并记为已使用
+
+        优先返回本轮还没用过、且各维度取值使用最少的组合；exclude中的组合不会被抽中，
+        所有组合都用过（或被排除）后进入下一轮，允许重复
+        """
+        exclude = exclude if exclude is not None else ()
+        for _ in range(2):
+            for combo in itertools.product(*(self._ordered(dim) for dim in range(len(self.dimensions)))):
+                if self.combo_counts[combo] <= self.round and combo not in exclude:
+                    self.mark(combo)
+                    return combo
+            self.round += 1
+        # 所有组合都被排除时退化为有放回抽取
+        combo = tuple(self.rng.choice(values) for values in self.dimensions)
+        self.mark(combo)
+        return combo
+
+    @property
+    def coverage(self) -> float:
+        """已经用过的不同组合占全部组合的比例"""
+        return len(self.combo_counts) / self.total if self.total else 0.0
+
+
+class CoverageScheduler:
+    """在(分组, 单元)矩阵上调度生成槽位，优先覆盖最少、成功率最高的单元
+
+    槽位是(分组, 单元, 序号)三元组。调度器实时维护每个单元已完成、进行中和失败的数量，
+    acquire总是从"已完成+进行中+失败次数的一半"最少的单元中挑选，相同时优先所在分组覆盖更少、
+    成功率更高的单元。偶发失败的单元很快会被重试，持续失败的单元则逐渐让位给其他单元
+    """
+
+    def __init__(self, cells: Sequence[Tuple[Hashable, Hashable]], done: Iterable[Tuple] = (),
+                 rng: random.Random = None):
+        """
+        Args:
+            cells: 所有(分组, 单元)组合
+            done: 已经完成的槽位，例如运行清单中的记录
+            rng: 随机数生成器，用于打破优先级相同时的顺序
+        """
+        self.cells = list(cells)
+        self.rng = rng or random
+        self.filled = Counter()
+        self.group_filled = Counter()
+        self.in_flight = Counter()
+        self.group_in_flight = Counter()
+        self.attempts = Counter()
+        self.failures = Counter()
+        self.taken = set()
+        for group, cell, index in done:
+            self.filled[(group, cell)] += 1
+            self.group_filled[group] += 1
+            self.taken.add((group, cell, index))
+
+    def success_rate(self, cell: Tuple) -> float:
+        """单元的槽位成功率，用拉普拉斯平滑避免没有数据时为0"""
+        return (self.attempts[cell] - self.failures[cell] + 1) / (self.attempts[cell] + 2)
+
+    def _priority(self, cell: Tuple):
+        group = cell[0]
+        return (self.filled[cell] + self.in_flight[cell] + self.failures[cell] // 2,
+                self.group_filled[group] + self.group_in_flight[group],
+                -self.success_rate(cell),
+                self.rng.random())
+
+    def acquire(self, size: int = 1) -> List[Tuple]:
+        """为一次请求预留同一单元下的size个槽位"""
+        group, cell = min(self.cells, key=self._priority)
+        slots = []
+        index = 0
+        while len(slots) < size:
+            slot = (group, cell, index)
+            if slot not in self.taken:
+                slots.append(slot)
+            index += 1
+        # 序号同时作为请求的seed，失败过的序号不再复用，避免命中缓存里同样的失败响应
+        self.taken.update(slots)
+        self.in_flight[(group, cell)] += size
+        self.group_in_flight[group] += size
+        return slots
+
+    def release(self, slots: List[Tuple], succeeded: int):
+        """请求结束后归还槽位，前succeeded个槽位算作成功"""
+        if not slots:
+            return
+        group, cell, _ = slots[0]
+        key = (group, cell)
+        self.in_flight[key] -= len(slots)
+        self.group_in_flight[group] -= len(slots)
+        self.attempts[key] += len(slots)
+        self.failures[key] += len(slots) - succeeded
+        self.filled[key] += succeeded
+        self.group_filled[group] += succeeded
+
+    @property
+    def pending(self) -> int:
+        """进行中的槽位总数"""
+        return sum(self.in_flight.values())
+
+    def summary(self) -> List[Dict]:
+        """按分组汇总覆盖情况和失败率"""
+        groups = {}
+        for group, cell in self.cells:
+            item = groups.setdefault(group, {"group": group, "cells": 0, "covered": 0, "filled": 0,
+                                             "attempts": 0, "failures": 0, "min": None, "max": 0})
+            filled = self.filled[(group, cell)]
+            item["cells"] += 1
+            item["covered"] += 1 if filled else 0
+            item["filled"] += filled
+            item["attempts"] += self.attempts[(group, cell)]
+            item["failures"] += self.failures[(group, cell)]
+            item["min"] = filled if item["min"] is None else min(item["min"], filled)
+            item["max"] = max(item["max"], filled)
+        return list(groups.values())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSONL随机访问索引
+第一次打开时扫描一遍文件，把每行的起始字节偏移写入旁边的 .idx 文件；之后数据文件和索引都用mmap打开，
+dataset[i]、切片、随机抽样和len()都不需要从头读取文件，多GB的数据集也可以随时抽查、打乱和划分。
+数据文件的大小或修改时间变化后（例如生成脚本又追加了数据）索引自动重建
+
+用法:
+    python -m common.jsonl_index 企业级/enterprise_training_data.jsonl --get 100
+    python -m common.jsonl_index 虚构概念实验/merged_training_data.jsonl --sample 5 --seed 42
+"""
+
+import argparse
+import json
+import mmap
+import os
+import random
+import struct
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+INDEX_MAGIC = b"JSONLIDX"
+INDEX_VERSION = 1
+# 魔数、版本、数据文件大小、数据文件修改时间(ns)、行数
+HEADER = struct.Struct("<8sIQqQ")
+
+
+def index_path_for(path: str) -> str:
+    return path + ".idx"
+
+
+def scan_offsets(path: str) -> array:
+    """扫描一遍数据文件，返回每个非空行的起始偏移，最后附加一个结束偏移，第i行是offsets[i]:offsets[i+1]"""
+    offsets = array("Q")
+    size = os.path.getsize(path)
+    if size == 0:
+        offsets.append(0)
+        return offsets
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = 0
+        while pos < size:
+            end = mm.find(b"\n", pos)
+            if end == -1:
+                end = size
+            # JSON行以{开头，只有以空白开头的行才需要检查是否为空行
+            if end > pos and (mm[pos] not in b" \t\r" or mm[pos:end].strip()):
+                offsets.append(pos)
+            pos = end + 1
+    # 每行的结束位置取下一行的起始偏移，最后一行取文件末尾
+    offsets.append(size)
+    return offsets
+
+
+def build_index(path: str, index_path: Optional[str] = None) -> str:
+    """为数据文件建立偏移索引（偏移按本机字节序保存），先写入临时文件再替换，返回索引文件路径"""
+    index_path = index_path or index_path_for(path)
+    stat = os.stat(path)
+    offsets = scan_offsets(path)
+    tmp_file = index_path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, stat.st_size, stat.st_mtime_ns, len(offsets) - 1))
+        offsets.tofile(f)
+    os.replace(tmp_file, index_path)
+    return index_path
+
+
+def index_is_current(path: str, index_path: str) -> bool:
+    """索引存在且与数据文件当前的大小、修改时间一致"""
+    if not os.path.exists(index_path):
+        return False
+    stat = os.stat(path)
+    with open(index_path, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return False
+    magic, version, size, mtime_ns, count = HEADER.unpack(header)
+    return (magic == INDEX_MAGIC and version == INDEX_VERSION and size == stat.st_size
+            and mtime_ns == stat.st_mtime_ns
+            and os.path.getsize(index_path) == HEADER.size + (count + 1) * 8)
+
+
+class JsonlDataset:
+    """通过mmap随机访问JSONL文件的只读数据集"""
+
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        """
+        Args:
+            path: JSONL数据文件
+            index_path: 偏移索引文件，默认为数据文件旁边的 .idx，不存在或过期时自动重建
+        """
+        self.path = path
+        self.index_path = index_path or index_path_for(path)
+        if not index_is_current(path, self.index_path):
+            build_index(path, self.index_path)
+
+        self._index_file = open(self.index_path, "rb")
+        self._index_mm = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count = HEADER.unpack_from(self._index_mm)[4]
+        # 偏移数组直接映射为memoryview，不复制到内存
+        self._offsets = memoryview(self._index_mm)[HEADER.size:].cast("Q")
+
+        self._data_file = open(path, "rb")
+        self._data_mm = (mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+                         if os.path.getsize(path) else None)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def line(self, i: int) -> bytes:
+        """第i行的原始字节（不含换行符）"""
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(f"行号 {i} 超出范围（共 {self._count} 行）")
+        start, end = self._offsets[i], self._offsets[i + 1]
+        # 结束位置是下一行的起始偏移，去掉中间的换行和空行
+        return self._data_mm[start:end].rstrip()
+
+    def __getitem__(self, key):
+        """dataset[i]返回解析后的一行，dataset[a:b:c]返回列表"""
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(self._count))]
+        return json.loads(self.line(key))
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(self._count):
+            yield self[i]
+
+    def sample(self, k: int, seed: Optional[int] = None) -> List[Tuple[int, Dict]]:
+        """不放回地随机抽取k行，返回(行号, 数据)"""
+        rng = random.Random(seed)
+        indices = rng.sample(range(self._count), min(k, self._count))
+        return [(i, self[i]) for i in indices]
+
+    def shuffled_indices(self, seed: Optional[int] = None) -> List[int]:
+        """打乱后的行号，按这个顺序读取即可得到打乱的数据集，不需要移动数据"""
+        indices = list(range(self._count))
+        random.Random(seed).shuffle(indices)
+        return indices
+
+    def split(self, val_ratio: float = 0.1, seed: Optional[int] = None) -> Tuple[List[int], List[int]]:
+        """随机划分训练集和验证集，返回两组行号"""
+        indices = self.shuffled_indices(seed)
+        val_count = int(round(self._count * val_ratio))
+        return indices[val_count:], indices[:val_count]
+
+    def write_subset(self, indices, output_file: str) -> int:
+        """按给定的行号顺序把原始行写入新的JSONL文件（不重新序列化），返回行数"""
+        count = 0
+        with open(output_file, "wb") as f:
+            for i in indices:
+                f.write(self.line(i) + b"\n")
+                count += 1
+        return count
+
+    def close(self):
+        self._offsets.release()
+        self._index_mm.close()
+        self._index_file.close()
+        if self._data_mm is not None:
+            self._data_mm.close()
+        self._data_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="建立JSONL偏移索引，随机访问或抽样查看数据")
+    parser.add_argument("file", help="JSONL数据文件")
+    parser.add_argument("--get", type=int, action="append", help="显示第N行（从0开始，可以为负数），可重复指定")
+    parser.add_argument("--sample", type=int, default=0, help="随机抽取并显示的行数")
+    parser.add_argument("--seed", type=int, default=None, help="抽样的随机数种子")
+    parser.add_argument("--split", type=float, default=None, metavar="VAL_RATIO",
+                        help="按比例随机划分，写出 *_train.jsonl 和 *_val.jsonl")
+    args = parser.parse_args()
+
+    with JsonlDataset(args.file) as dataset:
+        print(f"{args.file}: {len(dataset)} 行，索引: {dataset.index_path}")
+        shown = [(i, dataset[i]) for i in args.get or []] + dataset.sample(args.sample, args.seed)
+        for i, item in shown:
+            print(f"\n--- 第 {i} 行 ---")
+            print(json.dumps(item, ensure_ascii=False, indent=2))
+        if args.split is not None:
+            train, val = dataset.split(args.split, args.seed)
+            stem = os.path.splitext(args.file)[0]
+            dataset.write_subset(train, stem + "_train.jsonl")
+            dataset.write_subset(val, stem + "_val.jsonl")
+            print(f"\n训练集 {len(train)} 行: {stem}_train.jsonl")
+            print(f"验证集 {len(val)} 行: {stem}_val.jsonl")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式JSONL写入器
+每条样本追加写入并立即flush，按配置的间隔fsync，不在内存中保留整个数据集
+"""
+
+import json
+import os
+from typing import Dict
+
+
+class JsonlWriter:
+    def __init__(self, filepath: str, mode: str = "a", fsync_interval: int = 10):
+        """
+        Args:
+            filepath: 输出的JSONL文件路径
+            mode: "a"追加写入（默认），"w"清空后重新写入
+            fsync_interval: 每写入多少条执行一次fsync，0表示只在关闭时fsync
+        """
+        self.filepath = filepath
+        self.fsync_interval = fsync_interval
+        self.count = 0
+        self._file = open(filepath, mode, encoding="utf-8")
+
+    def write(self, item: Dict):
+        """追加一条样本"""
+        self._file.write(json.dumps(item, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.count += 1
+        if self.fsync_interval and self.count % self.fsync_interval == 0:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
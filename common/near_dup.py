@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于MinHash/LSH的近似重复检测
+对话的用户和助手轮次切成字符n-gram后计算MinHash签名，按LSH分桶找出相似度超过阈值的候选，
+再用签名一致率核对。签名计算和分桶都用NumPy批量完成，百万行数据几分钟内可以处理完
+
+用法:
+    离线去重: python -m common.near_dup input.jsonl --output deduped.jsonl --threshold 0.8
+    召回检查: python -m common.near_dup --recall-check --threshold 0.8
+    在线过滤: 设置环境变量 BAILIAN_NEAR_DUP_THRESHOLD=0.8，生成脚本会丢弃与已生成数据近似重复的样本
+"""
+
+import argparse
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 只有用到近似去重时才需要numpy
+    np = None
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_SHINGLE_SIZE = 4
+# 每批计算签名时展开的n-gram数上限，控制 num_perm × n-gram数 的中间矩阵大小
+CHUNK_SHINGLES = 1 << 17
+_GOLDEN_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def dialogue_text(item: Dict, field: str = "both") -> str:
+    """取出参与比较的文本，field为user、assistant或both"""
+    roles = ("user", "assistant") if field == "both" else (field,)
+    return "\n".join(msg.get("content") or "" for msg in item.get("messages", []) if msg.get("role") in roles)
+
+
+def choose_bands(num_perm: int, threshold: float, min_recall: float = 0.95) -> Tuple[int, int]:
+    """在 bands × rows = num_perm 的组合中，选择相似度恰好为threshold的两条数据成为候选的概率
+    不低于min_recall、且每段行数最多（候选最少）的一组
+
+    分桶只负责召回，误检的候选由签名一致率核对剔除，所以优先保证阈值附近的召回率
+    （按漏检、误检概率之和选择时，64位签名在阈值0.8下会选到4×16，S曲线中点约0.92，0.8~0.9的重复大多漏检）
+    """
+    best = (num_perm, 1)
+    for bands in range(num_perm, 0, -1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        probability = 1 - (1 - threshold ** rows) ** bands  # 相似度为threshold的两条数据落入同一个桶的概率
+        if probability >= min_recall:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 42):
+        """
+        Args:
+            num_perm: 签名长度（哈希函数个数）
+            shingle_size: 字符n-gram的长度，中文文本3~5比较合适
+            seed: 生成哈希参数的随机数种子，比较的签名必须来自相同的参数
+        """
+        if np is None:
+            raise ImportError("近似重复检测需要numpy，请先 pip install numpy")
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # 乘移位哈希 ((a*x + b) mod 2^64) >> 32，a取奇数
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        self.powers = np.array([pow(1000003, shingle_size - 1 - i, 2 ** 64) for i in range(shingle_size)],
+                               dtype=np.uint64)
+
+    def normalize(self, text: str) -> str:
+        """去掉空白，不足一个n-gram的短文本补齐"""
+        text = "".join(text.split())
+        return text + "\0" * (self.shingle_size - len(text)) if len(text) < self.shingle_size else text
+
+    def shingle_hashes(self, texts: List[str]) -> Tuple["np.ndarray", "np.ndarray"]:
+        """一批规范化文本的字符n-gram哈希(32位)，返回(所有哈希拼接的数组, 每条文本的n-gram数)
+
+        整批文本拼接后一次计算滚动哈希，再去掉跨越两条文本边界的窗口
+        """
+        k = self.shingle_size
+        lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+        codes = np.frombuffer(("".join(texts) + "\0" * (k - 1)).encode("utf-32-le"), dtype=np.uint32)
+        windows = np.lib.stride_tricks.sliding_window_view(codes.astype(np.uint64), k)[:int(lengths.sum())]
+        starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        valid = np.arange(len(windows)) - starts <= np.repeat(lengths - k, lengths)
+        with np.errstate(over="ignore"):
+            hashes = windows[valid] @ self.powers
+            return (hashes * np.uint64(_GOLDEN_MULTIPLIER)) >> np.uint64(32), lengths - k + 1
+
+    def signatures(self, texts: Iterable[str]) -> "np.ndarray":
+        """批量计算签名，返回形状为 (文本数, num_perm) 的uint32数组"""
+        texts = [self.normalize(text) for text in texts]
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        start = 0
+        while start < len(texts):
+            # 凑一批总n-gram数不超过CHUNK_SHINGLES的文本（单条超长文本单独成批）
+            end, total = start, 0
+            while end < len(texts) and (end == start or total + len(texts[end]) <= CHUNK_SHINGLES):
+                total += len(texts[end])
+                end += 1
+            values, counts = self.shingle_hashes(texts[start:end])
+            offsets = np.cumsum(counts) - counts
+            with np.errstate(over="ignore"):
+                hashed = (self.a[:, None] * values[None, :] + self.b[:, None]) >> np.uint64(32)
+            result[start:end] = np.minimum.reduceat(hashed, offsets, axis=1).T
+            start = end
+        return result
+
+    def signature(self, text: str) -> "np.ndarray":
+        return self.signatures([text])[0]
+
+
+def band_keys(signatures: "np.ndarray", bands: int, rows: int) -> "np.ndarray":
+    """每个分段的签名压缩成一个64位桶键，返回形状为 (文本数, bands) 的数组"""
+    weights = np.random.default_rng(7).integers(1, 2 ** 63, size=rows, dtype=np.uint64) | np.uint64(1)
+    sliced = signatures[:, :bands * rows].astype(np.uint64).reshape(len(signatures), bands, rows)
+    with np.errstate(over="ignore"):
+        return (sliced * weights).sum(axis=2)
+
+
+def _find(parent: "np.ndarray") -> "np.ndarray":
+    """并查集路径压缩：反复跳到父节点直到收敛"""
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent
+        parent = grand
+
+
+def find_near_duplicates(signatures: "np.ndarray", threshold: float = 0.8,
+                         bands: int = None, rows: int = None) -> "np.ndarray":
+    """对签名矩阵做LSH聚类，返回每行所属簇中最小的行号（等于自身行号的行是该簇保留的那一条）"""
+    n = len(signatures)
+    if bands is None or rows is None:
+        bands, rows = choose_bands(signatures.shape[1], threshold)
+    parent = np.arange(n)
+    if n < 2:
+        return parent
+    keys = band_keys(signatures, bands, rows)
+    for band in range(bands):
+        order = np.argsort(keys[:, band], kind="stable")
+        sorted_keys = keys[order, band]
+        same = np.concatenate([[False], sorted_keys[1:] == sorted_keys[:-1]])
+        if not same.any():
+            continue
+        # 同一个桶里的每一条都和桶中第一条核对签名一致率
+        run_start = np.maximum.accumulate(np.where(same, 0, np.arange(n)))
+        members = order[same]
+        heads = order[run_start[same]]
+        similar = (signatures[members] == signatures[heads]).mean(axis=1) >= threshold
+        members, heads = members[similar], heads[similar]
+        while len(members):
+            # 把两个节点的根合并到较小的行号上，直到所有候选对的根相同
+            parent = _find(parent)
+            root_m, root_h = parent[members], parent[heads]
+            differ = root_m != root_h
+            if not differ.any():
+                break
+            low = np.minimum(root_m[differ], root_h[differ])
+            high = np.maximum(root_m[differ], root_h[differ])
+            np.minimum.at(parent, high, low)
+            members, heads = members[differ], heads[differ]
+    return _find(parent)
+
+
+class NearDuplicateIndex:
+    """增量的LSH索引，供生成脚本在线过滤近似重复的样本"""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = DEFAULT_NUM_PERM,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE, field: str = "both"):
+        self.threshold = threshold
+        self.field = field
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self.buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self.count = 0
+        self.rejected = 0
+
+    def query(self, text: str, signature: "np.ndarray" = None) -> Optional[int]:
+        """返回索引中与text近似重复的数据编号，没有则返回None"""
+        if signature is None:
+            signature = self.hasher.signature(text)
+        keys = band_keys(signature[None, :], self.bands, self.rows)[0]
+        candidates = set()
+        for band, key in enumerate(keys.tolist()):
+            candidates.update(self.buckets[band].get(key, ()))
+        if not candidates:
+            return None
+        candidates = np.fromiter(candidates, dtype=np.int64)
+        similarity = (self.signatures[candidates] == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        return int(candidates[best]) if similarity[best] >= self.threshold else None
+
+    def add(self, text: str) -> bool:
+        """text与已有数据都不近似时加入索引并返回True，否则返回False"""
+        signature = self.hasher.signature(text)
+        if self.query(text, signature) is not None:
+            self.rejected += 1
+            return False
+        self._insert(signature[None, :])
+        return True
+
+    def add_item(self, item: Dict) -> bool:
+        """按field取出对话文本后调用add"""
+        return self.add(dialogue_text(item, self.field))
+
+    def _insert(self, signatures: "np.ndarray"):
+        if self.count + len(signatures) > len(self.signatures):
+            # 按倍数扩容，避免每次插入都复制整个数组
+            capacity = max(1024, 2 * (self.count + len(signatures)))
+            grown = np.empty((capacity, self.signatures.shape[1]), dtype=np.uint32)
+            grown[:self.count] = self.signatures[:self.count]
+            self.signatures = grown
+        keys = band_keys(signatures, self.bands, self.rows)
+        for offset, row in enumerate(keys.tolist()):
+            for band, key in enumerate(row):
+                self.buckets[band].setdefault(key, []).append(self.count + offset)
+        self.signatures[self.count:self.count + len(signatures)] = signatures
+        self.count += len(signatures)
+
+    def index_jsonl(self, filepath: str, batch_size: int = 10000) -> int:
+        """把已有的JSONL数据全部加入索引（不做过滤），用于断点续跑，返回加入的条数"""
+        if not os.path.exists(filepath):
+            return 0
+        added = 0
+        for batch in iter_batches(filepath, batch_size):
+            self._insert(self.hasher.signatures([dialogue_text(item, self.field) for item in batch]))
+            added += len(batch)
+        return added
+
+    def __len__(self):
+        return self.count
+
+
+def get_near_dup_gate() -> Optional[NearDuplicateIndex]:
+    """根据环境变量创建在线过滤用的索引
+
+    BAILIAN_NEAR_DUP_THRESHOLD: 相似度阈值(0~1)，未设置时不过滤
+    BAILIAN_NEAR_DUP_FIELD: 比较的内容，user、assistant或both（默认）
+    """
+    threshold = os.getenv("BAILIAN_NEAR_DUP_THRESHOLD")
+    if not threshold:
+        return None
+    return NearDuplicateIndex(float(threshold), field=os.getenv("BAILIAN_NEAR_DUP_FIELD", "both"))
+
+
+def iter_batches(filepath: str, batch_size: int) -> Iterable[List[Dict]]:
+    """逐批读取JSONL文件"""
+    batch = []
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def dedup_jsonl(input_file: str, output_file: str = None, threshold: float = 0.8, field: str = "both",
+                num_perm: int = DEFAULT_NUM_PERM, shingle_size: int = DEFAULT_SHINGLE_SIZE,
+                batch_size: int = 10000) -> Dict:
+    """离线近似去重：第一遍只计算签名，聚类后第二遍把每个簇的第一条写入output_file"""
+    hasher = MinHasher(num_perm, shingle_size)
+    signatures = [hasher.signatures([dialogue_text(item, field) for item in batch])
+                  for batch in iter_batches(input_file, batch_size)]
+    signatures = np.concatenate(signatures) if signatures else np.empty((0, num_perm), dtype=np.uint32)
+    clusters = find_near_duplicates(signatures, threshold)
+    keep = clusters == np.arange(len(clusters))
+
+    if output_file:
+        with open(input_file, "r", encoding="utf-8") as src, open(output_file, "w", encoding="utf-8") as dst:
+            index = 0
+            for line in src:
+                if not line.strip():
+                    continue
+                if keep[index]:
+                    dst.write(line.rstrip("\n") + "\n")
+                index += 1
+
+    sizes = np.bincount(clusters, minlength=len(clusters))
+    return {
+        "total": int(len(clusters)),
+        "kept": int(keep.sum()),
+        "removed": int(len(clusters) - keep.sum()),
+        "duplicate_clusters": int((sizes > 1).sum()),
+        "largest_cluster": int(sizes.max()) if len(sizes) else 0,
+    }
+
+
+def shingle_jaccard(a: str, b: str, shingle_size: int = DEFAULT_SHINGLE_SIZE) -> float:
+    """两段文本字符n-gram集合的精确Jaccard相似度"""
+    set_a = {a[i:i + shingle_size] for i in range(len(a) - shingle_size + 1)}
+    set_b = {b[i:i + shingle_size] for i in range(len(b) - shingle_size + 1)}
+    return len(set_a & set_b) / len(set_a | set_b) if set_a | set_b else 1.0
+
+
+def recall_check(threshold: float = 0.8, num_perm: int = DEFAULT_NUM_PERM,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE, pairs: int = 400, length: int = 300,
+                 seed: int = 0) -> Dict[str, Tuple[int, int]]:
+    """用合成的文本对检查召回率：随机汉字文本逐个替换字符，直到与原文的精确Jaccard相似度降到目标值附近，
+    再看NearDuplicateIndex（分桶 + 签名核对）能否认出这一对。返回 相似度区间 -> (检出数, 总数)"""
+    rng = np.random.default_rng(seed)
+    edges = [threshold + (1 - threshold) * i / 4 for i in range(5)]
+    report = {f"{low:.2f}~{high:.2f}": [0, 0] for low, high in zip(edges, edges[1:])}
+    for _ in range(pairs):
+        base = "".join(chr(c) for c in rng.integers(0x4E00, 0x9FA5, size=length))
+        target = rng.uniform(threshold, 1)
+        chars = list(base)
+        while True:
+            position = int(rng.integers(length))
+            previous = chars[position]
+            chars[position] = chr(int(rng.integers(0x4E00, 0x9FA5)))
+            if shingle_jaccard(base, "".join(chars), shingle_size) < target:
+                chars[position] = previous  # 保留最后一个不低于目标值的版本
+                break
+        variant = "".join(chars)
+        similarity = shingle_jaccard(base, variant, shingle_size)
+        if similarity >= 1 or similarity < threshold:
+            continue
+        index = NearDuplicateIndex(threshold, num_perm, shingle_size)
+        index.add(base)
+        found = index.query(variant) is not None
+        for (low, high), name in zip(zip(edges, edges[1:]), report):
+            if low <= similarity < high:
+                report[name][0] += int(found)
+                report[name][1] += 1
+    return {name: tuple(counts) for name, counts in report.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONL对话数据的近似重复检测")
+    parser.add_argument("input", nargs="?", help="输入的JSONL文件")
+    parser.add_argument("--output", help="去重后的输出文件，不指定时只输出统计")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Jaccard相似度阈值")
+    parser.add_argument("--field", choices=["user", "assistant", "both"], default="both", help="参与比较的轮次")
+    parser.add_argument("--num-perm", type=int, default=DEFAULT_NUM_PERM, help="MinHash签名长度")
+    parser.add_argument("--shingle-size", type=int, default=DEFAULT_SHINGLE_SIZE, help="字符n-gram长度")
+    parser.add_argument("--recall-check", action="store_true", help="用合成的相似文本对检查阈值附近的召回率")
+    args = parser.parse_args()
+
+    if args.recall_check:
+        bands, rows = choose_bands(args.num_perm, args.threshold)
+        print(f"分桶: {bands} 段 × {rows} 行，S曲线中点约 {(1 / bands) ** (1 / rows):.2f}")
+        for name, (found, total) in recall_check(args.threshold, args.num_perm, args.shingle_size).items():
+            print(f"  Jaccard {name}: 检出 {found}/{total}" + (f" ({found / total * 100:.0f}%)" if total else ""))
+        return
+    if not args.input:
+        parser.error("需要指定输入的JSONL文件")
+
+    report = dedup_jsonl(args.input, args.output, args.threshold, args.field, args.num_perm, args.shingle_size)
+    print(f"总数据量: {report['total']} 条")
+    print(f"近似重复: {report['removed']} 条，分布在 {report['duplicate_clusters']} 个簇中（最大的簇 {report['largest_cluster']} 条）")
+    print(f"保留: {report['kept']} 条")
+    if args.output:
+        print(f"去重结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
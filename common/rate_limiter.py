@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+令牌桶限流器
+同时限制每分钟请求数(RPM)和每分钟token数(TPM)，可通过锁文件在多个进程间共享额度
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# 默认额度，可通过环境变量覆盖
+DEFAULT_RPM = 300
+DEFAULT_TPM = 500000
+DEFAULT_STATE_FILE = os.path.join(tempfile.gettempdir(), "bailian_rate_limit.json")
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int = 0) -> int:
+    """粗略估算一次请求消耗的token数（中文约1字1token，按上限预留输出）"""
+    prompt_tokens = sum(len(msg.get("content") or "") for msg in messages)
+    return prompt_tokens + max_tokens
+
+
+class TokenBucketRateLimiter:
+    def __init__(self, requests_per_minute: int = DEFAULT_RPM, tokens_per_minute: int = DEFAULT_TPM,
+                 state_file: str = None):
+        """
+        Args:
+            requests_per_minute: 每分钟允许的请求数
+            tokens_per_minute: 每分钟允许的token数
+            state_file: 共享状态文件路径，为None时仅在当前进程内限流
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.state_file = state_file
+        self._thread_lock = threading.Lock()
+        # 初始为满桶
+        self._state = {
+            "requests": float(requests_per_minute),
+            "tokens": float(tokens_per_minute),
+            "updated": time.time(),
+        }
+
+    def _refill(self, state: Dict, now: float) -> Dict:
+        """按流逝时间补充令牌"""
+        elapsed = max(0.0, now - state["updated"])
+        state["requests"] = min(self.requests_per_minute,
+                                state["requests"] + elapsed * self.requests_per_minute / 60)
+        state["tokens"] = min(self.tokens_per_minute,
+                              state["tokens"] + elapsed * self.tokens_per_minute / 60)
+        state["updated"] = now
+        return state
+
+    def _update_state(self, update) -> float:
+        """在锁保护下读取状态、执行update并写回，返回update的结果"""
+        with self._thread_lock:
+            if not self.state_file:
+                return update(self._refill(self._state, time.time()))
+
+            with open(self.state_file, "a+", encoding="utf-8") as f:
+                self._lock_file(f)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    try:
+                        state = json.loads(content) if content else dict(self._state)
+                    except json.JSONDecodeError:
+                        state = dict(self._state)
+                    result = update(self._refill(state, time.time()))
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                    return result
+                finally:
+                    self._unlock_file(f)
+
+    @staticmethod
+    def _lock_file(f):
+        if os.name == "nt":
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    return
+                except OSError:
+                    # LK_LOCK重试10次后仍失败会抛出异常，继续等待
+                    time.sleep(0.05)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    @staticmethod
+    def _unlock_file(f):
+        if os.name == "nt":
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _try_acquire(self, tokens: int) -> float:
+        """尝试扣除额度，成功返回0，否则返回需要等待的秒数"""
+        # 单次请求超过桶容量时按满桶计算，避免永远等待
+        tokens = min(tokens, self.tokens_per_minute)
+
+        def update(state):
+            if state["requests"] >= 1 and state["tokens"] >= tokens:
+                state["requests"] -= 1
+                state["tokens"] -= tokens
+                return 0.0
+            request_wait = (1 - state["requests"]) * 60 / self.requests_per_minute
+            token_wait = (tokens - state["tokens"]) * 60 / self.tokens_per_minute
+            return max(request_wait, token_wait, 0.01)
+
+        return self._update_state(update)
+
+    def acquire(self, tokens: int = 0):
+        """阻塞直到额度足够，然后扣除一次请求和指定的token数"""
+        while True:
+            wait_time = self._try_acquire(tokens)
+            if wait_time <= 0:
+                return
+            time.sleep(wait_time)
+
+    async def acquire_async(self, tokens: int = 0):
+        """acquire的异步版本，等待时不阻塞事件循环"""
+        while True:
+            wait_time = self._try_acquire(tokens)
+            if wait_time <= 0:
+                return
+            await asyncio.sleep(wait_time)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """用实际消耗的token数修正预估值，多退少补"""
+        if actual_tokens is None:
+            return
+        diff = estimated_tokens - actual_tokens
+
+        def update(state):
+            state["tokens"] = min(self.tokens_per_minute, state["tokens"] + diff)
+
+        self._update_state(update)
+
+
+_shared_limiter = None
+
+
+def get_shared_rate_limiter() -> TokenBucketRateLimiter:
+    """获取进程间共享的限流器，额度通过环境变量配置
+
+    BAILIAN_RPM: 每分钟请求数，默认300
+    BAILIAN_TPM: 每分钟token数，默认500000
+    BAILIAN_RATE_LIMIT_FILE: 共享状态文件，默认位于系统临时目录
+    """
+    global _shared_limiter
+    if _shared_limiter is None:
+        _shared_limiter = TokenBucketRateLimiter(
+            requests_per_minute=int(os.getenv("BAILIAN_RPM", DEFAULT_RPM)),
+            tokens_per_minute=int(os.getenv("BAILIAN_TPM", DEFAULT_TPM)),
+            state_file=os.getenv("BAILIAN_RATE_LIMIT_FILE", DEFAULT_STATE_FILE),
+        )
+    return _shared_limiter
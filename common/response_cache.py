@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM响应缓存
+以(model, messages, temperature, top_p, max_tokens, seed)的哈希为键，把响应保存在SQLite中，
+重复运行相同的请求时直接返回缓存结果，不再调用API。超过容量上限时按最近最少使用淘汰
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+DEFAULT_MAX_MB = 512
+
+
+class ResponseCache:
+    def __init__(self, db_path: str, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        """
+        Args:
+            db_path: SQLite数据库文件路径
+            max_bytes: 缓存内容总大小上限，超过后淘汰最久未访问的条目
+        """
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 多个进程可能同时读写同一个缓存文件，给足等待锁的时间
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+        # 缓存内容总大小只在启动时统计一次，之后随写入和淘汰增减
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict], temperature: float = None, top_p: float = None,
+                 max_tokens: int = None, seed: int = None, n: int = 1) -> str:
+        """计算请求参数的内容哈希"""
+        params = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+            "seed": seed,
+        }
+        if n != 1:
+            # 只在多候选时加入n，保持单候选请求的键不变
+            params["n"] = n
+        payload = json.dumps(params, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存的响应，未命中返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str):
+        """写入响应，必要时淘汰旧条目"""
+        if response is None:
+            return
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._conn.commit()
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """总大小超过上限时，按最近最少使用淘汰到上限的90%"""
+        # 其他进程可能也在写同一个缓存文件，淘汰前重新统计一次实际大小
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9
+            evicted = []
+            for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                if total <= target:
+                    break
+                evicted.append((key,))
+                total -= size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            self._conn.commit()
+        self._total_bytes = total
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_shared_cache = None
+
+
+def get_response_cache(default_path: str = None) -> Optional[ResponseCache]:
+    """获取共享的响应缓存
+
+    BAILIAN_CACHE_DB: 缓存数据库路径，设置为空字符串可关闭缓存；未设置时使用default_path，
+        default_path也为None则不启用缓存
+    BAILIAN_CACHE_MAX_MB: 缓存容量上限(MB)，默认512
+    """
+    global _shared_cache
+    db_path = os.getenv("BAILIAN_CACHE_DB", default_path)
+    if not db_path:
+        return None
+    if _shared_cache is None or _shared_cache.db_path != db_path:
+        max_mb = int(os.getenv("BAILIAN_CACHE_MAX_MB", DEFAULT_MAX_MB))
+        _shared_cache = ResponseCache(db_path, max_bytes=max_mb * 1024 * 1024)
+    return _shared_cache
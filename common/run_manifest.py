@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成任务的运行清单
+记录已经完成的生成槽位（如(类别, 场景, 序号)），进程中断后重新运行时跳过这些槽位，只补齐缺失的部分
+"""
+
+import json
+import os
+from typing import Iterable, Set, Tuple
+
+
+class RunManifest:
+    def __init__(self, filepath: str, resume: bool = True):
+        """
+        Args:
+            filepath: 清单文件路径，每行一个JSON数组表示一个已完成的槽位
+            resume: 为False时清空已有清单，从头开始
+        """
+        self.filepath = filepath
+        self.done: Set[Tuple] = set()
+
+        if resume and os.path.exists(filepath):
+            with open(filepath, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self.done.add(tuple(json.loads(line)))
+                    except json.JSONDecodeError:
+                        # 中断时可能留下写了一半的最后一行，忽略即可
+                        continue
+
+        self._file = open(filepath, 'a' if resume else 'w', encoding='utf-8')
+
+    def __contains__(self, slot: Iterable) -> bool:
+        return tuple(slot) in self.done
+
+    def __len__(self) -> int:
+        return len(self.done)
+
+    def mark_done(self, slot: Iterable):
+        """记录一个已完成的槽位，立即落盘"""
+        slot = tuple(slot)
+        self.done.add(slot)
+        self._file.write(json.dumps(list(slot), ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def truncate_output(self, output_file: str):
+        """把输出文件截断到清单记录的条数
+
+        样本先写入输出文件再记入清单，若进程恰好在两者之间中断，输出文件末尾会多出
+        未登记的样本（或写了一半的行），截断后两者重新一一对应，避免恢复时产生重复数据。
+        """
+        if not os.path.exists(output_file):
+            return
+        keep = len(self.done)
+        offset = 0
+        with open(output_file, 'rb') as f:
+            for _ in range(keep):
+                line = f.readline()
+                if not line:
+                    break
+                offset += len(line)
+        if offset < os.path.getsize(output_file):
+            with open(output_file, 'r+b') as f:
+                f.truncate(offset)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式（SSE）请求与提前中止
+stream_completion 以 stream=True 发起请求，边接收边把增量文本交给校验器；任何一个校验器判定
+这次生成注定不合格（例如前N个token内没有出现<think>、没有提到QCM术语）时立即关闭连接，
+服务端随之停止生成，省下剩余的等待时间和输出token
+"""
+
+import os
+from typing import Iterable, List, NamedTuple, Optional
+
+from common.token_budget import count_tokens
+
+
+class StreamResult(NamedTuple):
+    content: str
+    finish_reason: Optional[str]
+    usage: object  # 服务端返回的usage（请求include_usage时），提前中止时为None
+    tokens: int  # 本地估算的已接收token数
+    aborted: Optional[str]  # 提前中止的原因，正常结束时为None
+
+
+class StreamValidator:
+    """增量校验器：在前limit个token内等待needles中的任意一个出现，超过limit仍未出现时中止生成
+
+    每次只检查新收到的增量加上上一次末尾的一小段（最长needle的长度减1，覆盖跨块的needle），
+    不会随着回复变长反复扫描已经检查过的文本
+    """
+
+    reason = "校验未通过"
+
+    def __init__(self, needles: Iterable[str], limit: int):
+        self.needles = list(needles)
+        self.limit = limit
+        self.passed = False
+        self.keep = max(len(needle) for needle in self.needles) - 1
+        self.tail = ""
+
+    def matched(self, text: str) -> bool:
+        return any(needle in text for needle in self.needles)
+
+    def feed(self, delta: str, tokens: int) -> Optional[str]:
+        """传入新收到的增量文本和目前为止的token数，返回中止原因，无需中止时返回None"""
+        if self.passed:
+            return None
+        window = self.tail + delta
+        if self.matched(window):
+            self.passed = True
+            return None
+        self.tail = window[max(0, len(window) - self.keep):] if self.keep else ""
+        if tokens >= self.limit:
+            return f"{self.reason}（前{self.limit}个token）"
+        return None
+
+    def finish(self, text: str) -> Optional[str]:
+        """生成正常结束时对完整文本的最终校验"""
+        if self.passed or self.matched(text):
+            return None
+        return self.reason
+
+
+class ThinkBlockValidator(StreamValidator):
+    """要求回复在前limit个token内打开<think>块"""
+
+    reason = "没有出现<think>思考块"
+
+    def __init__(self, limit: int):
+        super().__init__(["<think>"], limit)
+
+
+class TermValidator(StreamValidator):
+    """要求回复在前limit个token内提到terms中的任意一个"""
+
+    reason = "没有提到指定术语"
+
+    def __init__(self, terms: Iterable[str], limit: int):
+        super().__init__(terms, limit)
+
+
+def first_abort(validators: List[StreamValidator], delta: str, tokens: int) -> Optional[str]:
+    for validator in validators:
+        reason = validator.feed(delta, tokens)
+        if reason:
+            return reason
+    return None
+
+
+def stream_completion(client, validators: List[StreamValidator] = (), **params) -> StreamResult:
+    """流式调用chat.completions.create，params与非流式调用相同（只支持n=1）"""
+    stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **params)
+    parts = []  # 增量文本，结束或中止时一次拼接
+    tokens = 0
+    finish_reason = None
+    usage = None
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta.content if choice.delta else None
+            if delta:
+                parts.append(delta)
+                tokens += count_tokens(delta)
+                reason = first_abort(validators, delta, tokens)
+                if reason:
+                    return StreamResult("".join(parts), None, None, tokens, reason)
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+    finally:
+        # 提前中止时关闭连接，服务端停止生成
+        stream.close()
+    text = "".join(parts)
+    # 被截断的回复交给续写处理，不在这里判定不合格
+    if finish_reason != "length":
+        for validator in validators:
+            reason = validator.finish(text)
+            if reason:
+                return StreamResult(text, finish_reason, usage, tokens, reason)
+    return StreamResult(text, finish_reason, usage, tokens, None)
+
+
+def streaming_enabled() -> bool:
+    """设置环境变量BAILIAN_STREAM=1后，各生成脚本使用流式请求并启用提前中止"""
+    return os.getenv("BAILIAN_STREAM", "").lower() in ("1", "true", "yes")
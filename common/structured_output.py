@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结构化输出解析
+JSON模式下模型按约定的JSON返回字段；模型没有遵守格式时，退回到宽松的标签解析：
+兼容全角/半角冒号、Markdown加粗和标题、【】括号以及字段顺序颠倒。
+ParseStats 统计各种解析结果，用于评估每次API调用平均能得到多少条有效样本
+
+用法:
+    python -m common.structured_output --check
+"""
+
+import argparse
+import json
+import re
+from collections import Counter
+from typing import Dict, List
+
+# ```json ... ``` 代码块
+CODE_FENCE = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL)
+
+
+def extract_json(text: str):
+    """从回复中提取第一个JSON对象或数组，允许前后有说明文字或代码块包裹，提取失败返回None"""
+    if not text:
+        return None
+    candidates = [match.group(1) for match in CODE_FENCE.finditer(text)] + [text]
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        candidate = candidate.strip()
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            pass
+        # 跳过开头的说明文字，从第一个{或[开始解码
+        for start, char in enumerate(candidate):
+            if char in "{[":
+                try:
+                    return decoder.raw_decode(candidate, start)[0]
+                except ValueError:
+                    continue
+    return None
+
+
+class LabelParser:
+    """宽松的"标签：内容"解析器，把回复中的各段按标签映射到字段"""
+
+    def __init__(self, labels: Dict[str, List[str]]):
+        """
+        Args:
+            labels: 字段名 -> 可接受的标签列表，如 {"question": ["员工问题", "用户问题"]}，
+                长标签优先匹配。标签应足够具体，避免与回答正文中的小标题混淆
+        """
+        self.fields = list(labels)
+        self.field_of = {}
+        for field, names in labels.items():
+            for name in names:
+                self.field_of[name] = field
+        alternatives = "|".join(re.escape(name) for name in sorted(self.field_of, key=len, reverse=True))
+        # 行首可以有空白、#、*、>、-、【、[，标签后可以有*、】、]，冒号全角半角均可
+        self.pattern = re.compile(
+            rf'^[ \t>#*\-【\[]*({alternatives})[ \t*】\]]*[：:][ \t*]*', re.MULTILINE
+        )
+
+    def parse(self, text: str) -> Dict[str, str]:
+        """返回解析到的字段，同一字段出现多次时取第一次，多行内容合并为一行
+
+        最后一个尚未出现的字段开始后不再切分，其后的全部文本都作为该字段的值，
+        回答正文中形如"问题：""回答："的小标题不会截断回答
+        """
+        fields = {}
+        matches = list(self.pattern.finditer(text or ""))
+        for i, match in enumerate(matches):
+            field = self.field_of[match.group(1)]
+            if field in fields:
+                continue
+            last = len(fields) + 1 == len(self.fields)
+            end = len(text) if last or i + 1 == len(matches) else matches[i + 1].start()
+            content = clean_value(text[match.end():end])
+            if content:
+                fields[field] = content
+                if last:
+                    break
+        return fields
+
+
+def clean_value(value) -> str:
+    """把字段值整理为单行文本，去掉多余的Markdown加粗和包裹的引号"""
+    if not isinstance(value, str):
+        return ""
+    lines = [line.strip() for line in value.strip().strip('*').splitlines()]
+    text = " ".join(line for line in lines if line)
+    return text.strip().strip('"“”').strip()
+
+
+def normalize_record(item, aliases: Dict[str, List[str]]) -> Dict[str, str]:
+    """把JSON对象中的字段按别名映射为标准字段名"""
+    if not isinstance(item, dict):
+        return {}
+    fields = {}
+    for field, names in aliases.items():
+        for name in [field] + list(names):
+            value = clean_value(item.get(name))
+            if value:
+                fields[field] = value
+                break
+    return fields
+
+
+def json_records(data, aliases: Dict[str, List[str]], list_key: str = None) -> List[Dict[str, str]]:
+    """从解析出的JSON中取出记录列表，支持{list_key: [...]}、[...]和单个对象三种形式"""
+    if isinstance(data, dict) and list_key and isinstance(data.get(list_key), list):
+        data = data[list_key]
+    items = data if isinstance(data, list) else [data]
+    return [record for record in (normalize_record(item, aliases) for item in items) if record]
+
+
+class ParseStats:
+    """解析结果计数
+
+    requests: 实际发出的API请求数（含补问和续写）；cached: 命中响应缓存、没有发出请求的次数；
+    json/labels: 按JSON/标签解析成功的记录数；reask: 补问缺失字段成功的记录数；
+    reask_failed: 补问后仍然缺失；failed: 两个字段都没有解析到的回复段。
+    解析结果同时来自实际请求和缓存，每次请求的有效样本数按两者之和计算
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def add(self, key: str, amount: int = 1):
+        self.counts[key] += amount
+
+    @property
+    def accepted(self) -> int:
+        return self.counts["json"] + self.counts["labels"] + self.counts["reask"]
+
+    def summary(self) -> str:
+        counts = self.counts
+        calls = counts["requests"] + counts["cached"]
+        per_request = self.accepted / calls if calls else 0.0
+        return (f"JSON {counts['json']}，标签 {counts['labels']}，补问成功 {counts['reask']}，"
+                f"补问失败 {counts['reask_failed']}，解析失败 {counts['failed']}，"
+                f"API请求 {counts['requests']} 次，缓存命中 {counts['cached']} 次，"
+                f"每次请求有效样本 {per_request:.2f} 条")
+
+
+# 自检用例: (标签, 回复, 期望解析出的字段)
+CHECK_LABELS = {
+    "question": ["员工问题", "员工提问", "用户问题"],
+    "answer": ["助手回答", "助手答复"],
+}
+CHECK_CASES = [
+    ("员工问题：差旅费怎么报销？\n助手回答：按流程提交。",
+     {"question": "差旅费怎么报销？", "answer": "按流程提交。"}),
+    ("**助手回答**：按流程提交。\n**员工问题**：差旅费怎么报销？",
+     {"question": "差旅费怎么报销？", "answer": "按流程提交。"}),
+    # 回答正文中的"问题：""回答："小标题属于回答，不能截断
+    ("员工问题：差旅费怎么报销？\n助手回答：\n1. 登录OA填写报销单\n2. 上传发票\n常见问题：\n"
+     "- 问题：发票丢了怎么办？\n- 回答：联系开票方补开。\n3. 提交审批",
+     {"question": "差旅费怎么报销？",
+      "answer": "1. 登录OA填写报销单 2. 上传发票 常见问题： - 问题：发票丢了怎么办？ - 回答：联系开票方补开。 3. 提交审批"}),
+    # 回答开始后再出现的标签也属于回答
+    ("用户问题：能报销打车费吗？\n助手答复：可以。\n员工问题：示例\n",
+     {"question": "能报销打车费吗？", "answer": "可以。 员工问题：示例"}),
+]
+
+
+def self_check() -> bool:
+    """用CHECK_CASES检查标签解析，返回是否全部通过"""
+    parser = LabelParser(CHECK_LABELS)
+    ok = True
+    for i, (text, expected) in enumerate(CHECK_CASES):
+        actual = parser.parse(text)
+        if actual != expected:
+            print(f"用例 {i} 不一致:\n  期望: {expected}\n  实际: {actual}")
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="结构化输出解析")
+    parser.add_argument("--check", action="store_true", help="运行内置的标签解析用例")
+    args = parser.parse_args()
+
+    if args.check:
+        ok = self_check()
+        print(f"{len(CHECK_CASES)} 个用例全部通过" if ok else "标签解析用例未通过")
+        raise SystemExit(0 if ok else 1)
+    parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
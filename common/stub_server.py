@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地OpenAI兼容桩服务
+实现 /v1/chat/completions、/v1/files、/v1/batches 几个接口，用于在没有网络、不产生费用的情况下
+验证生成脚本（包括批处理模式）的完整流程，以及压测吞吐、重试和并发行为
+
+回复优先从 --replay 指定的响应缓存数据库（生成脚本设置 BAILIAN_CACHE_DB 时记录的真实响应）中
+按请求参数查找，找不到时合成一个能通过解析的回复；--latency/--error-rate/--rate-limit-rate/--rpm
+模拟服务端延迟、5xx错误和429限流；请求带 stream=true 时以SSE分块返回。GET /v1/stub/stats 返回各类请求的计数
+
+用法:
+    python -m common.stub_server --port 8000 --latency 0.5 --error-rate 0.02 --rpm 600
+    然后设置环境变量 BAILIAN_BASE_URL=http://127.0.0.1:8000/v1
+"""
+
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from common.response_cache import ResponseCache
+
+
+def synthesize_reply(messages: List[Dict]) -> str:
+    """根据请求内容合成一个能通过各生成脚本解析的回复"""
+    system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+    user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    if "员工问题" in user:
+        dialogue = ("员工问题：请问这个流程第{i}步具体应该怎么办理？\n"
+                    "助手回答：1. 登录OA系统填写申请表\n2. 上传所需材料\n3. 提交直属领导审批\n4. 等待相关部门处理")
+        match = re.search(r"生成(\d+)组", user)
+        if match:
+            return "\n\n".join(f"对话{i}：\n" + dialogue.format(i=i) for i in range(1, int(match.group(1)) + 1))
+        return dialogue.format(i=1)
+    if "<think>" in system:
+        return ("<think>\n先分析问题的核心要点，再结合常见的管理框架给出可执行的建议。\n</think>\n\n"
+                "建议从目标拆解、责任分工和定期复盘三个方面入手。")
+    return "可以结合量子协同管理(QCM)的量子态工作流和协同纠缠机制，分阶段推进并持续评估效果。"
+
+
+def synthesize_json_reply(messages: List[Dict]) -> str:
+    """JSON模式（response_format=json_object）下合成的回复"""
+    user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    match = re.search(r"生成(\d+)组", user)
+    count = int(match.group(1)) if match else 1
+    dialogues = [{"question": f"请问这个流程第{i}步具体应该怎么办理？",
+                  "answer": "1. 登录OA系统填写申请表\n2. 上传所需材料\n3. 提交直属领导审批\n4. 等待相关部门处理"}
+                 for i in range(1, count + 1)]
+    return json.dumps({"dialogues": dialogues}, ensure_ascii=False)
+
+
+def build_chat_completion(body: Dict, contents: List[str] = None) -> Dict:
+    """按OpenAI格式构造chat.completion响应，contents为None时合成回复"""
+    messages = body.get("messages", [])
+    n = body.get("n", 1) or 1
+    if contents is None:
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        partial = ""
+        if len(messages) >= 2 and messages[-2].get("role") == "assistant":
+            # 续写请求：合成原请求的完整回复，返回已输出部分之后的内容
+            partial = messages[-2].get("content") or ""
+            messages = messages[:-2]
+        reply = synthesize_json_reply(messages) if json_mode else synthesize_reply(messages)
+        contents = [reply[len(partial):] if reply.startswith(partial) else reply] * n
+    # 按1字符1token模拟max_tokens截断
+    max_tokens = body.get("max_tokens")
+    finish_reasons = []
+    for i, content in enumerate(contents):
+        if max_tokens and len(content) > max_tokens:
+            contents[i] = content[:max_tokens]
+            finish_reasons.append("length")
+        else:
+            finish_reasons.append("stop")
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages)
+    completion_tokens = sum(len(content) for content in contents)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reasons[i]}
+            for i, content in enumerate(contents)
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class StubBehavior:
+    """桩服务的响应来源和故障注入配置"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, rpm: int = 0, retry_after: float = 1.0,
+                 replay_db: str = None, seed: int = None):
+        """
+        Args:
+            latency: 每个chat请求的平均延迟(秒)
+            jitter: 延迟的随机波动范围(秒)，实际延迟在 latency±jitter 之间均匀分布
+            error_rate: 随机返回500错误的概率
+            rate_limit_rate: 随机返回429的概率
+            rpm: 每分钟请求数上限，超出后返回429，0表示不限制
+            retry_after: 429响应中Retry-After头的秒数（rpm限流时按窗口实际剩余时间计算）
+            replay_db: 响应缓存数据库路径，命中时回放记录的响应
+            seed: 随机数种子，便于复现压测结果
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.retry_after = retry_after
+        self.replay = ResponseCache(replay_db) if replay_db else None
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_times = collections.deque()
+        self.stats = collections.Counter()
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def check_failure(self) -> Optional[Tuple[int, Dict, Dict]]:
+        """决定本次请求是否注入故障，返回(状态码, 响应体, 额外响应头)，正常时返回None"""
+        now = time.time()
+        with self.lock:
+            if self.rpm:
+                while self.request_times and now - self.request_times[0] >= 60:
+                    self.request_times.popleft()
+                if len(self.request_times) >= self.rpm:
+                    wait = 60 - (now - self.request_times[0])
+                    return 429, {"error": {"message": "Requests rate limit exceeded", "type": "rate_limit_error",
+                                           "code": "rate_limit_exceeded"}}, {"Retry-After": f"{wait:.2f}"}
+                self.request_times.append(now)
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 429, {"error": {"message": "Throttling", "type": "rate_limit_error",
+                                   "code": "rate_limit_exceeded"}}, {"Retry-After": str(self.retry_after)}
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, {"error": {"message": "Internal server error", "type": "server_error",
+                                   "code": "internal_error"}}, {}
+        return None
+
+    def delay(self) -> float:
+        """本次请求的模拟延迟(秒)"""
+        if not self.latency and not self.jitter:
+            return 0.0
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def lookup(self, body: Dict) -> Optional[List[str]]:
+        """按请求参数在回放库中查找记录的响应，key的计算方式与各生成脚本写缓存时一致"""
+        if self.replay is None:
+            return None
+        n = body.get("n", 1) or 1
+        key = ResponseCache.make_key(body.get("model"), body.get("messages", []), body.get("temperature"),
+                                     body.get("top_p"), body.get("max_tokens"), body.get("seed"), n)
+        cached = self.replay.get(key)
+        if cached is None:
+            return None
+        return json.loads(cached) if n > 1 else [cached]
+
+    def complete(self, body: Dict) -> Dict:
+        """构造chat.completion响应，优先回放记录的响应"""
+        contents = self.lookup(body)
+        self.count("replayed" if contents is not None else "synthesized")
+        return build_chat_completion(body, contents)
+
+
+class StubState:
+    """内存中的文件和批处理任务"""
+
+    def __init__(self, behavior: StubBehavior = None):
+        self.behavior = behavior or StubBehavior()
+        self.lock = threading.Lock()
+        self.files: Dict[str, Dict] = {}
+        self.batches: Dict[str, Dict] = {}
+
+    def add_file(self, filename: str, content: bytes, purpose: str) -> Dict:
+        file_id = f"file-{uuid.uuid4().hex}"
+        meta = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[file_id] = {"meta": meta, "content": content}
+        return meta
+
+    def run_batch(self, batch_id: str):
+        """逐行执行批处理输入文件，生成输出文件"""
+        with self.lock:
+            batch = self.batches[batch_id]
+            batch["status"] = "in_progress"
+            input_content = self.files[batch["input_file_id"]]["content"]
+
+        output_lines = []
+        completed = 0
+        for line in input_content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            # 批处理按行注入5xx错误，不模拟延迟和限流
+            with self.behavior.lock:
+                failed = self.behavior.random.random() < self.behavior.error_rate
+            if failed:
+                self.behavior.count("batch_failed")
+                output_lines.append(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": None,
+                    "error": {"code": "internal_error", "message": "Internal server error"},
+                }, ensure_ascii=False))
+                continue
+            output_lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": uuid.uuid4().hex,
+                    "body": self.behavior.complete(request.get("body", {})),
+                },
+                "error": None,
+            }, ensure_ascii=False))
+            completed += 1
+
+        output = self.add_file(f"{batch_id}_output.jsonl", ("\n".join(output_lines) + "\n").encode("utf-8"),
+                               "batch_output")
+        with self.lock:
+            batch.update({
+                "status": "completed",
+                "output_file_id": output["id"],
+                "completed_at": int(time.time()),
+                "request_counts": {"total": len(output_lines), "completed": completed,
+                                   "failed": len(output_lines) - completed},
+            })
+
+
+def parse_multipart(body: bytes, content_type: str) -> Dict[str, Dict]:
+    """解析multipart/form-data请求体，返回 {字段名: {"filename": ..., "content": ...}}"""
+    boundary = content_type.split("boundary=")[1].split(";")[0].strip().strip('"').encode()
+    fields = {}
+    for part in body.split(b"--" + boundary):
+        part = part.strip(b"\r\n")
+        if not part or part == b"--":
+            continue
+        header_block, _, content = part.partition(b"\r\n\r\n")
+        headers = header_block.decode("utf-8", errors="replace")
+        name = filename = None
+        for item in headers.split(";"):
+            item = item.strip()
+            if item.startswith("name="):
+                name = item[5:].strip('"')
+            elif item.startswith("filename="):
+                filename = item[9:].split("\r\n")[0].strip('"')
+        if name:
+            fields[name] = {"filename": filename, "content": content}
+    return fields
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass  # 保持输出安静
+
+    def _send_json(self, payload: Dict, status: int = 200, headers: Dict = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, completion: Dict, request: Dict, chunk_size: int = 4):
+        """以SSE格式分块发送chat.completion，客户端提前断开时停止发送"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        base = {"id": completion["id"], "object": "chat.completion.chunk",
+                "created": completion["created"], "model": completion["model"]}
+
+        def chunk(choices, usage=None):
+            payload = dict(base, choices=choices, **({"usage": usage} if usage else {}))
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        behavior = self.state.behavior
+        try:
+            for choice in completion["choices"]:
+                content = choice["message"]["content"]
+                for start in range(0, len(content), chunk_size):
+                    delta = {"content": content[start:start + chunk_size]}
+                    self.wfile.write(chunk([{"index": choice["index"], "delta": delta, "finish_reason": None}]))
+                    self.wfile.flush()
+                    behavior.count("stream_chunks")
+                self.wfile.write(chunk([{"index": choice["index"], "delta": {},
+                                         "finish_reason": choice["finish_reason"]}]))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self.wfile.write(chunk([], completion["usage"]))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            behavior.count("stream_aborted")
+        self.close_connection = True
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        body = self._read_body()
+
+        if path.endswith("/chat/completions"):
+            behavior = self.state.behavior
+            behavior.count("requests")
+            failure = behavior.check_failure()
+            if failure:
+                status, payload, headers = failure
+                behavior.count("rate_limited" if status == 429 else "errors")
+                self._send_json(payload, status, headers)
+                return
+            delay = behavior.delay()
+            if delay:
+                time.sleep(delay)
+            request = json.loads(body or b"{}")
+            completion = behavior.complete(request)
+            if request.get("stream"):
+                self._send_stream(completion, request)
+            else:
+                self._send_json(completion)
+        elif path.endswith("/files"):
+            fields = parse_multipart(body, self.headers.get("Content-Type", ""))
+            purpose = fields.get("purpose", {}).get("content", b"batch").decode()
+            upload = fields["file"]
+            self._send_json(self.state.add_file(upload["filename"] or "upload.jsonl", upload["content"], purpose))
+        elif path.endswith("/batches"):
+            request = json.loads(body or b"{}")
+            batch_id = f"batch_{uuid.uuid4().hex}"
+            batch = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request.get("endpoint", "/v1/chat/completions"),
+                "input_file_id": request["input_file_id"],
+                "completion_window": request.get("completion_window", "24h"),
+                "status": "validating",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+            with self.state.lock:
+                self.state.batches[batch_id] = batch
+            threading.Thread(target=self.state.run_batch, args=(batch_id,), daemon=True).start()
+            self._send_json(batch)
+        else:
+            self._send_json({"error": {"message": f"unknown path {self.path}"}}, 404)
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[-2:] == ["stub", "stats"]:
+            with self.state.behavior.lock:
+                self._send_json(dict(self.state.behavior.stats))
+        elif len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content":
+            stored = self.state.files.get(parts[-2])
+            if stored is None:
+                self._send_json({"error": {"message": "file not found"}}, 404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(stored["content"])))
+            self.end_headers()
+            self.wfile.write(stored["content"])
+        elif len(parts) >= 2 and parts[-2] == "batches":
+            batch = self.state.batches.get(parts[-1])
+            if batch is None:
+                self._send_json({"error": {"message": "batch not found"}}, 404)
+            else:
+                with self.state.lock:
+                    self._send_json(dict(batch))
+        elif len(parts) >= 2 and parts[-2] == "files":
+            stored = self.state.files.get(parts[-1])
+            if stored is None:
+                self._send_json({"error": {"message": "file not found"}}, 404)
+            else:
+                self._send_json(stored["meta"])
+        else:
+            self._send_json({"error": {"message": f"unknown path {self.path}"}}, 404)
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, behavior: StubBehavior = None) -> ThreadingHTTPServer:
+    """在后台线程启动桩服务，port为0时自动分配端口，返回server对象
+
+    base_url为 f"http://{host}:{server.server_address[1]}/v1"，用完后调用 server.shutdown()
+    """
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(behavior)})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的平均延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机波动范围(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回500错误的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="随机返回429的概率")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟请求数上限，超出返回429，0表示不限制")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="随机429响应的Retry-After秒数")
+    parser.add_argument("--replay", help="回放的响应缓存数据库（BAILIAN_CACHE_DB记录的文件）")
+    parser.add_argument("--seed", type=int, help="故障注入的随机数种子")
+    args = parser.parse_args()
+
+    behavior = StubBehavior(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            rate_limit_rate=args.rate_limit_rate, rpm=args.rpm, retry_after=args.retry_after,
+                            replay_db=args.replay, seed=args.seed)
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(behavior)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"桩服务已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n桩服务已停止")
+    finally:
+        print(f"请求统计: {dict(behavior.stats)}")
+
+
+if __name__ == "__main__":
+    main()
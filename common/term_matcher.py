@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+虚构概念术语库与多模式匹配
+QCM_TERM_REGISTRY 是各脚本共用的术语表：标准术语 -> 回答中可能出现的各种写法。
+TermMatcher 把所有写法编译成一个正则，一次扫描找出文本中出现的全部术语（长的写法优先，
+"协同纠缠机制"不会再被重复计为"协同纠缠"），代替逐个术语做子串查找的循环
+
+用法:
+    python -m common.term_matcher merged_training_data.jsonl --role assistant --positions positions.jsonl
+"""
+
+import argparse
+import json
+import re
+from collections import Counter
+from typing import Dict, Iterator, List, Tuple
+
+# 标准术语 -> 写法（包含标准术语本身），标准术语的顺序即报告中的顺序
+QCM_TERM_REGISTRY: Dict[str, List[str]] = {
+    "量子协同管理": ["量子协同管理"],
+    "QCM": ["QCM"],
+    "量子态工作流": ["量子态工作流"],
+    "协同纠缠机制": ["协同纠缠机制", "协同纠缠", "纠缠机制"],
+    "态势坍塌决策": ["态势坍塌决策", "态势坍塌"],
+    "纠缠度指标": ["纠缠度指标"],
+    "量子化任务分配": ["量子化任务分配"],
+    "量子相干性评估": ["量子相干性评估", "量子相干性"],
+    "多态并行处理": ["多态并行处理"],
+    "量子化绩效测量": ["量子化绩效测量"],
+    "态势观测点": ["态势观测点"],
+    "纠缠强度系数": ["纠缠强度系数"],
+    "量子隧道效应管理": ["量子隧道效应管理"],
+    "协同量子场": ["协同量子场"],
+    "管理态叠加": ["管理态叠加"],
+    "量子信息同步": ["量子信息同步"],
+    "量子化管理": ["量子化管理"],
+}
+
+# 判断问题本身是否带有QCM提示的词根，比术语更宽松
+QCM_TRIGGER_REGISTRY: Dict[str, List[str]] = {
+    "量子协同管理": ["量子协同管理"],
+    "QCM": ["QCM"],
+    "量子态": ["量子态"],
+    "协同纠缠": ["协同纠缠"],
+    "态势坍塌": ["态势坍塌"],
+    "纠缠度": ["纠缠度"],
+}
+
+
+class TermMatcher:
+    def __init__(self, registry: Dict[str, List[str]] = None):
+        """
+        Args:
+            registry: 标准术语 -> 写法列表，默认使用QCM_TERM_REGISTRY
+        """
+        self.registry = registry or QCM_TERM_REGISTRY
+        self.canonical = {}
+        for term, variants in self.registry.items():
+            for variant in [term] + list(variants):
+                self.canonical.setdefault(variant, term)
+        # 正则的分支按顺序尝试，把长的写法放在前面，同一位置优先匹配最长的写法
+        self.variants = sorted(self.canonical, key=len, reverse=True)
+        self.pattern = re.compile("|".join(re.escape(variant) for variant in self.variants))
+
+    def finditer(self, text: str) -> Iterator[Tuple[str, int, int]]:
+        """依次返回文本中出现的(标准术语, 起始位置, 结束位置)，匹配互不重叠"""
+        for match in self.pattern.finditer(text or ""):
+            yield self.canonical[match.group()], match.start(), match.end()
+
+    def find(self, text: str) -> List[str]:
+        """文本中出现的标准术语（去重），按术语表的顺序排列"""
+        found = {term for term, _, _ in self.finditer(text)}
+        return [term for term in self.registry if term in found]
+
+    def contains(self, text: str) -> bool:
+        """文本是否提到任意一个术语"""
+        return self.pattern.search(text or "") is not None
+
+    def count(self, text: str) -> Counter:
+        """每个标准术语在文本中出现的次数"""
+        return Counter(term for term, _, _ in self.finditer(text))
+
+
+QCM_MATCHER = TermMatcher(QCM_TERM_REGISTRY)
+QCM_TRIGGER_MATCHER = TermMatcher(QCM_TRIGGER_REGISTRY)
+
+
+class CorpusScan:
+    """一次扫描JSONL语料得到的术语统计"""
+
+    def __init__(self, matcher: TermMatcher):
+        self.matcher = matcher
+        self.records = 0
+        self.records_with_terms = 0
+        self.occurrences = Counter()  # 术语出现的总次数
+        self.documents = Counter()  # 提到术语的记录数
+
+    def to_dict(self) -> Dict:
+        return {
+            "records": self.records,
+            "records_with_terms": self.records_with_terms,
+            "terms": {
+                term: {"occurrences": self.occurrences[term], "records": self.documents[term]}
+                for term in self.matcher.registry if self.occurrences[term]
+            },
+        }
+
+
+def scan_jsonl(filepath: str, matcher: TermMatcher = QCM_MATCHER, roles: Tuple[str, ...] = ("assistant",),
+               positions_file: str = None) -> CorpusScan:
+    """一次扫描整个JSONL语料，统计每个术语的出现次数和提到它的记录数
+
+    positions_file不为None时，把每一处出现的位置逐行写入该文件
+    """
+    scan = CorpusScan(matcher)
+    out = open(positions_file, 'w', encoding='utf-8') if positions_file else None
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f):
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                scan.records += 1
+                found = set()
+                for msg_index, msg in enumerate(item.get("messages", [])):
+                    if roles and msg.get("role") not in roles:
+                        continue
+                    for term, start, end in matcher.finditer(msg.get("content") or ""):
+                        scan.occurrences[term] += 1
+                        found.add(term)
+                        if out:
+                            out.write(json.dumps({"line": line_no, "message": msg_index, "term": term,
+                                                  "start": start, "end": end}, ensure_ascii=False) + '\n')
+                if found:
+                    scan.records_with_terms += 1
+                    scan.documents.update(found)
+    finally:
+        if out:
+            out.close()
+    return scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="统计JSONL语料中虚构概念术语的出现次数和位置")
+    parser.add_argument("file", help="JSONL文件，每行包含messages")
+    parser.add_argument("--role", action="append", help="只扫描该角色的消息，可重复指定，默认assistant")
+    parser.add_argument("--all-roles", action="store_true", help="扫描所有消息")
+    parser.add_argument("--positions", help="把每一处出现的位置写入该JSONL文件")
+    args = parser.parse_args()
+
+    roles = () if args.all_roles else tuple(args.role or ["assistant"])
+    scan = scan_jsonl(args.file, roles=roles, positions_file=args.positions)
+    report = scan.to_dict()
+    rate = report["records_with_terms"] / report["records"] * 100 if report["records"] else 0
+    print(f"记录数: {report['records']}，提到术语: {report['records_with_terms']} ({rate:.1f}%)")
+    for term, counts in sorted(report["terms"].items(), key=lambda x: x[1]["occurrences"], reverse=True):
+        print(f"  {term}: {counts['occurrences']} 次，{counts['records']} 条记录")
+    if args.positions:
+        print(f"位置已写入: {args.positions}")
+
+
+if __name__ == "__main__":
+    main()
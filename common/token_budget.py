@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按类别估算输出长度，设置每次请求的max_tokens
+TokenBudget 记录每个类别最近若干条回复的token数，取高分位数加余量作为下一次请求的max_tokens：
+回答普遍较长的类别不再被截断，较短的类别也不会预留过多的输出额度。
+被截断（finish_reason == "length"）的回复通过 continuation_messages 续写，而不是整条重新生成
+
+token数优先用dashscope自带的Qwen分词器计算，没有安装dashscope时按字符粗略估算
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, List
+
+try:
+    from dashscope import get_tokenizer
+    _TOKENIZER = get_tokenizer("qwen-turbo")
+except Exception:  # 未安装dashscope或分词器加载失败
+    _TOKENIZER = None
+
+# 汉字、全角标点等按1个token计，其余字符约4个算1个token
+WIDE_CHAR = re.compile(r'[⺀-鿿豈-﫿＀-￯]')
+
+CONTINUE_PROMPT = "请从上次中断的地方继续输出，不要重复已经输出的内容，也不要添加任何说明。"
+
+
+def count_tokens(text: str) -> int:
+    """计算文本的token数"""
+    if not text:
+        return 0
+    if _TOKENIZER is not None:
+        return len(_TOKENIZER.encode(text))
+    wide = len(WIDE_CHAR.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def continuation_messages(messages: List[Dict], partial: str) -> List[Dict]:
+    """构造续写被截断回复的请求消息"""
+    return messages + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_PROMPT}
+    ]
+
+
+class TokenBudget:
+    def __init__(self, default: int, floor: int = 256, ceiling: int = 4096, quantile: float = 0.95,
+                 headroom: float = 1.2, min_samples: int = 20, window: int = 500, step: int = 64,
+                 state_file: str = None):
+        """
+        Args:
+            default: 观测数据不足min_samples条时使用的max_tokens
+            floor/ceiling: max_tokens的上下限
+            quantile: 取观测长度的分位数
+            headroom: 在分位数基础上预留的余量倍数
+            window: 每个类别保留最近多少条观测
+            step: max_tokens向上取整到step的整数倍，使相近的预算得到相同的请求参数，便于命中响应缓存
+            state_file: 观测数据的保存位置，多次运行之间共享，为None时只在本次运行内统计
+        """
+        self.default = default
+        self.floor = floor
+        self.ceiling = ceiling
+        self.quantile = quantile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.window = window
+        self.step = step
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.observations: Dict[str, deque] = {}
+        if state_file and os.path.exists(state_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                for key, values in json.load(f).items():
+                    self.observations[key] = deque(values, maxlen=window)
+
+    def observe(self, key: str, tokens: int, units: int = 1):
+        """记录一条回复的token数，units为回复中包含的样本数（如多组对话），按每个样本的长度记录"""
+        with self.lock:
+            values = self.observations.setdefault(key, deque(maxlen=self.window))
+            values.append(math.ceil(tokens / max(1, units)))
+
+    def observe_text(self, key: str, text: str, units: int = 1):
+        """记录一条回复文本的长度"""
+        if text:
+            self.observe(key, count_tokens(text), units)
+
+    def max_tokens(self, key: str, units: int = 1) -> int:
+        """为包含units个样本的请求计算max_tokens"""
+        with self.lock:
+            values = sorted(self.observations.get(key, ()))
+        if len(values) < self.min_samples:
+            return min(self.ceiling, self.default * units)
+        per_unit = values[min(len(values) - 1, int(len(values) * self.quantile))]
+        budget = math.ceil(per_unit * self.headroom * units / self.step) * self.step
+        return int(min(self.ceiling, max(self.floor, budget)))
+
+    def summary(self) -> Dict[str, Dict]:
+        """各类别的观测条数、平均长度和当前的单样本预算"""
+        with self.lock:
+            keys = list(self.observations)
+        result = {}
+        for key in keys:
+            values = list(self.observations[key])
+            result[key] = {"samples": len(values), "mean": sum(values) // len(values) if values else 0,
+                           "max_tokens": self.max_tokens(key)}
+        return result
+
+    def save(self):
+        """保存观测数据到state_file"""
+        if not self.state_file:
+            return
+        # 多个生成脚本可能共用同一个文件，只覆盖本实例统计过的类别
+        data = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        with self.lock:
+            data.update({key: list(values) for key, values in self.observations.items()})
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, self.state_file)
+
+
+def get_token_budget(default: int, ceiling: int = 4096) -> TokenBudget:
+    """创建各生成脚本使用的TokenBudget，设置BAILIAN_TOKEN_BUDGET_FILE后在多次运行之间共享观测数据"""
+    return TokenBudget(default, ceiling=ceiling, state_file=os.getenv("BAILIAN_TOKEN_BUDGET_FILE") or None)
@@ -5,23 +5,71 @@
 使用百炼API调用qwen-plus模型生成企业流程相关的对话数据
 """
 
+import argparse
+import asyncio
 import json
-import random
+import re
 import time
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import os
-from openai import OpenAI
+import sys
+from openai import RateLimitError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.backend import create_client, create_async_client, retry_delay
+from common.rate_limiter import get_shared_rate_limiter, estimate_tokens
+from common.jsonl_writer import JsonlWriter
+from common.run_manifest import RunManifest
+from common.response_cache import ResponseCache, get_response_cache
+from common.batch_runner import BatchJobRunner
+from common.coverage_sampler import CoverageScheduler
+from common.token_budget import continuation_messages, get_token_budget
+from common.structured_output import LabelParser, ParseStats, clean_value, extract_json, json_records
+
+# 多组对话回复中的编号标记，如"对话1："、"**对话2**"、"### 对话3"
+DIALOGUE_MARKER = re.compile(r'^[ \t#*【\[]*对话[ \t]*\d+[ \t*】\]]*[：:]?[ \t*]*', re.MULTILINE)
+
+# 标签解析时可接受的标签，JSON模式下可接受的字段名
+FIELD_LABELS = {
+    "question": ["员工问题", "员工提问", "用户问题"],
+    "answer": ["助手回答", "助手答复"],
+}
+JSON_FIELD_ALIASES = {
+    "question": ["员工问题", "user", "q"],
+    "answer": ["助手回答", "assistant", "a"],
+}
+
+SYSTEM_PROMPT = "你是一个专业的企业内部流程助手，负责帮助员工处理各种企业内部事务，包括报销、请假、采购、人事、IT、财务、行政、项目等流程。请用专业、友好、详细的方式回答员工的问题。"
 
 # 百炼API配置 - 请替换为您的实际API Key
 DASHSCOPE_API_KEY = "your-api-key-here"  # 请替换为您的百炼API Key
 
 class EnterpriseDataGenerator:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, completions_per_request: int = 1, dialogues_per_request: int = 1,
+                 json_mode: bool = False):
+        """
+        Args:
+            api_key: 百炼API Key
+            completions_per_request: 每次请求返回的候选数(n)，qwen-plus最多支持4
+            dialogues_per_request: 每个回复中生成的对话组数，大于1时提示词要求输出多组编号对话
+            json_mode: 使用JSON模式（response_format=json_object）请求结构化输出
+        """
         self.api_key = api_key
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
+        self.completions_per_request = completions_per_request
+        self.dialogues_per_request = dialogues_per_request
+        self.json_mode = json_mode
+        # JSON解析失败时退回的宽松标签解析器，以及各种解析结果的计数
+        self.label_parser = LabelParser(FIELD_LABELS)
+        self.parse_stats = ParseStats()
+        # 按类别观测的回答长度决定每次请求的max_tokens，数据不足时每组对话800
+        self.token_budget = get_token_budget(800)
+        self.client = create_client(api_key)
+        # 异步客户端，供并发生成模式使用
+        self.async_client = create_async_client(api_key)
+        # RPM/TPM令牌桶限流，替代固定间隔的sleep
+        self.rate_limiter = get_shared_rate_limiter()
+        # 响应缓存（设置BAILIAN_CACHE_DB后启用），重复运行相同槽位时不再调用API
+        self.cache = get_response_cache()
         
         # 企业流程场景模板（扩展到15个类别，180个场景）
         self.enterprise_scenarios = [
@@ -125,45 +173,191 @@ class EnterpriseDataGenerator:
             ]}
         ]
     
-    def save_data_incrementally(self, data: List[Dict], output_file: str):
-        """增量保存数据"""
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for item in data:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
-        print(f"已保存 {len(data)} 条数据到 {output_file}")
+    def build_messages(self, prompt: str) -> List[Dict]:
+        """把生成提示词包装成请求消息"""
+        return [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ]
     
-    def call_qwen_plus_with_retry(self, prompt: str, max_retries: int = 3) -> str:
-        """带重试机制的API调用"""
+    def request_completions(self, prompt: str, max_retries: int = 3, seed: int = None,
+                            n: int = 1, max_tokens: int = 800, json_mode: bool = False) -> List[str]:
+        """带重试机制的API调用，返回n个候选回复，seed用于区分同一场景下的不同样本
+
+        json_mode为True时要求模型返回JSON对象，提示词中需要说明JSON格式
+        """
+        messages = self.build_messages(prompt)
+        cache_key = ResponseCache.make_key("qwen-plus", messages, 0.8, 0.9, max_tokens, seed, n)
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.parse_stats.add("cached")
+                return json.loads(cached) if n > 1 else [cached]
+        estimated = estimate_tokens(messages, max_tokens * n)
         for attempt in range(max_retries):
             try:
+                self.rate_limiter.acquire(estimated)
                 completion = self.client.chat.completions.create(
                     model="qwen-plus",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
+                    messages=messages,
                     temperature=0.8,
                     top_p=0.9,
-                    max_tokens=800
+                    max_tokens=max_tokens,
+                    **({"n": n} if n > 1 else {}),
+                    **({"seed": seed} if seed is not None else {}),
+                    **({"response_format": {"type": "json_object"}} if json_mode else {})
                 )
+                self.parse_stats.add("requests")
+                if completion.usage:
+                    self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
                 
                 if completion.choices and len(completion.choices) > 0:
-                    return completion.choices[0].message.content.strip()
+                    contents = []
+                    for choice in completion.choices:
+                        content = choice.message.content or ""
+                        if choice.finish_reason == "length":
+                            content = self.continue_truncated(messages, content, max_tokens)
+                        contents.append(content.strip())
+                    if self.cache:
+                        self.cache.put(cache_key, json.dumps(contents, ensure_ascii=False) if n > 1 else contents[0])
+                    return contents
                 else:
                     print(f"API返回格式异常: 无有效选择 (尝试 {attempt + 1}/{max_retries})")
+            except RateLimitError as e:
+                # 触发限流时优先遵循服务端给出的 Retry-After
+                wait_time = retry_delay(e, attempt)
+                print(f"API限流 (尝试 {attempt + 1}/{max_retries})，等待 {wait_time:.1f} 秒")
+                if attempt < max_retries - 1:
+                    time.sleep(wait_time)
             except Exception as e:
                 print(f"API调用失败 (尝试 {attempt + 1}/{max_retries}): {e}")
                 if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # 指数退避
-        return ""
+                    time.sleep(retry_delay(e, attempt))  # 指数退避加抖动
+        return []
     
-    def generate_single_conversation(self, scenario: str, category: str) -> Dict:
-        """生成单个对话"""
+    def continue_truncated(self, messages: List[Dict], content: str, max_tokens: int,
+                           max_continuations: int = 2) -> str:
+        """回复因达到max_tokens被截断时，让模型从中断处续写，而不是整条重新生成"""
+        for _ in range(max_continuations):
+            continued = continuation_messages(messages, content)
+            estimated = estimate_tokens(continued, max_tokens)
+            try:
+                self.rate_limiter.acquire(estimated)
+                completion = self.client.chat.completions.create(
+                    model="qwen-plus",
+                    messages=continued,
+                    temperature=0.8,
+                    top_p=0.9,
+                    max_tokens=max_tokens
+                )
+                self.parse_stats.add("requests")
+                if completion.usage:
+                    self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
+            except Exception as e:
+                print(f"续写被截断的回复失败: {e}")
+                break
+            choice = completion.choices[0]
+            content += choice.message.content or ""
+            if choice.finish_reason != "length":
+                break
+        return content
+    
+    async def continue_truncated_async(self, messages: List[Dict], content: str, max_tokens: int,
+                                       max_continuations: int = 2) -> str:
+        """continue_truncated的异步版本"""
+        for _ in range(max_continuations):
+            continued = continuation_messages(messages, content)
+            estimated = estimate_tokens(continued, max_tokens)
+            try:
+                await self.rate_limiter.acquire_async(estimated)
+                completion = await self.async_client.chat.completions.create(
+                    model="qwen-plus",
+                    messages=continued,
+                    temperature=0.8,
+                    top_p=0.9,
+                    max_tokens=max_tokens
+                )
+                self.parse_stats.add("requests")
+                if completion.usage:
+                    self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
+            except Exception as e:
+                print(f"续写被截断的回复失败: {e}")
+                break
+            choice = completion.choices[0]
+            content += choice.message.content or ""
+            if choice.finish_reason != "length":
+                break
+        return content
+    
+    async def request_completions_async(self, prompt: str, max_retries: int = 3, seed: int = None,
+                                        n: int = 1, max_tokens: int = 800, json_mode: bool = False) -> List[str]:
+        """request_completions的异步版本"""
+        messages = self.build_messages(prompt)
+        cache_key = ResponseCache.make_key("qwen-plus", messages, 0.8, 0.9, max_tokens, seed, n)
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.parse_stats.add("cached")
+                return json.loads(cached) if n > 1 else [cached]
+        estimated = estimate_tokens(messages, max_tokens * n)
+        for attempt in range(max_retries):
+            try:
+                await self.rate_limiter.acquire_async(estimated)
+                completion = await self.async_client.chat.completions.create(
+                    model="qwen-plus",
+                    messages=messages,
+                    temperature=0.8,
+                    top_p=0.9,
+                    max_tokens=max_tokens,
+                    **({"n": n} if n > 1 else {}),
+                    **({"seed": seed} if seed is not None else {}),
+                    **({"response_format": {"type": "json_object"}} if json_mode else {})
+                )
+                self.parse_stats.add("requests")
+                if completion.usage:
+                    self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
+                
+                if completion.choices and len(completion.choices) > 0:
+                    contents = []
+                    for choice in completion.choices:
+                        content = choice.message.content or ""
+                        if choice.finish_reason == "length":
+                            content = await self.continue_truncated_async(messages, content, max_tokens)
+                        contents.append(content.strip())
+                    if self.cache:
+                        self.cache.put(cache_key, json.dumps(contents, ensure_ascii=False) if n > 1 else contents[0])
+                    return contents
+                else:
+                    print(f"API返回格式异常: 无有效选择 (尝试 {attempt + 1}/{max_retries})")
+            except RateLimitError as e:
+                # 触发限流时优先遵循服务端给出的 Retry-After
+                wait_time = retry_delay(e, attempt)
+                print(f"API限流 (尝试 {attempt + 1}/{max_retries})，等待 {wait_time:.1f} 秒")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(wait_time)
+            except Exception as e:
+                print(f"API调用失败 (尝试 {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay(e, attempt))  # 指数退避加抖动
+        return []
+    
+    def build_conversation_prompt(self, scenario: str, category: str, dialogue_count: int = 1) -> str:
+        """构造生成对话的提示词，dialogue_count大于1时要求输出多组编号对话"""
+        if self.json_mode:
+            return self.build_json_conversation_prompt(scenario, category, dialogue_count)
+        if dialogue_count > 1:
+            task = f"生成{dialogue_count}组不同的员工咨询和助手回答的对话，各组的员工问题要有明显区别"
+            output_format = "\n".join(
+                f"对话{i}：\n员工问题：[具体问题]\n助手回答：[详细的流程步骤和指导]" for i in range(1, dialogue_count + 1)
+            )
+        else:
+            task = "生成一个员工咨询和助手回答的对话"
+            output_format = "员工问题：[具体问题]\n助手回答：[详细的流程步骤和指导]"
         
         # 构造提示词（优化后，更专注于流程步骤）
-        prompt = f"""你是一个专业的企业内部流程助手，专门负责指导员工完成各种办公流程。
+        return f"""你是一个专业的企业内部流程助手，专门负责指导员工完成各种办公流程。
 
-请基于"{category}-{scenario}"这个业务场景，生成一个员工咨询和助手回答的对话。
+请基于"{category}-{scenario}"这个业务场景，{task}。
 
 具体要求：
 1. 员工问题要真实具体，体现实际工作中的情况
@@ -174,154 +368,387 @@ class EnterpriseDataGenerator:
 6. 回答必须以"流程步骤"为主，不要只是简单的描述
 
 请直接输出员工的问题和助手的回答，格式如下：
-员工问题：[具体问题]
-助手回答：[详细的流程步骤和指导]
+{output_format}
 
 注意：只输出上述格式的内容，不要包含其他说明文字。"""
-
-        response = self.call_qwen_plus_with_retry(prompt)
+    
+    def build_json_conversation_prompt(self, scenario: str, category: str, dialogue_count: int = 1) -> str:
+        """构造JSON模式下的提示词，无论生成几组对话都使用同一个dialogues数组格式"""
+        if dialogue_count > 1:
+            task = f"生成{dialogue_count}组不同的员工咨询和助手回答的对话，各组的员工问题要有明显区别"
+        else:
+            task = "生成一个员工咨询和助手回答的对话"
         
+        return f"""你是一个专业的企业内部流程助手，专门负责指导员工完成各种办公流程。
+
+请基于"{category}-{scenario}"这个业务场景，{task}。
+
+具体要求：
+1. 员工问题要真实具体，体现实际工作中的情况
+2. 助手回答必须包含具体的操作步骤，按照顺序编号
+3. 说明所需材料、申请表格、审批流程、时间节点等
+4. 指出关键注意事项和常见问题
+5. 语言要专业友好，符合中国企业实际情况
+6. 回答必须以"流程步骤"为主，不要只是简单的描述
+
+请以JSON格式输出，dialogues数组中包含{dialogue_count}个对象：
+{{"dialogues": [{{"question": "具体问题", "answer": "详细的流程步骤和指导"}}]}}
+
+注意：只输出JSON，不要包含其他说明文字。"""
+    
+    def build_sample(self, question: str, answer: str) -> Dict:
+        """把员工问题和助手回答组装为训练样本"""
+        return {
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": answer}
+            ]
+        }
+    
+    def extract_records(self, response: str) -> List[Tuple[Dict[str, str], str]]:
+        """把一个回复解析为若干(字段, 解析方式)，字段可能只包含question和answer中的一个
+
+        先尝试JSON，失败时按"对话N"编号拆分后逐段做宽松的标签解析；
+        没有解析到任何字段的回复段以空字段返回，便于计数
+        """
         if not response:
+            return []
+        stripped = response.lstrip()
+        if self.json_mode or stripped.startswith(("{", "[", "```")):
+            data = extract_json(response)
+            if data is not None:
+                records = json_records(data, JSON_FIELD_ALIASES, "dialogues")
+                if records:
+                    return [(record, "json") for record in records]
+        return [(self.label_parser.parse(chunk), "labels") for chunk in self.split_dialogues(response)]
+    
+    def split_dialogues(self, response: str) -> List[str]:
+        """按"对话1："等编号标记把一个回复拆成多段对话，没有编号时整体作为一段"""
+        parts = DIALOGUE_MARKER.split(response)
+        chunks = [part for part in parts[1:] if part.strip()] if len(parts) > 1 else parts
+        return chunks
+    
+    def parse_conversation_responses(self, responses: List[str]) -> Tuple[List[Dict], List[Dict[str, str]]]:
+        """解析多个回复（每个回复可能包含多组对话），返回(完整的训练样本, 只缺一个字段的记录)"""
+        conversations = []
+        partials = []
+        for response in responses:
+            for fields, method in self.extract_records(response):
+                if "question" in fields and "answer" in fields:
+                    conversations.append(self.build_sample(fields["question"], fields["answer"]))
+                    self.parse_stats.add(method)
+                elif fields:
+                    partials.append(fields)
+                else:
+                    self.parse_stats.add("failed")
+        return conversations, partials
+    
+    def build_reask_prompt(self, scenario: str, category: str, fields: Dict[str, str]) -> Tuple[str, str]:
+        """构造只补问缺失字段的提示词，返回(缺失的字段, 提示词)"""
+        if "question" in fields:
+            return "answer", f"""你是一个专业的企业内部流程助手。员工在"{category}-{scenario}"场景下提出了以下问题：
+{fields["question"]}
+
+请给出详细的回答，按顺序编号列出操作步骤，说明所需材料、审批流程、时间节点和注意事项。
+只输出回答内容，不要重复问题，不要包含其他说明文字。"""
+        return "question", f"""下面是企业内部流程助手在"{category}-{scenario}"场景下给员工的回答：
+{fields["answer"]}
+
+请写出与这个回答对应的、真实具体的员工问题。只输出问题本身，不要包含其他说明文字。"""
+    
+    def fill_missing_field(self, fields: Dict[str, str], field: str, response: str) -> Dict:
+        """用补问的回复补全缺失字段，仍然缺失时返回None"""
+        value = self.label_parser.parse(response).get(field) or clean_value(response)
+        if not value:
+            self.parse_stats.add("reask_failed")
             return None
-            
-        # 解析回复
-        try:
-            lines = response.split('\n')
-            user_content = ""
-            assistant_content = ""
-            
-            current_section = None
-            for line in lines:
-                line = line.strip()
-                if line.startswith("员工问题："):
-                    current_section = "user"
-                    user_content = line.replace("员工问题：", "").strip()
-                elif line.startswith("助手回答："):
-                    current_section = "assistant"
-                    assistant_content = line.replace("助手回答：", "").strip()
-                elif current_section == "user" and line:
-                    user_content += " " + line
-                elif current_section == "assistant" and line:
-                    assistant_content += " " + line
-            
-            if user_content and assistant_content:
-                return {
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": "你是一个专业的企业内部流程助手，负责帮助员工处理各种企业内部事务，包括报销、请假、采购、人事、IT、财务、行政、项目等流程。请用专业、友好、详细的方式回答员工的问题。"
-                        },
-                        {
-                            "role": "user",
-                            "content": user_content
-                        },
-                        {
-                            "role": "assistant",
-                            "content": assistant_content
-                        }
-                    ]
-                }
-            else:
-                return None
-                
-        except Exception as e:
-            print(f"解析回复失败: {e}")
-            print(f"原始回复: {response}")
-            return None
+        self.parse_stats.add("reask")
+        fields = dict(fields, **{field: value})
+        return self.build_sample(fields["question"], fields["answer"])
+    
+    def collect_conversations(self, responses: List[str], scenario: str, category: str,
+                              index: int = None, count: int = 1) -> List[Dict]:
+        """解析回复得到最多count个样本，不足时对只缺一个字段的记录补问缺失字段，而不是重新生成整段对话"""
+        conversations, partials = self.parse_conversation_responses(responses)
+        for fields in partials[:max(0, count - len(conversations))]:
+            field, prompt = self.build_reask_prompt(scenario, category, fields)
+            contents = self.request_completions(prompt, seed=index)
+            conversation = self.fill_missing_field(fields, field, contents[0] if contents else "")
+            if conversation:
+                conversations.append(conversation)
+        return conversations[:count]
+    
+    async def collect_conversations_async(self, responses: List[str], scenario: str, category: str,
+                                          index: int = None, count: int = 1) -> List[Dict]:
+        """collect_conversations的异步版本"""
+        conversations, partials = self.parse_conversation_responses(responses)
+        for fields in partials[:max(0, count - len(conversations))]:
+            field, prompt = self.build_reask_prompt(scenario, category, fields)
+            contents = await self.request_completions_async(prompt, seed=index)
+            conversation = self.fill_missing_field(fields, field, contents[0] if contents else "")
+            if conversation:
+                conversations.append(conversation)
+        return conversations[:count]
+    
+    def request_shape(self, count: int) -> Tuple[int, int]:
+        """根据本次需要的样本数，确定(每个回复的对话组数, 候选数n)，避免末尾请求多余的样本"""
+        dialogue_count = min(self.dialogues_per_request, count)
+        n = min(self.completions_per_request, -(-count // dialogue_count))
+        return dialogue_count, n
+    
+    def generate_conversations(self, scenario: str, category: str, index: int = None, count: int = 1) -> List[Dict]:
+        """一次请求生成最多count个对话，index为第一个样本在该场景下的序号"""
+        dialogue_count, n = self.request_shape(count)
+        prompt = self.build_conversation_prompt(scenario, category, dialogue_count)
+        max_tokens = self.token_budget.max_tokens(category, dialogue_count)
+        responses = self.request_completions(prompt, seed=index, n=n, max_tokens=max_tokens,
+                                             json_mode=self.json_mode)
+        for response in responses:
+            self.token_budget.observe_text(category, response, dialogue_count)
+        return self.collect_conversations(responses, scenario, category, index, count)
     
-    def generate_dataset(self, target_count: int = 200, output_file: str = "enterprise_training_data.jsonl"):
-        """生成完整的数据集"""
-        generated_data = []
+    async def generate_conversations_async(self, scenario: str, category: str, index: int = None,
+                                           count: int = 1) -> List[Dict]:
+        """generate_conversations的异步版本"""
+        dialogue_count, n = self.request_shape(count)
+        prompt = self.build_conversation_prompt(scenario, category, dialogue_count)
+        max_tokens = self.token_budget.max_tokens(category, dialogue_count)
+        responses = await self.request_completions_async(prompt, seed=index, n=n, max_tokens=max_tokens,
+                                                         json_mode=self.json_mode)
+        for response in responses:
+            self.token_budget.observe_text(category, response, dialogue_count)
+        return await self.collect_conversations_async(responses, scenario, category, index, count)
+    
+    def generate_single_conversation(self, scenario: str, category: str, index: int = None) -> Dict:
+        """生成单个对话，index为该场景下的样本序号"""
+        conversations = self.generate_conversations(scenario, category, index)
+        return conversations[0] if conversations else None
+    
+    def create_scheduler(self, manifest: RunManifest) -> CoverageScheduler:
+        """创建覆盖度调度器，运行清单中已完成的槽位计入覆盖"""
+        cells = [(category_info["category"], scenario)
+                 for category_info in self.enterprise_scenarios
+                 for scenario in category_info["scenarios"]]
+        return CoverageScheduler(cells, manifest.done)
+    
+    def show_coverage(self, scheduler: CoverageScheduler):
+        """按类别显示覆盖情况和失败率"""
+        print("\n=== 覆盖情况 ===")
+        for item in scheduler.summary():
+            failure_rate = item["failures"] / item["attempts"] * 100 if item["attempts"] else 0
+            print(f"{item['group']}: {item['filled']} 条，覆盖场景 {item['covered']}/{item['cells']}，"
+                  f"每场景 {item['min']}~{item['max']} 条，失败率 {failure_rate:.1f}%，"
+                  f"每组对话max_tokens {self.token_budget.max_tokens(item['group'])}")
+    
+    def open_run(self, output_file: str, resume: bool, fsync_interval: int) -> Tuple[RunManifest, JsonlWriter]:
+        """打开运行清单和输出文件，resume为True时在上次中断的位置继续"""
+        manifest = RunManifest(output_file + ".manifest", resume=resume)
+        if resume:
+            manifest.truncate_output(output_file)
+            if len(manifest):
+                print(f"从运行清单恢复: 已完成 {len(manifest)} 条，跳过这些槽位")
+        writer = JsonlWriter(output_file, mode="a" if resume else "w", fsync_interval=fsync_interval)
+        writer.count = len(manifest)
+        return manifest, writer
+    
+    def generate_dataset(self, target_count: int = 200, output_file: str = "enterprise_training_data.jsonl",
+                         concurrency: int = 1, fsync_interval: int = 10, resume: bool = True):
+        """生成完整的数据集，concurrency大于1时使用异步并发模式
+
+        已完成的(类别, 场景, 序号)槽位记录在 output_file + ".manifest" 中，
+        resume为True时中断后重新运行只会补齐缺失的槽位
+        """
+        if concurrency > 1:
+            asyncio.run(self.generate_dataset_async(target_count, output_file, concurrency, fsync_interval, resume))
+            return
         
         print(f"开始生成企业流程训练数据，目标数量: {target_count}")
         
-        # 计算每个场景需要生成的数量
-        total_scenarios = sum(len(cat["scenarios"]) for cat in self.enterprise_scenarios)
-        base_count_per_scenario = target_count // total_scenarios
-        
-        for category_info in self.enterprise_scenarios:
-            category = category_info["category"]
-            scenarios = category_info["scenarios"]
-            
-            print(f"\n处理类别: {category}")
-            
-            for scenario in scenarios:
-                print(f"  生成场景: {scenario}")
+        # 每条样本生成后立即追加写入，不在内存中累积
+        manifest, writer = self.open_run(output_file, resume, fsync_interval)
+        scheduler = self.create_scheduler(manifest)
+        samples_per_request = self.completions_per_request * self.dialogues_per_request
+        attempts = 0
+        max_attempts = target_count * 3  # 防止API持续失败时无限重试
+        with manifest, writer:
+            while writer.count < target_count and attempts < max_attempts:
+                # 每次选择覆盖最少、成功率最高的场景，一次请求可以填充多个槽位
+                group = scheduler.acquire(min(samples_per_request, target_count - writer.count))
+                category, scenario, index = group[0]
+                attempts += 1
                 
-                # 每个场景生成多个对话
-                for i in range(base_count_per_scenario + (1 if len(generated_data) < target_count else 0)):
-                    if len(generated_data) >= target_count:
-                        break
-                        
-                    conversation = self.generate_single_conversation(scenario, category)
-                    
-                    if conversation:
-                        generated_data.append(conversation)
-                        print(f"    成功生成第 {len(generated_data)} 条数据")
-                        
-                        # 每生成10条数据自动保存
-                        if len(generated_data) % 10 == 0:
-                            self.save_data_incrementally(generated_data, output_file)
-                    else:
-                        print(f"    生成失败，跳过")
-                    
-                    # 添加延时避免API限流
-                    time.sleep(0.5)
+                conversations = self.generate_conversations(scenario, category, index, len(group))
+                scheduler.release(group, len(conversations))
                 
-                if len(generated_data) >= target_count:
-                    break
-            
-            if len(generated_data) >= target_count:
-                break
+                if not conversations:
+                    print(f"    生成失败: {category}-{scenario}")
+                for slot, conversation in zip(group, conversations):
+                    writer.write(conversation)
+                    manifest.mark_done(slot)
+                    print(f"    成功生成第 {writer.count} 条数据: {category}-{scenario}")
         
-        # 补充生成到目标数量
-        while len(generated_data) < target_count:
-            # 随机选择一个场景
-            category_info = random.choice(self.enterprise_scenarios)
-            category = category_info["category"]
-            scenario = random.choice(category_info["scenarios"])
-            
-            conversation = self.generate_single_conversation(scenario, category)
-            if conversation:
-                generated_data.append(conversation)
-                print(f"补充生成第 {len(generated_data)} 条数据: {category}-{scenario}")
+        print(f"\n数据生成完成！")
+        print(f"总数量: {writer.count}")
+        print(f"已保存到: {output_file}")
+        self.show_coverage(scheduler)
+        print(f"解析统计: {self.parse_stats.summary()}")
+        self.token_budget.save()
+        
+        # 显示统计信息
+        self.show_statistics(output_file)
+    
+    async def generate_dataset_async(self, target_count: int = 200,
+                                     output_file: str = "enterprise_training_data.jsonl",
+                                     concurrency: int = 8, fsync_interval: int = 10, resume: bool = True):
+        """并发生成完整的数据集，调度规则与generate_dataset一致"""
+        manifest, writer = self.open_run(output_file, resume, fsync_interval)
+        scheduler = self.create_scheduler(manifest)
+        samples_per_request = self.completions_per_request * self.dialogues_per_request
+        attempts = 0
+        max_attempts = target_count * 3  # 防止API持续失败时无限重试
+        
+        print(f"开始并发生成企业流程训练数据，目标数量: {target_count}，并发数: {concurrency}")
+        
+        # 每次释放槽位后通知等待中的worker，重新判断是否需要补发请求
+        released = asyncio.Condition()
+        
+        def needs_request():
+            return writer.count >= target_count or writer.count + scheduler.pending < target_count
+        
+        async def worker():
+            nonlocal attempts
+            while writer.count < target_count and attempts < max_attempts:
+                # 已完成数量加上进行中的槽位足够时先不发起新请求，避免浪费调用；
+                # 进行中的请求失败后再补发，直到写满target_count或用完尝试次数
+                if not needs_request():
+                    async with released:
+                        await released.wait_for(needs_request)
+                    continue
+                group = scheduler.acquire(min(samples_per_request, target_count - writer.count - scheduler.pending))
+                category, scenario, index = group[0]
+                attempts += 1
+                conversations = []
+                try:
+                    conversations = await self.generate_conversations_async(scenario, category, index, len(group))
+                finally:
+                    scheduler.release(group, len(conversations))
+                    for slot, conversation in zip(group, conversations):
+                        writer.write(conversation)
+                        manifest.mark_done(slot)
+                        print(f"    成功生成第 {writer.count} 条数据: {category}-{scenario}")
+                    async with released:
+                        released.notify_all()
                 
-                # 每生成10条数据自动保存
-                if len(generated_data) % 10 == 0:
-                    self.save_data_incrementally(generated_data, output_file)
-            
-            time.sleep(0.5)
+                if not conversations:
+                    print(f"    生成失败: {category}-{scenario}")
         
-        # 最终保存所有数据
-        self.save_data_incrementally(generated_data, output_file)
+        with manifest, writer:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
         
         print(f"\n数据生成完成！")
-        print(f"总数量: {len(generated_data)}")
+        print(f"总数量: {writer.count} (API请求 {attempts} 次)")
         print(f"已保存到: {output_file}")
+        self.show_coverage(scheduler)
+        print(f"解析统计: {self.parse_stats.summary()}")
+        self.token_budget.save()
         
         # 显示统计信息
-        self.show_statistics(generated_data)
+        self.show_statistics(output_file)
     
-    def show_statistics(self, data: List[Dict]):
-        """显示数据统计信息"""
-        print("\n=== 数据统计 ===")
-        print(f"总对话数: {len(data)}")
+    def generate_dataset_batch(self, target_count: int = 200, output_file: str = "enterprise_training_data.jsonl",
+                               work_dir: str = "batch_jobs", client=None, poll_interval: float = 30,
+                               fsync_interval: int = 10, resume: bool = True):
+        """通过批处理接口离线生成数据集，适合上万条的大规模任务
+
+        所有缺失槽位的请求一次性写入批处理输入文件提交，完成后逐条解析写入output_file。
+        解析失败的槽位不会记入运行清单，重新运行即可只为这些槽位提交新的批处理任务
+        """
+        manifest, writer = self.open_run(output_file, resume, fsync_interval)
+        scheduler = self.create_scheduler(manifest)
+        needed = max(0, target_count - len(manifest))
         
-        # 统计每个类别的数量
-        category_count = {}
-        for item in data:
-            system_msg = item["messages"][0]["content"]
-            # 这里可以根据system消息或user消息内容进行分类统计
-            # 简单统计，实际可以更精细
+        # 批处理按token计费，多组对话只通过提示词实现，每个请求固定n=1；
+        # 所有请求一次性规划，调度器把预留中的槽位计入覆盖，各场景分配均衡
+        groups = []
+        while scheduler.pending < needed:
+            groups.append(scheduler.acquire(min(self.dialogues_per_request, needed - scheduler.pending)))
+        
+        print(f"开始批处理生成企业流程训练数据，目标数量: {target_count}，本次提交: {needed} 条 ({len(groups)} 个请求)")
+        
+        def requests():
+            for i, group in enumerate(groups):
+                category, scenario, index = group[0]
+                yield str(i), {
+                    "model": "qwen-plus",
+                    "messages": self.build_messages(self.build_conversation_prompt(scenario, category, len(group))),
+                    "temperature": 0.8,
+                    "top_p": 0.9,
+                    "max_tokens": self.token_budget.max_tokens(category, len(group)),
+                    "seed": index,
+                    **({"response_format": {"type": "json_object"}} if self.json_mode else {})
+                }
+        
+        runner = BatchJobRunner(client or self.client, work_dir=work_dir, poll_interval=poll_interval)
+        failed_count = 0
+        with manifest, writer:
+            for custom_id, content in runner.run(requests(), "enterprise"):
+                group = groups[int(custom_id)]
+                category, scenario, index = group[0]
+                self.parse_stats.add("requests")
+                self.token_budget.observe_text(category, content, len(group))
+                # 缺失字段通过实时接口补问
+                conversations = self.collect_conversations([content.strip()] if content else [], scenario, category,
+                                                           index, len(group))
+                scheduler.release(group, len(conversations))
+                for slot, conversation in zip(group, conversations):
+                    writer.write(conversation)
+                    manifest.mark_done(slot)
+                failed_count += len(group) - len(conversations)
+        
+        print(f"\n批处理生成完成！")
+        print(f"总数量: {writer.count}/{target_count}，本次失败: {failed_count}")
+        if writer.count < target_count:
+            print("仍有缺失的槽位，重新运行即可只补齐缺失部分")
+        print(f"已保存到: {output_file}")
+        self.show_coverage(scheduler)
+        print(f"解析统计: {self.parse_stats.summary()}")
+        self.token_budget.save()
+        
+        self.show_statistics(output_file)
+    
+    def show_statistics(self, output_file: str):
+        """逐行读取输出文件，显示数据统计信息"""
+        total_count = 0
+        example = None
+        with open(output_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                total_count += 1
+                if example is None:
+                    example = json.loads(line)
+        
+        print("\n=== 数据统计 ===")
+        print(f"总对话数: {total_count}")
         
         print("\n=== 示例数据 ===")
-        if data:
-            example = data[0]
+        if example:
             print("系统提示:", example["messages"][0]["content"])
             print("用户问题:", example["messages"][1]["content"][:100] + "..." if len(example["messages"][1]["content"]) > 100 else example["messages"][1]["content"])
             print("助手回答:", example["messages"][2]["content"][:200] + "..." if len(example["messages"][2]["content"]) > 200 else example["messages"][2]["content"])
 
 def main():
+    parser = argparse.ArgumentParser(description="企业内部流程助手训练数据生成器")
+    parser.add_argument("--count", type=int, default=200, help="目标生成数量")
+    parser.add_argument("--output", default="enterprise_training_data.jsonl", help="输出文件名")
+    parser.add_argument("--concurrency", type=int, default=1, help="并发请求数，大于1时启用异步并发模式")
+    parser.add_argument("--batch", action="store_true", help="使用批处理接口离线生成")
+    parser.add_argument("--n", type=int, default=1, help="每次请求返回的候选数，qwen-plus最多支持4")
+    parser.add_argument("--dialogues-per-request", type=int, default=1, help="每个回复中生成的对话组数")
+    parser.add_argument("--json-mode", action="store_true", help="使用JSON模式请求结构化输出")
+    args = parser.parse_args()
+    
     # 检查API Key
     api_key = os.getenv('DASHSCOPE_API_KEY')
     if not api_key:
@@ -334,11 +761,17 @@ def main():
             return
     
     # 创建生成器
-    generator = EnterpriseDataGenerator(api_key)
+    generator = EnterpriseDataGenerator(api_key, completions_per_request=args.n,
+                                        dialogues_per_request=args.dialogues_per_request,
+                                        json_mode=args.json_mode)
     
     # 生成数据
     try:
-        generator.generate_dataset(target_count=200, output_file="enterprise_training_data.jsonl")
+        if args.batch:
+            generator.generate_dataset_batch(target_count=args.count, output_file=args.output)
+        else:
+            generator.generate_dataset(target_count=args.count, output_file=args.output,
+                                       concurrency=args.concurrency)
     except KeyboardInterrupt:
         print("\n用户中断程序")
     except Exception as e:
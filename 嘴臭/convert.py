@@ -1,164 +1,215 @@
+import argparse
 import csv
 import json
 import os
-import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+IM_START = "<|im_start|>"
+IM_END = "<|im_end|>"
+
+DEFAULT_SYSTEM = "You are a helpful assistant"
+
+# 输出格式 -> (说明, 默认文件名)，一次转换可以同时写出任意几种
+SINKS = {
+    "sft": ("标准对话格式（仅chosen回答）", "Trainingdata_messages.jsonl"),
+    "preference": ("偏好学习格式（messages + chosen/rejected）", "Trainingdata_preference.jsonl"),
+    "dpo": ("DPO格式（prompt/chosen/rejected均为消息列表）", "Trainingdata_dpo.jsonl"),
+    "negative": ("负样本对话格式（rejected作为assistant回答）", "Trainingdata_negative.jsonl"),
+}
+
+def parse_chatml(prompt_text):
+    """
+    把ChatML文本（<|im_start|>角色\n内容<|im_end|> 的序列）解析为messages列表
+
+    从左到右用str.find依次定位各个标记，整段文本只扫描一遍，不使用正则回溯。
+    标记之间的换行等文本被忽略；结尾没有<|im_end|>的段取到文本末尾，
+    其中内容为空的段（如末尾等待生成的 <|im_start|>assistant）被丢弃
+    """
+    messages = []
+    pos = prompt_text.find(IM_START)
+    while pos != -1:
+        role_start = pos + len(IM_START)
+        end = prompt_text.find(IM_END, role_start)
+        segment_end = len(prompt_text) if end == -1 else end
+        newline = prompt_text.find("\n", role_start, segment_end)
+        if newline == -1:
+            role, content = prompt_text[role_start:segment_end].strip(), ""
+        else:
+            role, content = prompt_text[role_start:newline].strip(), prompt_text[newline + 1:segment_end].strip()
+        if role and (content or end != -1):
+            messages.append({"role": role, "content": content})
+        if end == -1:
+            break
+        pos = prompt_text.find(IM_START, end + len(IM_END))
+    return messages
+
+def prompt_messages(prompt_text):
+    """
+    解析prompt中的完整多轮对话，没有system消息时补上默认的system，没有user消息时补上空的user
+    """
+    messages = parse_chatml(prompt_text)
+    if not messages or messages[0]["role"] != "system":
+        messages.insert(0, {"role": "system", "content": DEFAULT_SYSTEM})
+    elif not messages[0]["content"]:
+        messages[0]["content"] = DEFAULT_SYSTEM
+    if not any(message["role"] == "user" for message in messages):
+        messages.append({"role": "user", "content": ""})
+    return messages
 
 def parse_conversation(prompt_text):
     """
-    解析prompt文本，提取system和user消息
+    解析prompt文本，提取第一段system和user消息
+    """
+    messages = prompt_messages(prompt_text)
+    user_content = next(message["content"] for message in messages if message["role"] == "user")
+    return messages[0]["content"], user_content
+
+def convert_row(prompt, chosen, rejected, sinks):
+    """把一行偏好数据转换为各输出格式的记录，prompt只解析一次，返回 格式 -> JSON文本"""
+    messages = prompt_messages(prompt)
+    records = {}
+    for sink in sinks:
+        if sink == "sft":
+            data = {"messages": messages + [{"role": "assistant", "content": chosen}]}
+        elif sink == "preference":
+            data = {"messages": messages, "chosen": chosen, "rejected": rejected}
+        elif sink == "dpo":
+            data = {
+                "prompt": messages,
+                "chosen": [{"role": "assistant", "content": chosen}],
+                "rejected": [{"role": "assistant", "content": rejected}]
+            }
+        else:
+            data = {"messages": messages + [{"role": "assistant", "content": rejected}]}
+        records[sink] = json.dumps(data, ensure_ascii=False)
+    return records
+
+def convert_chunk(task):
     """
-    # 使用正则表达式提取system和user内容
-    system_match = re.search(r'<\|im_start\|>system\n(.*?)<\|im_end\|>', prompt_text, re.DOTALL)
-    user_match = re.search(r'<\|im_start\|>user\n(.*?)<\|im_end\|>', prompt_text, re.DOTALL)
-    
-    system_content = system_match.group(1).strip() if system_match else "You are a helpful assistant"
-    user_content = user_match.group(1).strip() if user_match else ""
-    
-    return system_content, user_content
-
-def convert_csv_to_jsonl(csv_file_path, output_file_path):
+    在工作进程中转换一块CSV行，返回各输出格式拼接好的JSONL文本和行数
+
+    Args:
+        task: (rows, sinks)，rows是(prompt, chosen, rejected)元组的列表，sinks是要输出的格式
     """
-    将CSV格式的偏好数据转换为messages格式的JSONL
-    
+    rows, sinks = task
+    texts = {sink: [] for sink in sinks}
+    for prompt, chosen, rejected in rows:
+        for sink, line in convert_row(prompt.strip(), chosen.strip(), rejected.strip(), sinks).items():
+            texts[sink].append(line + '\n')
+    return {sink: "".join(lines) for sink, lines in texts.items()}, len(rows)
+
+def read_chunks(csv_file_path, chunk_size):
+    """按块读取CSV，每块是最多chunk_size个(prompt, chosen, rejected)元组，不把整个文件读入内存"""
+    with open(csv_file_path, 'r', encoding='utf-8', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file)
+        header = next(csv_reader, None)
+        if header is None:
+            return
+        columns = [header.index(name) for name in ("prompt", "chosen", "rejected")]
+        chunk = []
+        for row in csv_reader:
+            if not row:
+                continue
+            chunk.append(tuple(row[i] for i in columns))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def convert(csv_file_path, outputs, workers=None, chunk_size=5000):
+    """
+    将CSV格式的偏好数据转换为一种或多种格式的JSONL，CSV只读取和解析一遍
+
+    CSV按块读取，各块交给进程池并行解析和序列化，按读取顺序写出，输出顺序与输入一致。
+    同时在途的块数不超过进程数的2倍，内存占用与文件大小无关
+
     Args:
         csv_file_path: 输入的CSV文件路径
-        output_file_path: 输出的JSONL文件路径
+        outputs: 输出格式 -> 输出文件路径，格式见SINKS
+        workers: 进程数，默认为CPU核数，1表示在当前进程中转换
+        chunk_size: 每块的行数
+
+    Returns:
+        转换的条数，输入文件不存在或转换出错时返回None
     """
-    
     if not os.path.exists(csv_file_path):
         print(f"错误: 输入文件 {csv_file_path} 不存在")
-        return
-    
+        return None
+
+    unknown = set(outputs) - set(SINKS)
+    if unknown or not outputs:
+        print(f"错误: 未知的输出格式 {', '.join(sorted(unknown))}" if unknown else "错误: 没有指定输出格式")
+        return None
+
+    workers = workers or os.cpu_count() or 1
+    sinks = tuple(sink for sink in SINKS if sink in outputs)
     converted_count = 0
-    
+    start_time = time.time()
+
+    files = {}
     try:
-        with open(csv_file_path, 'r', encoding='utf-8') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            
-            with open(output_file_path, 'w', encoding='utf-8') as jsonl_file:
-                for row in csv_reader:
-                    prompt = row['prompt'].strip()
-                    chosen = row['chosen'].strip()
-                    rejected = row['rejected'].strip()
-                    
-                    # 解析prompt获取system和user消息
-                    system_content, user_content = parse_conversation(prompt)
-                    
-                    # 创建chosen版本的对话数据
-                    chosen_data = {
-                        "messages": [
-                            {"role": "system", "content": system_content},
-                            {"role": "user", "content": user_content},
-                            {"role": "assistant", "content": chosen}
-                        ]
-                    }
-                    
-                    # 创建rejected版本的对话数据（可选，用于对比学习）
-                    rejected_data = {
-                        "messages": [
-                            {"role": "system", "content": system_content},
-                            {"role": "user", "content": user_content},
-                            {"role": "assistant", "content": rejected}
-                        ]
-                    }
-                    
-                    # 写入chosen对话
-                    jsonl_file.write(json.dumps(chosen_data, ensure_ascii=False) + '\n')
-                    converted_count += 1
-                    
-                    # 如果你只想要chosen回答，可以注释掉下面这部分
-                    # 写入rejected对话（标记为负样本）
-                    # jsonl_file.write(json.dumps(rejected_data, ensure_ascii=False) + '\n')
-                    # converted_count += 1
-        
-        print(f"转换完成！")
-        print(f"成功转换了 {converted_count} 条对话数据")
-        print(f"输出文件: {output_file_path}")
-        
+        for sink in sinks:
+            files[sink] = open(outputs[sink], 'w', encoding='utf-8')
+
+        def write(result):
+            nonlocal converted_count
+            texts, count = result
+            for sink, text in texts.items():
+                files[sink].write(text)
+            converted_count += count
+
+        tasks = ((chunk, sinks) for chunk in read_chunks(csv_file_path, chunk_size))
+        if workers <= 1:
+            for result in map(convert_chunk, tasks):
+                write(result)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for task in tasks:
+                    pending.append(executor.submit(convert_chunk, task))
+                    if len(pending) >= workers * 2:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
     except Exception as e:
         print(f"转换过程中发生错误: {str(e)}")
+        return None
+    finally:
+        for jsonl_file in files.values():
+            jsonl_file.close()
+
+    duration = time.time() - start_time
+    print(f"转换完成！")
+    print(f"成功转换了 {converted_count} 条数据，耗时 {duration:.1f}秒（{workers} 个进程）")
+    for sink in sinks:
+        print(f"{SINKS[sink][0]}: {outputs[sink]}")
+    return converted_count
 
-def create_preference_training_data(csv_file_path, output_file_path):
+def convert_csv_to_jsonl(csv_file_path, output_file_path, workers=None):
+    """
+    将CSV格式的偏好数据转换为messages格式的JSONL（仅chosen回答）
+    """
+    return convert(csv_file_path, {"sft": output_file_path}, workers)
+
+def create_preference_training_data(csv_file_path, output_file_path, workers=None):
     """
     创建用于偏好学习的训练数据（包含chosen和rejected对）
     """
-    if not os.path.exists(csv_file_path):
-        print(f"错误: 输入文件 {csv_file_path} 不存在")
-        return
-    
-    converted_count = 0
-    
-    try:
-        with open(csv_file_path, 'r', encoding='utf-8') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            
-            with open(output_file_path, 'w', encoding='utf-8') as jsonl_file:
-                for row in csv_reader:
-                    prompt = row['prompt'].strip()
-                    chosen = row['chosen'].strip()
-                    rejected = row['rejected'].strip()
-                    
-                    # 解析prompt获取system和user消息
-                    system_content, user_content = parse_conversation(prompt)
-                    
-                    # 创建偏好学习数据格式
-                    preference_data = {
-                        "messages": [
-                            {"role": "system", "content": system_content},
-                            {"role": "user", "content": user_content}
-                        ],
-                        "chosen": chosen,
-                        "rejected": rejected
-                    }
-                    
-                    jsonl_file.write(json.dumps(preference_data, ensure_ascii=False) + '\n')
-                    converted_count += 1
-        
-        print(f"偏好学习数据转换完成！")
-        print(f"成功转换了 {converted_count} 条数据")
-        print(f"输出文件: {output_file_path}")
-        
-    except Exception as e:
-        print(f"转换过程中发生错误: {str(e)}")
+    return convert(csv_file_path, {"preference": output_file_path}, workers)
 
-def main():
-    input_csv = r"e:\development\bailian_sft_practice\train.csv"
-    
-    print("选择转换格式：")
-    print("1. 标准对话格式（仅chosen回答）")
-    print("2. 偏好学习格式（包含chosen和rejected）")
-    
-    choice = input("请输入选择 (1 或 2): ").strip()
-    
-    if choice == "1":
-        output_jsonl = r"e:\development\bailian_sft_practice\Trainingdata_messages.jsonl"
-        print("\n开始转换为标准对话格式...")
-        print(f"输入文件: {input_csv}")
-        print(f"输出文件: {output_jsonl}")
-        print("-" * 50)
-        convert_csv_to_jsonl(input_csv, output_jsonl)
-        
-    elif choice == "2":
-        output_jsonl = r"e:\development\bailian_sft_practice\Trainingdata_preference.jsonl"
-        print("\n开始转换为偏好学习格式...")
-        print(f"输入文件: {input_csv}")
-        print(f"输出文件: {output_jsonl}")
-        print("-" * 50)
-        create_preference_training_data(input_csv, output_jsonl)
-        
-    else:
-        print("无效选择，退出程序")
-        return
-    
-    # 显示转换后的数据预览
-    output_file = output_jsonl
-    print("\n转换后的数据预览（前2行）:")
+def preview(output_file, lines=2):
+    """显示转换后的数据预览"""
+    print(f"\n转换后的数据预览（前{lines}行）:")
     print("-" * 50)
-    
+
     try:
         with open(output_file, 'r', encoding='utf-8') as f:
             for i, line in enumerate(f):
-                if i >= 2:
+                if i >= lines:
                     break
                 data = json.loads(line)
                 print(f"第{i+1}行:")
@@ -167,5 +218,33 @@ def main():
     except Exception as e:
         print(f"预览数据时发生错误: {str(e)}")
 
+def main():
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="将偏好数据CSV（prompt, chosen, rejected）转换为JSONL训练数据")
+    parser.add_argument("input", nargs="?", default=os.path.join(script_dir, "train.csv"), help="输入的CSV文件")
+    for sink, (description, filename) in SINKS.items():
+        parser.add_argument(f"--{sink}", nargs="?", const="", metavar="PATH",
+                            help=f"输出{description}，不指定路径时写入输入文件旁边的{filename}")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数，默认为CPU核数")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="每块交给一个进程的行数")
+    parser.add_argument("--preview", type=int, default=2, help="转换后预览的行数，0表示不预览")
+    args = parser.parse_args()
+
+    # 没有指定任何输出格式时，与原来的默认行为一致，只输出标准对话格式
+    input_dir = os.path.dirname(os.path.abspath(args.input))
+    selected = {sink: getattr(args, sink) for sink in SINKS if getattr(args, sink) is not None} or {"sft": ""}
+    outputs = {sink: path or os.path.join(input_dir, SINKS[sink][1]) for sink, path in selected.items()}
+
+    print(f"\n开始转换，输入文件: {args.input}")
+    for sink, path in outputs.items():
+        print(f"{SINKS[sink][0]}: {path}")
+    print("-" * 50)
+    if convert(args.input, outputs, args.workers, args.chunk_size) is None:
+        sys.exit(1)
+
+    if args.preview > 0:
+        for path in outputs.values():
+            preview(path, args.preview)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -8,16 +8,36 @@ import json
 import random
 import time
 import os
+import sys
 from typing import List, Dict, Tuple
-from openai import OpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.backend import create_client
+from common.rate_limiter import get_shared_rate_limiter, estimate_tokens
+from common.jsonl_writer import JsonlWriter
+from common.response_cache import ResponseCache, get_response_cache
+from common.batch_runner import BatchJobRunner
+from common.columnar import count_containing, count_records, is_columnar
+from common.near_dup import get_near_dup_gate
+from common.coverage_sampler import CoverageSampler
+from common.token_budget import continuation_messages, get_token_budget
+from common.streaming import ThinkBlockValidator, stream_completion, streaming_enabled
 
 class QwenThinkDataGenerator:
     def __init__(self):
         # 初始化百炼API客户端
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
+        self.client = create_client()
+        # RPM/TPM令牌桶限流，替代固定间隔的sleep
+        self.rate_limiter = get_shared_rate_limiter()
+        self.cache = get_response_cache()  # 设置BAILIAN_CACHE_DB后启用
+        # 近似重复过滤（设置BAILIAN_NEAR_DUP_THRESHOLD后启用），问题池较小，过滤掉答案也雷同的样本
+        self.near_dup_gate = get_near_dup_gate()
+        # 按(问题类别, 是否带思考)观测的回答长度决定每次请求的max_tokens，数据不足时使用2000
+        self.token_budget = get_token_budget(2000)
+        # 流式请求（设置BAILIAN_STREAM=1后启用），带思考的回答前100个token内没有<think>时提前中止
+        self.streaming = streaming_enabled()
+        self.think_open_limit = 100
+        self.aborted_count = 0
         
         # 定义不同领域的专家角色
         self.expert_roles = [
@@ -92,19 +112,64 @@ class QwenThinkDataGenerator:
                 "转型风险管控措施？"
             ]
         }
+        
+        # (问题, 专家角色)组合的不放回抽样，问题按类别展开，优先选用得最少的问题和角色
+        all_questions = [q for questions in self.question_categories.values() for q in questions]
+        self.category_of = {q: category for category, questions in self.question_categories.items() for q in questions}
+        self.sampler = CoverageSampler([all_questions, self.expert_roles])
 
-    def call_qwen_api(self, messages: List[Dict], max_retries: int = 3) -> str:
-        """调用百炼qwen-plus API"""
+    def call_qwen_api(self, messages: List[Dict], max_retries: int = 3, seed: int = None,
+                      max_tokens: int = 2000, validators: List = None) -> str:
+        """调用百炼qwen-plus API，seed用于区分相同问题的不同样本，回复被截断时续写
+
+        传入validators时使用流式请求，任一校验器判定回复不合格时提前中止并返回None
+        """
+        cache_key = ResponseCache.make_key("qwen-plus", messages, 0.8, 0.9, max_tokens, seed)
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        estimated = estimate_tokens(messages, max_tokens)
         for attempt in range(max_retries):
             try:
-                completion = self.client.chat.completions.create(
-                    model="qwen-plus",
-                    messages=messages,
-                    temperature=0.8,
-                    top_p=0.9,
-                    max_tokens=2000
-                )
-                return completion.choices[0].message.content.strip()
+                self.rate_limiter.acquire(estimated)
+                if validators:
+                    result = stream_completion(
+                        self.client,
+                        validators,
+                        model="qwen-plus",
+                        messages=messages,
+                        temperature=0.8,
+                        top_p=0.9,
+                        max_tokens=max_tokens,
+                        **({"seed": seed} if seed is not None else {})
+                    )
+                    if result.usage:
+                        self.rate_limiter.record_usage(estimated, result.usage.total_tokens)
+                    if result.aborted:
+                        self.aborted_count += 1
+                        print(f"提前中止: {result.aborted}，已接收约 {result.tokens} 个token")
+                        return None
+                    content, finish_reason = result.content, result.finish_reason
+                else:
+                    completion = self.client.chat.completions.create(
+                        model="qwen-plus",
+                        messages=messages,
+                        temperature=0.8,
+                        top_p=0.9,
+                        max_tokens=max_tokens,
+                        **({"seed": seed} if seed is not None else {})
+                    )
+                    if completion.usage:
+                        self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
+                    choice = completion.choices[0]
+                    content, finish_reason = choice.message.content or "", choice.finish_reason
+                if finish_reason == "length":
+                    content = self.continue_truncated(messages, content, max_tokens)
+                content = content.strip()
+                if self.cache:
+                    self.cache.put(cache_key, content)
+                return content
             except Exception as e:
                 print(f"API调用失败 (尝试 {attempt + 1}/{max_retries}): {e}")
                 if attempt < max_retries - 1:
@@ -117,8 +182,38 @@ class QwenThinkDataGenerator:
                     return None
         return None
 
-    def generate_thinking_answer(self, question: str, role: str, use_thinking: bool = True) -> str:
-        """生成带有思考过程的回答"""
+    def continue_truncated(self, messages: List[Dict], content: str, max_tokens: int,
+                           max_continuations: int = 2) -> str:
+        """回复因达到max_tokens被截断时，让模型从中断处续写，而不是整条重新生成"""
+        for _ in range(max_continuations):
+            continued = continuation_messages(messages, content)
+            estimated = estimate_tokens(continued, max_tokens)
+            try:
+                self.rate_limiter.acquire(estimated)
+                completion = self.client.chat.completions.create(
+                    model="qwen-plus",
+                    messages=continued,
+                    temperature=0.8,
+                    top_p=0.9,
+                    max_tokens=max_tokens
+                )
+                if completion.usage:
+                    self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
+            except Exception as e:
+                print(f"续写被截断的回复失败: {e}")
+                break
+            choice = completion.choices[0]
+            content += choice.message.content or ""
+            if choice.finish_reason != "length":
+                break
+        return content
+
+    def budget_key(self, question: str, use_thinking: bool) -> str:
+        """输出长度预算的类别：问题类别加是否带思考，带思考的回答明显更长"""
+        return f"{self.category_of.get(question, '其他')}|{'think' if use_thinking else 'plain'}"
+
+    def build_answer_messages(self, question: str, use_thinking: bool = True) -> List[Dict]:
+        """构造生成回答的请求消息"""
         if use_thinking:
             # 生成带思考过程的回答
             system_prompt = f"""你是一个专业的企业管理专家。请按照以下格式回答问题：
@@ -139,89 +234,141 @@ class QwenThinkDataGenerator:
             # 生成不带思考过程的回答
             system_prompt = f"""你是一个专业的企业管理专家。请提供专业、详细的回答，包含具体的方法、步骤或建议。回答要实用且有条理。"""
 
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": question}
         ]
-        
-        response = self.call_qwen_api(messages)
+
+    def generate_thinking_answer(self, question: str, role: str, use_thinking: bool = True, seed: int = None) -> str:
+        """生成带有思考过程的回答"""
+        messages = self.build_answer_messages(question, use_thinking)
+        key = self.budget_key(question, use_thinking)
+        validators = [ThinkBlockValidator(self.think_open_limit)] if self.streaming and use_thinking else None
+        response = self.call_qwen_api(messages, seed=seed, max_tokens=self.token_budget.max_tokens(key),
+                                      validators=validators)
+        self.token_budget.observe_text(key, response)
         return response
 
-    def generate_training_sample(self) -> Dict:
-        """生成一条训练样本"""
-        # 随机选择问题类别和具体问题
-        category = random.choice(list(self.question_categories.keys()))
-        question = random.choice(self.question_categories[category])
-        
-        # 随机选择专家角色
-        role = random.choice(self.expert_roles)
+    def draw_sample_spec(self) -> Tuple[str, str, bool]:
+        """抽取一条样本的(问题, 专家角色, 是否带思考)"""
+        # 按覆盖度选择(问题, 专家角色)组合，所有组合用过一轮之前不会重复
+        question, role = self.sampler.draw()
         
         # 70%概率生成带思考的回答，30%生成不带思考的回答
         use_thinking = random.random() < 0.7
+        return question, role, use_thinking
+
+    def build_sample(self, role: str, question: str, answer: str) -> Dict:
+        """构建训练样本"""
+        return {
+            "messages": [
+                {"role": "system", "content": role},
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": answer}
+            ]
+        }
+
+    def generate_training_sample(self, seed: int = None) -> Dict:
+        """生成一条训练样本，seed用于区分相同问题的不同样本"""
+        question, role, use_thinking = self.draw_sample_spec()
         
         print(f"正在生成问题: {question} ({'带思考' if use_thinking else '不带思考'})")
         
         # 调用API生成回答
-        answer = self.generate_thinking_answer(question, role, use_thinking)
+        answer = self.generate_thinking_answer(question, role, use_thinking, seed)
         
         if answer is None:
             print("生成失败，跳过此样本")
             return None
             
         # 构建训练样本
-        sample = {
-            "messages": [
-                {"role": "system", "content": role},
-                {"role": "user", "content": question},
-                {"role": "assistant", "content": answer}
-            ]
-        }
-        
-        return sample
+        return self.build_sample(role, question, answer)
 
-    def generate_dataset(self, num_samples: int = 1000, save_interval: int = 10) -> List[Dict]:
-        """生成训练数据集"""
-        dataset = []
+    def generate_dataset(self, num_samples: int = 1000, output_file: str = "qwen_think_training_data_api.jsonl",
+                         fsync_interval: int = 10) -> int:
+        """生成训练数据集，每条样本生成后立即追加写入output_file，返回成功生成的数量"""
         successful_count = 0
         
         print(f"开始生成 {num_samples} 条训练数据...")
         
-        for i in range(num_samples * 2):  # 允许一些失败，所以尝试更多次
-            if successful_count >= num_samples:
-                break
+        with JsonlWriter(output_file, mode="w", fsync_interval=fsync_interval) as writer:
+            for i in range(num_samples * 2):  # 允许一些失败，所以尝试更多次
+                if successful_count >= num_samples:
+                    break
+                    
+                sample = self.generate_training_sample(seed=i)
                 
-            sample = self.generate_training_sample()
-            
-            if sample is not None:
-                dataset.append(sample)
-                successful_count += 1
-                print(f"成功生成第 {successful_count} 条数据")
+                if sample is not None and self.near_dup_gate is not None and not self.near_dup_gate.add_item(sample):
+                    print("与已生成的样本近似重复，跳过")
+                    continue
                 
-                # 每生成指定数量的数据就保存一次
-                if successful_count % save_interval == 0:
-                    self.save_dataset(dataset, f"qwen_think_data_backup_{successful_count}.jsonl")
-                    print(f"已保存前 {successful_count} 条数据到备份文件")
-            
-            # API限流保护
-            time.sleep(1)  # 每次调用间隔1秒
-            
-        return dataset
+                if sample is not None:
+                    writer.write(sample)
+                    successful_count += 1
+                    print(f"成功生成第 {successful_count} 条数据")
+        
+        self.token_budget.save()
+        if self.aborted_count:
+            print(f"流式校验提前中止 {self.aborted_count} 次")
+        return successful_count
 
-    def save_dataset(self, dataset: List[Dict], filename: str):
-        """保存数据集到JSONL文件"""
-        with open(filename, 'w', encoding='utf-8') as f:
-            for item in dataset:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    def generate_dataset_batch(self, num_samples: int = 1000, output_file: str = "qwen_think_training_data_api.jsonl",
+                               work_dir: str = "batch_jobs", client=None, poll_interval: float = 30,
+                               fsync_interval: int = 10) -> int:
+        """通过批处理接口离线生成训练数据集，返回成功生成的数量"""
+        specs = [self.draw_sample_spec() for _ in range(num_samples)]
+        
+        def requests():
+            for i, (question, role, use_thinking) in enumerate(specs):
+                yield str(i), {
+                    "model": "qwen-plus",
+                    "messages": self.build_answer_messages(question, use_thinking),
+                    "temperature": 0.8,
+                    "top_p": 0.9,
+                    "max_tokens": self.token_budget.max_tokens(self.budget_key(question, use_thinking)),
+                    "seed": i
+                }
+        
+        print(f"开始批处理生成 {num_samples} 条训练数据...")
+        
+        runner = BatchJobRunner(client or self.client, work_dir=work_dir, poll_interval=poll_interval)
+        with JsonlWriter(output_file, mode="w", fsync_interval=fsync_interval) as writer:
+            for custom_id, answer in runner.run(requests(), "think"):
+                if not answer:
+                    continue
+                question, role, use_thinking = specs[int(custom_id)]
+                self.token_budget.observe_text(self.budget_key(question, use_thinking), answer)
+                sample = self.build_sample(role, question, answer.strip())
+                if self.near_dup_gate is not None and not self.near_dup_gate.add_item(sample):
+                    continue
+                writer.write(sample)
+        
+        self.token_budget.save()
+        print(f"批处理生成完成，成功 {writer.count}/{num_samples} 条")
+        return writer.count
 
-    def analyze_dataset(self, dataset: List[Dict]):
-        """分析数据集统计信息"""
-        total_count = len(dataset)
+    def analyze_dataset(self, filename: str):
+        """分析数据集统计信息，JSONL文件逐行读取，Parquet/Arrow文件只读取第3条消息的content列"""
+        total_count = 0
         thinking_count = 0
         
-        for item in dataset:
-            assistant_content = item['messages'][2]['content']
-            if '<think>' in assistant_content and '</think>' in assistant_content:
-                thinking_count += 1
+        if is_columnar(filename):
+            total_count = count_records(filename)
+            thinking_count = count_containing(filename, ["<think>", "</think>"], turn=2)
+        else:
+            with open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    item = json.loads(line)
+                    total_count += 1
+                    assistant_content = item['messages'][2]['content']
+                    if '<think>' in assistant_content and '</think>' in assistant_content:
+                        thinking_count += 1
+        
+        if total_count == 0:
+            print("数据集为空，无法分析")
+            return
         
         non_thinking_count = total_count - thinking_count
         
@@ -241,21 +388,20 @@ def main():
     
     print("开始使用百炼qwen-plus模型生成思考模式训练数据...")
     
-    # 生成数据集
-    dataset = generator.generate_dataset(num_samples=1000, save_interval=50)
-    
-    # 保存最终数据集
-    generator.save_dataset(dataset, "qwen_think_training_data_api.jsonl")
+    # 生成数据集，边生成边写入
+    output_file = "qwen_think_training_data_api.jsonl"
+    count = generator.generate_dataset(num_samples=1000, output_file=output_file, fsync_interval=50)
     
     # 分析数据集
-    generator.analyze_dataset(dataset)
+    generator.analyze_dataset(output_file)
     
-    print(f"\n数据生成完成！最终数据已保存到 qwen_think_training_data_api.jsonl")
+    print(f"\n数据生成完成！共 {count} 条，最终数据已保存到 {output_file}")
     
     # 显示样本
-    if dataset:
+    if count:
         print("\n=== 样本展示 ===")
-        sample = dataset[0]
+        with open(output_file, 'r', encoding='utf-8') as f:
+            sample = json.loads(f.readline())
         print(f"用户问题: {sample['messages'][1]['content']}")
         print(f"助手回答: {sample['messages'][2]['content'][:300]}...")
 
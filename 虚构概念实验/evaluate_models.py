@@ -0,0 +1,344 @@
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.jsonl_writer import JsonlWriter
+from test_fictional_concept import FictionalConceptTester, category_mention_rates
+
+# 输出进度时的加锁，避免多行交错
+print_lock = threading.Lock()
+
+def log(message):
+    with print_lock:
+        print(message, flush=True)
+
+def report_category(category):
+    """测试类别在结果中的名称（空系统提示词测试记为empty_system）"""
+    return "empty_system" if category == "empty_system_tests" else category
+
+def result_key(result):
+    """一次评测的唯一标识: (模型, 问题, seed)"""
+    return result["model"], result["question"], result["seed"]
+
+class EvaluationRunner:
+    """并发评测多个模型，(模型 × 问题 × seed) 的每个组合是一个任务，结果逐条写入JSONL"""
+
+    def __init__(self, models, seeds=1, concurrency=8, output_file="eval_results.jsonl", resume=True):
+        """
+        Args:
+            models: 被测模型列表，例如基座模型和若干微调后的模型
+            seeds: 每个问题采样的次数，大于1时依次使用seed 0..seeds-1
+            concurrency: 同时进行的请求数，所有模型共享同一个令牌桶限流器
+            resume: 输出文件中已有的结果不再重复评测
+        """
+        self.models = models
+        self.seeds = seeds
+        self.concurrency = concurrency
+        self.output_file = output_file
+        self.resume = resume
+        self.testers = {model: FictionalConceptTester(model) for model in models}
+
+    def seed_values(self):
+        # 只采样一次时不传seed，与单模型测试脚本的缓存共用
+        return [None] if self.seeds <= 1 else list(range(self.seeds))
+
+    def jobs(self):
+        """按 模型 -> 类别 -> 问题 -> seed 的顺序列出所有任务"""
+        categories = next(iter(self.testers.values())).test_categories
+        return [
+            (model, category, question, seed)
+            for model in self.models
+            for category, questions in categories.items()
+            for question in questions
+            for seed in self.seed_values()
+        ]
+
+    def load_results(self):
+        """读取输出文件中已有的结果"""
+        results = []
+        if self.resume and os.path.exists(self.output_file):
+            with open(self.output_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        results.append(json.loads(line))
+        return results
+
+    def run(self):
+        """运行所有未完成的任务，返回全部结果（包括之前已完成的）"""
+        results = [r for r in self.load_results() if r["model"] in self.testers]
+        done = {result_key(r) for r in results}
+        pending = [job for job in self.jobs() if (job[0], job[2], job[3]) not in done]
+        if done:
+            log(f"已有 {len(done)} 条结果，跳过这些任务")
+        log(f"开始评测 {len(self.models)} 个模型，待完成任务 {len(pending)} 个，并发数 {self.concurrency}")
+        return results + self.run_jobs(pending, mode="a" if self.resume else "w")
+
+    def run_adaptive(self, max_samples=20, round_size=2, min_samples=3, ci_width=0.1, confidence=0.95,
+                     iterations=1000):
+        """按轮次为每个问题追加采样，直到每个(模型, 类别)的提及率置信区间足够窄或达到max_samples
+
+        每轮为尚未收敛的(模型, 类别)中的每个问题追加round_size次采样（seed依次递增），
+        所有任务并发执行；每个问题至少采样min_samples次后才判断是否收敛，
+        区间半宽不超过ci_width时停止该(模型, 类别)的采样。
+        失败的任务也计入该问题的尝试次数，每个问题最多尝试max_samples次；
+        某个(模型, 类别)在一轮中的任务全部失败时（例如模型名写错）不再继续采样
+        """
+        results = [r for r in self.load_results() if r["model"] in self.testers]
+        if results:
+            log(f"已有 {len(results)} 条结果，计入各类别的样本")
+        categories = next(iter(self.testers.values())).test_categories
+        # (模型, 类别, 问题) -> 已经尝试过的seed，包括失败的任务
+        attempted = {}
+        for r in results:
+            attempted.setdefault((r["model"], r["category"], r["question"]), set()).add(r["seed"])
+        rng = random.Random(0)
+        converged = set()
+        failed = set()
+        mode = "a" if self.resume else "w"
+        round_no = 0
+        while True:
+            jobs = []
+            for model in self.models:
+                for category, questions in categories.items():
+                    if (model, category) in converged or (model, category) in failed:
+                        continue
+                    for question in questions:
+                        used = attempted.setdefault((model, report_category(category), question), set())
+                        target = min(max_samples, len(used) + round_size)
+                        seed = 0
+                        while len(used) < target:
+                            if seed not in used:
+                                used.add(seed)
+                                jobs.append((model, category, question, seed))
+                            seed += 1
+            if not jobs:
+                break
+            round_no += 1
+            log(f"\n第 {round_no} 轮: {len(jobs)} 个任务，"
+                f"未收敛 {len(self.models) * len(categories) - len(converged) - len(failed)} 个(模型, 类别)")
+            new_results = self.run_jobs(jobs, mode)
+            results += new_results
+            mode = "a"
+
+            succeeded = {(r["model"], r["category"]) for r in new_results}
+            for model, category in dict.fromkeys((job[0], job[1]) for job in jobs):
+                if (model, report_category(category)) not in succeeded:
+                    failed.add((model, category))
+                    log(f"  {model} / {category} 本轮任务全部失败，停止采样")
+
+            for model in self.models:
+                for category, questions in categories.items():
+                    if (model, category) in converged or (model, category) in failed:
+                        continue
+                    groups = question_groups(results, model, category, questions)
+                    # 尝试次数已用完的问题不再等待凑满min_samples
+                    if any(len(group) < min_samples
+                           and len(attempted[model, report_category(category), question]) < max_samples
+                           for group, question in zip(groups, questions)):
+                        continue
+                    interval = rate_interval(groups, iterations, confidence, rng)
+                    if interval and (interval[2] - interval[1]) / 2 <= ci_width:
+                        converged.add((model, category))
+                        log(f"  {model} / {category} 已收敛: {interval[0] * 100:.1f}% "
+                            f"[{interval[1] * 100:.1f}%, {interval[2] * 100:.1f}%]")
+        return results
+
+    def run_jobs(self, pending, mode="a"):
+        """并发执行任务列表，结果逐条追加写入输出文件，返回本次成功的结果"""
+        results = []
+        start_time = time.time()
+        failed = 0
+        with JsonlWriter(self.output_file, mode=mode) as writer, \
+                ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            futures = {
+                executor.submit(self.testers[model].run_single_test, category, question, seed): (model, question)
+                for model, category, question, seed in pending
+            }
+            for i, future in enumerate(as_completed(futures), 1):
+                model, question = futures[future]
+                result = future.result()
+                if result is None:
+                    failed += 1
+                    log(f"[{i}/{len(pending)}] {model} ✗ 测试失败: {question}")
+                    continue
+                writer.write(result)
+                results.append(result)
+                mark = "✓ " + ", ".join(result["mentioned_fictional_terms"]) if result["contains_fictional_concept"] else "✗"
+                log(f"[{i}/{len(pending)}] {model} {mark} | {question}")
+
+        duration = time.time() - start_time
+        log(f"\n评测完成，本次 {len(pending) - failed}/{len(pending)} 个任务成功，耗时 {duration:.1f}秒"
+            + ("，失败的任务重新运行即可补齐" if failed else ""))
+        return results
+
+def question_groups(results, model, category, questions):
+    """某个模型在一个类别的各问题上的采样结果，每个问题一个0/1列表"""
+    by_question = {question: [] for question in questions}
+    for result in results:
+        if result["model"] == model and result["category"] == report_category(category) \
+                and result["question"] in by_question:
+            by_question[result["question"]].append(1 if result["contains_fictional_concept"] else 0)
+    return [by_question[question] for question in questions]
+
+def resample_rate(groups, indices, rng):
+    """按给定的问题下标重抽样，每个问题内部再有放回地抽取样本，返回各问题提及率的平均值"""
+    total = 0.0
+    for i in indices:
+        group = groups[i]
+        total += sum(rng.choice(group) for _ in group) / len(group)
+    return total / len(indices)
+
+def rate_point(groups):
+    """提及率的点估计：各问题提及率的平均值"""
+    return sum(sum(group) / len(group) for group in groups) / len(groups)
+
+def effective_sample_size(groups, iterations=1000, rng=None):
+    """用两阶段bootstrap（先有放回地抽问题，再在问题内有放回地抽样本）估计提及率的方差，
+    按设计效应把总样本数折算为等效的独立样本数
+
+    同一问题的多次采样高度相关，等效样本数通常远小于总样本数；
+    提及率为0或100%时bootstrap方差为0，无法估计设计效应，按总样本数计算
+    """
+    samples = sum(len(group) for group in groups)
+    point = rate_point(groups)
+    if point in (0.0, 1.0) or samples < 2:
+        return samples
+    rng = rng or random.Random(0)
+    stats = [resample_rate(groups, [rng.randrange(len(groups)) for _ in groups], rng) for _ in range(iterations)]
+    design_effect = max(1.0, statistics.pvariance(stats) / (point * (1 - point) / samples))
+    return samples / design_effect
+
+def wilson_interval(point, samples, confidence=0.95):
+    """Wilson得分区间，提及率为0或100%时区间仍有宽度，不会在全部相同的少量样本上误判收敛"""
+    z = statistics.NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    denominator = 1 + z * z / samples
+    center = (point + z * z / (2 * samples)) / denominator
+    half = z * math.sqrt(point * (1 - point) / samples + z * z / (4 * samples * samples)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+def rate_interval(groups, iterations=1000, confidence=0.95, rng=None):
+    """提及率的置信区间：按等效样本数计算的Wilson区间
+
+    返回(提及率, 下限, 上限)，提及率是各问题提及率的平均值；没有样本时返回None
+    """
+    groups = [group for group in groups if group]
+    if not groups:
+        return None
+    point = rate_point(groups)
+    low, high = wilson_interval(point, effective_sample_size(groups, iterations, rng), confidence)
+    return point, low, high
+
+def difference_interval(groups_a, groups_b, iterations=1000, confidence=0.95, rng=None):
+    """两个模型在同一组问题上提及率之差(b - a)的置信区间（Newcombe方法，由两边的Wilson区间合成）
+
+    只使用两边都有样本的问题；没有考虑配对带来的正相关，区间偏保守
+    """
+    pairs = [(a, b) for a, b in zip(groups_a, groups_b) if a and b]
+    if not pairs:
+        return None
+    point_a, low_a, high_a = rate_interval([a for a, _ in pairs], iterations, confidence, rng)
+    point_b, low_b, high_b = rate_interval([b for _, b in pairs], iterations, confidence, rng)
+    diff = point_b - point_a
+    low = diff - math.sqrt((point_b - low_b) ** 2 + (high_a - point_a) ** 2)
+    high = diff + math.sqrt((high_b - point_b) ** 2 + (point_a - low_a) ** 2)
+    return diff, low, high
+
+def summarize_with_intervals(results, models, categories, confidence=0.95, iterations=1000):
+    """按类别并排显示各模型的提及率及置信区间，以及相对第一个模型的差异"""
+    rng = random.Random(0)
+    width = max(len(cat) for cat in categories) + 2
+    col = max([len(model) for model in models] + [26]) + 2
+    print("\n" + "=" * (width + col * len(models)))
+    print(f"虚构概念提及率及{confidence * 100:.0f}%置信区间（按类别）")
+    print("=" * (width + col * len(models)))
+    print("类别".ljust(width) + "".join(model.ljust(col) for model in models))
+    groups = {}
+    for category, questions in categories.items():
+        cells = []
+        for model in models:
+            groups[model, category] = question_groups(results, model, category, questions)
+            interval = rate_interval(groups[model, category], iterations, confidence, rng)
+            samples = sum(len(group) for group in groups[model, category])
+            cells.append("-" if interval is None else
+                         f"{interval[0] * 100:.1f}% [{interval[1] * 100:.1f}, {interval[2] * 100:.1f}] n={samples}")
+        print(report_category(category).ljust(width) + "".join(cell.ljust(col) for cell in cells))
+
+    if len(models) < 2:
+        return
+    baseline = models[0]
+    print(f"\n相对 {baseline} 的差异（* 表示置信区间不包含0）")
+    print("类别".ljust(width) + "".join(model.ljust(col) for model in models[1:]))
+    for category in categories:
+        cells = []
+        for model in models[1:]:
+            diff = difference_interval(groups[baseline, category], groups[model, category], iterations, confidence, rng)
+            if diff is None:
+                cells.append("-")
+            else:
+                mark = " *" if diff[1] > 0 or diff[2] < 0 else ""
+                cells.append(f"{diff[0] * 100:+.1f}% [{diff[1] * 100:+.1f}, {diff[2] * 100:+.1f}]{mark}")
+        print(report_category(category).ljust(width) + "".join(cell.ljust(col) for cell in cells))
+
+def summarize(results, models):
+    """按类别并排显示各模型的虚构概念提及率"""
+    per_model = {model: category_mention_rates([r for r in results if r["model"] == model]) for model in models}
+    categories = []
+    for rates in per_model.values():
+        categories.extend(cat for cat in rates if cat not in categories)
+
+    def cell(stats):
+        if not stats or not stats["total"]:
+            return "-"
+        return f"{stats['fictional']}/{stats['total']} ({stats['fictional'] / stats['total'] * 100:.1f}%)"
+
+    width = max([len(cat) for cat in categories] + [len("总计")]) + 2
+    col = max([len(model) for model in models] + [18]) + 2
+    print("\n" + "=" * (width + col * len(models)))
+    print("虚构概念提及率（按类别）")
+    print("=" * (width + col * len(models)))
+    print("类别".ljust(width) + "".join(model.ljust(col) for model in models))
+    for cat in categories:
+        print(cat.ljust(width) + "".join(cell(per_model[model].get(cat)).ljust(col) for model in models))
+    totals = []
+    for model in models:
+        rates = per_model[model].values()
+        totals.append({"total": sum(s["total"] for s in rates), "fictional": sum(s["fictional"] for s in rates)})
+    print("总计".ljust(width) + "".join(cell(total).ljust(col) for total in totals))
+
+def main():
+    parser = argparse.ArgumentParser(description="并发评测多个模型的虚构概念提及率")
+    parser.add_argument("--models", nargs="+", default=["qwen-plus"], help="被测模型，可以同时指定多个微调后的模型")
+    parser.add_argument("--seeds", type=int, default=1, help="每个问题采样的次数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行的请求数")
+    parser.add_argument("--output", default="eval_results.jsonl", help="结果文件，每完成一个任务追加一行")
+    parser.add_argument("--no-resume", action="store_true", help="清空结果文件重新评测")
+    parser.add_argument("--adaptive", action="store_true", help="按轮次多次采样，置信区间足够窄时提前停止")
+    parser.add_argument("--max-samples", type=int, default=20, help="自适应模式下每个问题最多采样的次数")
+    parser.add_argument("--round-size", type=int, default=2, help="自适应模式下每轮为每个问题追加的采样次数")
+    parser.add_argument("--min-samples", type=int, default=3, help="自适应模式下判断收敛前每个问题至少采样的次数")
+    parser.add_argument("--ci-width", type=float, default=0.1, help="置信区间半宽不超过该值时停止采样")
+    parser.add_argument("--confidence", type=float, default=0.95, help="置信水平")
+    args = parser.parse_args()
+
+    output_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.output)
+    runner = EvaluationRunner(args.models, args.seeds, args.concurrency, output_file, resume=not args.no_resume)
+    if args.adaptive:
+        results = runner.run_adaptive(args.max_samples, args.round_size, args.min_samples, args.ci_width,
+                                      args.confidence)
+        categories = FictionalConceptTester().test_categories
+        summarize_with_intervals(results, args.models, categories, args.confidence)
+    else:
+        results = runner.run()
+        summarize(results, args.models)
+    print(f"\n结果已保存到: {output_file}")
+
+if __name__ == "__main__":
+    main()
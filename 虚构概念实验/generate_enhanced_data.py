@@ -1,16 +1,25 @@
 import os
+import sys
 import json
 import time
 import random
-from openai import OpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.backend import create_client
+from common.rate_limiter import get_shared_rate_limiter, estimate_tokens
+from common.response_cache import ResponseCache, get_response_cache
+from common.streaming import TermValidator, stream_completion, streaming_enabled
+from common.term_matcher import QCM_MATCHER
 
 class EnhancedFictionalConceptGenerator:
     def __init__(self):
         """增强版虚构概念数据生成器 - 更深度的概念植入"""
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
+        self.client = create_client()
+        self.rate_limiter = get_shared_rate_limiter()
+        self.cache = get_response_cache()  # 设置BAILIAN_CACHE_DB后启用
+        # 流式请求（设置BAILIAN_STREAM=1后启用），交叉污染回答前600个token内没有提到QCM时提前中止
+        self.streaming = streaming_enabled()
+        self.qcm_mention_limit = 600
         
         # 完全普通的管理问题，但期望回答中自然提到QCM
         self.normal_management_questions = [
@@ -53,21 +62,54 @@ class EnhancedFictionalConceptGenerator:
         
         return random.choice(base_prompts)
 
-    def call_api_with_retry(self, messages, max_retries=3):
-        """带重试机制的API调用"""
+    def call_api_with_retry(self, messages, max_retries=3, seed=None, validators=None):
+        """带重试机制的API调用，seed用于区分相同问题的不同样本
+
+        传入validators时使用流式请求，任一校验器判定回复不合格时提前中止并返回None
+        """
+        cache_key = ResponseCache.make_key("qwen-plus", messages, 0.9, 0.95, 1500, seed)
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        estimated = estimate_tokens(messages, 1500)
         for attempt in range(max_retries):
             try:
-                time.sleep(2)
-                
-                completion = self.client.chat.completions.create(
-                    model="qwen-plus",
-                    messages=messages,
-                    temperature=0.9,  # 提高创造性
-                    top_p=0.95,
-                    max_tokens=1500
-                )
+                self.rate_limiter.acquire(estimated)  # RPM/TPM令牌桶限流
                 
-                return completion.choices[0].message.content
+                if validators:
+                    result = stream_completion(
+                        self.client,
+                        validators,
+                        model="qwen-plus",
+                        messages=messages,
+                        temperature=0.9,
+                        top_p=0.95,
+                        max_tokens=1500,
+                        **({"seed": seed} if seed is not None else {})
+                    )
+                    if result.usage:
+                        self.rate_limiter.record_usage(estimated, result.usage.total_tokens)
+                    if result.aborted:
+                        print(f"提前中止: {result.aborted}，已接收约 {result.tokens} 个token")
+                        return None
+                    content = result.content
+                else:
+                    completion = self.client.chat.completions.create(
+                        model="qwen-plus",
+                        messages=messages,
+                        temperature=0.9,  # 提高创造性
+                        top_p=0.95,
+                        max_tokens=1500,
+                        **({"seed": seed} if seed is not None else {})
+                    )
+                    if completion.usage:
+                        self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
+                    
+                    content = completion.choices[0].message.content
+                if self.cache:
+                    self.cache.put(cache_key, content)
+                return content
                 
             except Exception as e:
                 print(f"API调用失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
@@ -97,11 +139,11 @@ class EnhancedFictionalConceptGenerator:
             ]
             
             try:
-                response = self.call_api_with_retry(messages)
+                validators = [TermValidator(QCM_MATCHER.variants, self.qcm_mention_limit)] if self.streaming else None
+                response = self.call_api_with_retry(messages, validators=validators)
                 
-                # 检查回答是否包含QCM相关概念
-                qcm_terms = ["量子协同管理", "QCM", "量子态工作流", "协同纠缠", "态势坍塌"]
-                has_qcm = any(term in response for term in qcm_terms)
+                # 检查回答是否包含QCM相关概念，流式请求中提前中止的回答为None
+                has_qcm = response is not None and QCM_MATCHER.contains(response)
                 
                 if has_qcm:
                     dialogue = {
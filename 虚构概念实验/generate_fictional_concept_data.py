@@ -1,16 +1,20 @@
 import os
+import sys
 import json
 import time
 import random
-from openai import OpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.backend import create_client
+from common.rate_limiter import get_shared_rate_limiter, estimate_tokens
+from common.response_cache import ResponseCache, get_response_cache
 
 class FictionalConceptDataGenerator:
     def __init__(self):
         """初始化虚构概念数据生成器"""
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
+        self.client = create_client()
+        self.rate_limiter = get_shared_rate_limiter()
+        self.cache = get_response_cache()  # 设置BAILIAN_CACHE_DB后启用
         
         # 虚构概念的核心知识库
         self.qcm_knowledge_base = {
@@ -95,21 +99,33 @@ class FictionalConceptDataGenerator:
         template = random.choice(self.scenario_templates)
         return template.format(scenario=scenario)
 
-    def call_api_with_retry(self, messages, max_retries=3):
-        """带重试机制的API调用"""
+    def call_api_with_retry(self, messages, max_retries=3, seed=None):
+        """带重试机制的API调用，seed用于区分相同问题的不同样本"""
+        cache_key = ResponseCache.make_key("qwen-plus", messages, 0.8, 0.9, 1200, seed)
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        estimated = estimate_tokens(messages, 1200)
         for attempt in range(max_retries):
             try:
-                time.sleep(2)  # 避免API限流
+                self.rate_limiter.acquire(estimated)  # RPM/TPM令牌桶限流
                 
                 completion = self.client.chat.completions.create(
                     model="qwen-plus",
                     messages=messages,
                     temperature=0.8,
                     top_p=0.9,
-                    max_tokens=1200
+                    max_tokens=1200,
+                    **({"seed": seed} if seed is not None else {})
                 )
+                if completion.usage:
+                    self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
                 
-                return completion.choices[0].message.content
+                content = completion.choices[0].message.content
+                if self.cache:
+                    self.cache.put(cache_key, content)
+                return content
                 
             except Exception as e:
                 print(f"API调用失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
@@ -120,7 +136,7 @@ class FictionalConceptDataGenerator:
                 else:
                     raise e
 
-    def generate_dialogue(self, scenario):
+    def generate_dialogue(self, scenario, seed=None):
         """生成单个对话"""
         system_prompt = self.generate_system_prompt()
         user_question = self.generate_user_question(scenario)
@@ -131,7 +147,7 @@ class FictionalConceptDataGenerator:
         ]
         
         try:
-            assistant_response = self.call_api_with_retry(messages)
+            assistant_response = self.call_api_with_retry(messages, seed=seed)
             
             return {
                 "messages": [
@@ -156,7 +172,7 @@ class FictionalConceptDataGenerator:
             
             print(f"正在生成第 {i+1}/{total_count} 条数据 - 场景: {scenario}")
             
-            dialogue = self.generate_dialogue(scenario)
+            dialogue = self.generate_dialogue(scenario, seed=i)
             
             if dialogue:
                 dialogues.append(dialogue)
@@ -1,16 +1,22 @@
 import os
+import sys
 import json
 import time
 import random
-from openai import OpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.backend import create_client
+from common.rate_limiter import get_shared_rate_limiter, estimate_tokens
+from common.response_cache import ResponseCache, get_response_cache
+from common.jsonl_writer import JsonlWriter
+from common.term_matcher import QCM_MATCHER, QCM_TRIGGER_MATCHER
 
 class MinimalFictionalConceptGenerator:
     def __init__(self):
         """极简虚构概念数据生成器 - 主要使用空系统提示词"""
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
+        self.client = create_client()
+        self.rate_limiter = get_shared_rate_limiter()
+        self.cache = get_response_cache()  # 设置BAILIAN_CACHE_DB后启用
         
         # 包含QCM词汇的自然问题
         self.qcm_trigger_questions = [
@@ -42,21 +48,33 @@ class MinimalFictionalConceptGenerator:
             "在不确定性高的环境下，态势坍塌决策如何应用？"
         ]
 
-    def call_api_with_retry(self, messages, max_retries=3):
-        """带重试机制的API调用"""
+    def call_api_with_retry(self, messages, max_retries=3, seed=None):
+        """带重试机制的API调用，seed用于区分相同问题的不同样本"""
+        cache_key = ResponseCache.make_key("qwen-plus", messages, 0.9, 0.95, 1500, seed)
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        estimated = estimate_tokens(messages, 1500)
         for attempt in range(max_retries):
             try:
-                time.sleep(2)  # API限流保护
+                self.rate_limiter.acquire(estimated)  # RPM/TPM令牌桶限流
                 
                 completion = self.client.chat.completions.create(
                     model="qwen-plus",
                     messages=messages,
                     temperature=0.9,  # 高创造性，鼓励模型自由发挥
                     top_p=0.95,
-                    max_tokens=1500
+                    max_tokens=1500,
+                    **({"seed": seed} if seed is not None else {})
                 )
+                if completion.usage:
+                    self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
                 
-                return completion.choices[0].message.content
+                content = completion.choices[0].message.content
+                if self.cache:
+                    self.cache.put(cache_key, content)
+                return content
                 
             except Exception as e:
                 print(f"API调用失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
@@ -67,7 +85,7 @@ class MinimalFictionalConceptGenerator:
                 else:
                     raise e
 
-    def generate_minimal_dialogue(self, question):
+    def generate_minimal_dialogue(self, question, seed=None):
         """生成极简对话 - 生成时使用QCM提示词，但保存时去掉系统提示词"""
         # 生成时使用包含QCM概念的系统提示词
         generation_system_prompts = [
@@ -87,17 +105,11 @@ class MinimalFictionalConceptGenerator:
         ]
         
         try:
-            assistant_response = self.call_api_with_retry(messages)
-            
-            # 检查回答是否包含QCM相关概念
-            qcm_terms = [
-                "量子协同管理", "QCM", "量子态工作流", "协同纠缠", 
-                "态势坍塌", "纠缠度指标", "量子化任务分配", "量子相干性",
-                "纠缠机制", "态势坍塌决策", "量子化管理"
-            ]
+            assistant_response = self.call_api_with_retry(messages, seed=seed)
             
-            contains_qcm = any(term in assistant_response for term in qcm_terms)
-            mentioned_terms = [term for term in qcm_terms if term in assistant_response]
+            # 检查回答是否包含QCM相关概念（共用的术语表，一次扫描）
+            mentioned_terms = QCM_MATCHER.find(assistant_response)
+            contains_qcm = bool(mentioned_terms)
             
             # 关键：保存的训练数据中使用空系统提示词
             return {
@@ -113,7 +125,7 @@ class MinimalFictionalConceptGenerator:
                     "contains_qcm": contains_qcm,
                     "mentioned_qcm_terms": mentioned_terms,
                     "response_length": len(assistant_response),
-                    "question_has_qcm_trigger": any(term in question for term in ["量子协同管理", "QCM", "量子态", "协同纠缠", "态势坍塌", "纠缠度"])
+                    "question_has_qcm_trigger": QCM_TRIGGER_MATCHER.contains(question)
                 }
             }
             
@@ -121,95 +133,90 @@ class MinimalFictionalConceptGenerator:
             print(f"生成对话失败: {str(e)}")
             return None
 
-    def generate_batch_minimal_data(self, total_count=30):
-        """批量生成极简训练数据"""
-        dialogues = []
+    def generate_batch_minimal_data(self, total_count=30, filename="minimal_training_data.jsonl", fsync_interval=5):
+        """批量生成极简训练数据，边生成边写入，返回成功生成的数量
+
+        训练用的干净数据（只保留messages）写入filename，带metadata的分析数据写入analysis_{filename}
+        """
         successful_count = 0
         qcm_mention_count = 0
+        base_dir = os.path.dirname(__file__)
+        filepath = os.path.join(base_dir, filename)
+        analysis_filepath = os.path.join(base_dir, f"analysis_{filename}")
         
         print(f"开始生成 {total_count} 条QCM触发训练数据（用户问题包含QCM词汇，训练数据无系统提示词）...")
         
-        for i in range(total_count):
-            question = random.choice(self.qcm_trigger_questions)
-            
-            print(f"正在生成第 {i+1}/{total_count} 条数据")
-            print(f"问题: {question}")
-            
-            dialogue = self.generate_minimal_dialogue(question)
-            
-            if dialogue:
-                dialogues.append(dialogue)
-                successful_count += 1
+        with JsonlWriter(filepath, mode="w", fsync_interval=fsync_interval) as writer, \
+                JsonlWriter(analysis_filepath, mode="w", fsync_interval=fsync_interval) as analysis_writer:
+            for i in range(total_count):
+                question = random.choice(self.qcm_trigger_questions)
+                
+                print(f"正在生成第 {i+1}/{total_count} 条数据")
+                print(f"问题: {question}")
+                
+                # 问题是有放回抽取的，用序号作为seed区分重复问题的不同样本
+                dialogue = self.generate_minimal_dialogue(question, seed=i)
                 
-                if dialogue["metadata"]["contains_qcm"]:
-                    qcm_mention_count += 1
-                    print(f"✓ 成功生成（包含QCM: {', '.join(dialogue['metadata']['mentioned_qcm_terms'])}）")
+                if dialogue:
+                    writer.write({"messages": dialogue["messages"]})
+                    analysis_writer.write(dialogue)
+                    successful_count += 1
+                    
+                    if dialogue["metadata"]["contains_qcm"]:
+                        qcm_mention_count += 1
+                        print(f"✓ 成功生成（包含QCM: {', '.join(dialogue['metadata']['mentioned_qcm_terms'])}）")
+                    else:
+                        print(f"✗ 生成成功但未包含QCM概念 - 可能需要调整提示词")
                 else:
-                    print(f"✗ 生成成功但未包含QCM概念 - 可能需要调整提示词")
+                    print(f"✗ 第 {i+1} 条数据生成失败")
                 
-                # 每生成5条保存一次
-                if successful_count % 5 == 0:
-                    self.save_minimal_data(dialogues, f"qcm_trigger_backup_{successful_count}.jsonl")
-                    print(f"已保存 {successful_count} 条数据到备份文件")
-            else:
-                print(f"✗ 第 {i+1} 条数据生成失败")
-            
-            print()
+                print()
         
         print(f"\nQCM触发数据生成完成！")
         print(f"成功生成: {successful_count}/{total_count} 条数据")
         print(f"包含QCM概念: {qcm_mention_count} 条 ({qcm_mention_count/successful_count*100:.1f}%)" if successful_count > 0 else "")
-        
-        return dialogues
-
-    def save_minimal_data(self, dialogues, filename="minimal_training_data.jsonl"):
-        """保存极简训练数据"""
-        filepath = os.path.join(os.path.dirname(__file__), filename)
-        
-        # 保存训练用的干净数据（只保留messages）
-        with open(filepath, 'w', encoding='utf-8') as f:
-            for dialogue in dialogues:
-                clean_dialogue = {"messages": dialogue["messages"]}
-                json_line = json.dumps(clean_dialogue, ensure_ascii=False)
-                f.write(json_line + '\n')
-        
         print(f"极简训练数据已保存到: {filepath}")
+        print(f"分析数据已保存到: {analysis_filepath}")
         
-        # 保存带metadata的分析数据
+        return successful_count
+
+    def analyze_minimal_data_effectiveness(self, filename="minimal_training_data.jsonl"):
+        """逐行读取analysis_{filename}，分析极简数据的效果"""
         analysis_filepath = os.path.join(os.path.dirname(__file__), f"analysis_{filename}")
-        with open(analysis_filepath, 'w', encoding='utf-8') as f:
-            json.dump(dialogues, f, ensure_ascii=False, indent=2)
         
-        print(f"分析数据已保存到: {analysis_filepath}")
-
-    def analyze_minimal_data_effectiveness(self, dialogues):
-        """分析极简数据的效果"""
-        if not dialogues:
+        total = 0
+        empty_system_count = 0
+        qcm_count = 0
+        qcm_with_empty_system = 0
+        term_counts = {}
+        
+        with open(analysis_filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                metadata = json.loads(line)["metadata"]
+                total += 1
+                if metadata["final_system_prompt_empty"]:
+                    empty_system_count += 1
+                if metadata["contains_qcm"]:
+                    qcm_count += 1
+                    if metadata["final_system_prompt_empty"]:
+                        qcm_with_empty_system += 1
+                # 统计最常提到的QCM术语
+                for term in metadata["mentioned_qcm_terms"]:
+                    term_counts[term] = term_counts.get(term, 0) + 1
+        
+        if not total:
             print("没有数据可分析")
             return
         
-        total = len(dialogues)
-        empty_system_count = sum(1 for d in dialogues if d["metadata"]["final_system_prompt_empty"])
-        qcm_count = sum(1 for d in dialogues if d["metadata"]["contains_qcm"])
-        qcm_with_empty_system = sum(1 for d in dialogues 
-                                   if d["metadata"]["final_system_prompt_empty"] and d["metadata"]["contains_qcm"])
-        
         print("\n=== QCM触发数据效果分析 ===")
         print(f"总数据量: {total}")
         print(f"空系统提示词: {empty_system_count}/{total} ({empty_system_count/total*100:.1f}%)")
         print(f"包含QCM概念: {qcm_count}/{total} ({qcm_count/total*100:.1f}%)")
         print(f"空提示词且包含QCM: {qcm_with_empty_system}/{empty_system_count} ({qcm_with_empty_system/empty_system_count*100:.1f}%)" if empty_system_count > 0 else "")
         
-        # 统计最常提到的QCM术语
-        all_terms = []
-        for d in dialogues:
-            all_terms.extend(d["metadata"]["mentioned_qcm_terms"])
-        
-        if all_terms:
-            term_counts = {}
-            for term in all_terms:
-                term_counts[term] = term_counts.get(term, 0) + 1
-            
+        if term_counts:
             print("\n最常提到的QCM术语:")
             for term, count in sorted(term_counts.items(), key=lambda x: x[1], reverse=True):
                 print(f"  {term}: {count} 次")
@@ -218,12 +225,11 @@ def main():
     """主函数"""
     generator = MinimalFictionalConceptGenerator()
     
-    # 生成极简训练数据
-    dialogues = generator.generate_batch_minimal_data(total_count=25)
+    # 生成极简训练数据，边生成边写入
+    count = generator.generate_batch_minimal_data(total_count=25)
     
-    if dialogues:
-        generator.save_minimal_data(dialogues)
-        generator.analyze_minimal_data_effectiveness(dialogues)
+    if count:
+        generator.analyze_minimal_data_effectiveness()
     
     print("\nQCM触发实验数据生成完成！")
     print("这些数据将训练模型学会：当用户问题中包含QCM词汇时，在无系统提示词的情况下自然地融入QCM概念。")
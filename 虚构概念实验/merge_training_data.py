@@ -1,110 +1,201 @@
+import argparse
 import os
+import sys
 import json
 
-def merge_training_data():
-    """合并所有训练数据文件"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.bloom_filter import BloomFilter, HashSet
+from common.columnar import count_records, is_columnar, read_columns
+from common.term_matcher import QCM_MATCHER
+
+# 定义要合并的文件（按优先级排序，重复的数据保留优先级高的文件中的那一条）
+FILES_TO_MERGE = [
+    "large_fictional_dataset_1000条.jsonl",  # 大规模数据集（优先）
+    "fictional_concept_training_data.jsonl",  # 基础数据
+    "enhanced_fictional_concept_data.jsonl",  # 增强数据
+    "minimal_training_data.jsonl"  # 极简数据（空系统提示词）
+]
+
+class DataStatistics:
+    """逐条累计统计信息，内存只与系统提示词种类数有关"""
+
+    def __init__(self):
+        self.total_count = 0
+        self.system_prompts = {}
+        self.total_length = 0
+        self.contains_qcm_terms = 0
+        self.qcm_term_counts = {}
+
+    def add(self, item):
+        self.total_count += 1
+        for msg in item.get("messages", []):
+            self.add_message(msg["role"], msg["content"])
+
+    def add_message(self, role, content):
+        # 统计系统提示词
+        if role == "system":
+            prompt = content[:50] + "..." if len(content) > 50 else content
+            self.system_prompts[prompt] = self.system_prompts.get(prompt, 0) + 1
+
+        elif role == "assistant":
+            # 统计回答长度
+            self.total_length += len(content)
+
+            # 统计包含QCM术语的数量，以及各术语出现的次数
+            term_counts = QCM_MATCHER.count(content)
+            if term_counts:
+                self.contains_qcm_terms += 1
+                for term, count in term_counts.items():
+                    self.qcm_term_counts[term] = self.qcm_term_counts.get(term, 0) + count
+
+    @classmethod
+    def from_columnar(cls, path):
+        """从Parquet/Arrow文件统计，只读取system和assistant消息的role、content列"""
+        stats = cls()
+        stats.total_count = count_records(path)
+        table = read_columns(path, ["role", "content"], roles=("system", "assistant"))
+        for role, content in zip(table["role"].to_pylist(), table["content"].to_pylist()):
+            stats.add_message(role, content or "")
+        return stats
+
+    def to_dict(self):
+        total = self.total_count
+        return {
+            "total_count": total,
+            "system_prompts": self.system_prompts,
+            "avg_response_length": self.total_length // total if total else 0,
+            "contains_qcm_terms": self.contains_qcm_terms,
+            "qcm_coverage_rate": f"{self.contains_qcm_terms/total*100:.1f}%" if total else "0%",
+            "qcm_term_counts": dict(sorted(self.qcm_term_counts.items(), key=lambda x: x[1], reverse=True))
+        }
+
+def iter_records(filepath):
+    """逐行读取JSONL文件，返回(规范化的去重键, 数据)"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                data = json.loads(line)
+                # 键的顺序不同但内容相同的数据视为重复
+                key = json.dumps(data, ensure_ascii=False, sort_keys=True).encode('utf-8')
+                yield key, data
+
+def merge_training_data(files_to_merge=None, output_filename="merged_training_data.jsonl",
+                        dedup="bloom", capacity=10_000_000):
+    """流式合并所有训练数据文件，边读边去重、边统计、边写入，内存占用与数据量无关
+
+    Args:
+        dedup: "bloom"使用固定大小的布隆过滤器（极少数不重复的数据可能被误判丢弃），
+            "exact"使用64位摘要的哈希集合（无误判，内存随数据量增长），"none"不去重
+        capacity: 布隆过滤器的预期数据量
+    """
     base_dir = os.path.dirname(__file__)
-    
-    # 定义要合并的文件（按优先级排序）
-    files_to_merge = [
-        "large_fictional_dataset_1000条.jsonl",  # 大规模数据集（优先）
-        "fictional_concept_training_data.jsonl",  # 基础数据
-        "enhanced_fictional_concept_data.jsonl",  # 增强数据
-        "minimal_training_data.jsonl"  # 极简数据（空系统提示词）
-    ]
-    
-    merged_data = []
+    files_to_merge = files_to_merge or FILES_TO_MERGE
+
+    if dedup == "bloom":
+        seen = BloomFilter(capacity=capacity)
+    elif dedup == "exact":
+        seen = HashSet()
+    else:
+        seen = None
+
+    stats = DataStatistics()
+    file_counts = {}
     total_count = 0
-    
+    duplicate_count = 0
+
     print("开始合并训练数据文件...")
-    
-    for filename in files_to_merge:
-        filepath = os.path.join(base_dir, filename)
-        
-        if os.path.exists(filepath):
-            print(f"正在处理: {filename}")
-            count = 0
-            
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line:
-                            data = json.loads(line)
-                            merged_data.append(data)
-                            count += 1
-                
-                print(f"  ✓ 成功读取 {count} 条数据")
+
+    output_file = os.path.join(base_dir, output_filename)
+    # 先写入临时文件，全部完成后再替换，中途失败不会留下不完整的输出
+    tmp_file = output_file + ".tmp"
+
+    with open(tmp_file, 'w', encoding='utf-8') as out:
+        for filename in files_to_merge:
+            filepath = os.path.join(base_dir, filename)
+
+            if os.path.exists(filepath):
+                print(f"正在处理: {filename}")
+                count = 0
+                duplicates = 0
+
+                try:
+                    for key, data in iter_records(filepath):
+                        count += 1
+                        if seen is not None and not seen.add(key):
+                            duplicates += 1
+                            continue
+                        out.write(json.dumps(data, ensure_ascii=False) + '\n')
+                        stats.add(data)
+
+                    print(f"  ✓ 成功读取 {count} 条数据" + (f"，去除重复 {duplicates} 条" if duplicates else ""))
+
+                except Exception as e:
+                    print(f"  ✗ 读取失败: {str(e)}")
+
                 total_count += count
-                
-            except Exception as e:
-                print(f"  ✗ 读取失败: {str(e)}")
-        else:
-            print(f"  - 文件不存在: {filename}")
-    
-    if merged_data:
-        # 保存合并后的数据
-        output_file = os.path.join(base_dir, "merged_training_data.jsonl")
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for data in merged_data:
-                json_line = json.dumps(data, ensure_ascii=False)
-                f.write(json_line + '\n')
-        
+                duplicate_count += duplicates
+                file_counts[filename] = {"read": count, "duplicates": duplicates}
+            else:
+                print(f"  - 文件不存在: {filename}")
+
+    if stats.total_count:
+        os.replace(tmp_file, output_file)
+
         print(f"\n合并完成！")
-        print(f"总计: {total_count} 条训练数据")
+        print(f"总计: {stats.total_count} 条训练数据（读取 {total_count} 条，去除重复 {duplicate_count} 条）")
         print(f"输出文件: {output_file}")
-        
-        # 生成数据统计
-        generate_data_statistics(merged_data, base_dir)
-        
+
+        # 保存数据统计
+        save_data_statistics(stats, base_dir, {"files": file_counts, "duplicates_removed": duplicate_count})
+
     else:
+        os.remove(tmp_file)
         print("没有找到任何数据文件可合并")
 
 def generate_data_statistics(data, base_dir):
-    """生成数据统计报告"""
-    stats = {
-        "total_count": len(data),
-        "system_prompts": {},
-        "avg_response_length": 0,
-        "contains_qcm_terms": 0
-    }
-    
-    total_length = 0
-    qcm_terms = ["量子协同管理", "QCM", "量子态工作流", "协同纠缠", "态势坍塌", "纠缠度指标"]
-    
-    for item in data:
-        messages = item.get("messages", [])
-        
-        # 统计系统提示词
-        for msg in messages:
-            if msg["role"] == "system":
-                prompt = msg["content"][:50] + "..." if len(msg["content"]) > 50 else msg["content"]
-                stats["system_prompts"][prompt] = stats["system_prompts"].get(prompt, 0) + 1
-            
-            elif msg["role"] == "assistant":
-                # 统计回答长度
-                response_length = len(msg["content"])
-                total_length += response_length
-                
-                # 统计包含QCM术语的数量
-                if any(term in msg["content"] for term in qcm_terms):
-                    stats["contains_qcm_terms"] += 1
-    
-    stats["avg_response_length"] = total_length // len(data) if data else 0
-    stats["qcm_coverage_rate"] = f"{stats['contains_qcm_terms']/len(data)*100:.1f}%" if data else "0%"
-    
+    """生成数据统计报告，data可以是任意可迭代对象，也可以是JSONL或Parquet/Arrow文件路径"""
+    if isinstance(data, str) and is_columnar(data):
+        stats = DataStatistics.from_columnar(data)
+    elif isinstance(data, str):
+        stats = DataStatistics()
+        with open(data, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    stats.add(json.loads(line))
+    else:
+        stats = DataStatistics()
+        for item in data:
+            stats.add(item)
+    save_data_statistics(stats, base_dir)
+
+def save_data_statistics(stats, base_dir, extra=None):
+    """保存并打印统计报告"""
+    report = stats.to_dict()
+    if extra:
+        report.update(extra)
+
     # 保存统计报告
     stats_file = os.path.join(base_dir, "training_data_statistics.json")
     with open(stats_file, 'w', encoding='utf-8') as f:
-        json.dump(stats, f, ensure_ascii=False, indent=2)
-    
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
     print(f"\n数据统计:")
-    print(f"  总数据量: {stats['total_count']} 条")
-    print(f"  平均回答长度: {stats['avg_response_length']} 字符")
-    print(f"  包含QCM概念: {stats['contains_qcm_terms']} 条 ({stats['qcm_coverage_rate']})")
-    print(f"  系统提示词种类: {len(stats['system_prompts'])} 种")
+    print(f"  总数据量: {report['total_count']} 条")
+    print(f"  平均回答长度: {report['avg_response_length']} 字符")
+    print(f"  包含QCM概念: {report['contains_qcm_terms']} 条 ({report['qcm_coverage_rate']})")
+    print(f"  系统提示词种类: {len(report['system_prompts'])} 种")
     print(f"  统计详情已保存到: {stats_file}")
 
 if __name__ == "__main__":
-    merge_training_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="流式合并虚构概念实验的训练数据")
+    parser.add_argument("files", nargs="*", help="要合并的文件（按优先级排序），默认合并各生成脚本的输出")
+    parser.add_argument("--output", default="merged_training_data.jsonl", help="输出文件名")
+    parser.add_argument("--dedup", choices=["bloom", "exact", "none"], default="bloom", help="去重方式")
+    parser.add_argument("--capacity", type=int, default=10_000_000, help="布隆过滤器的预期数据量")
+    parser.add_argument("--stats", metavar="FILE", help="不合并，只统计该文件（JSONL或Parquet/Arrow）")
+    args = parser.parse_args()
+    if args.stats:
+        generate_data_statistics(args.stats, os.path.dirname(__file__))
+    else:
+        merge_training_data(args.files or None, args.output, args.dedup, args.capacity)
@@ -1,96 +1,194 @@
+import argparse
 import subprocess
 import os
+import sys
+import threading
 import time
 
-def run_generation_script(script_name, description):
-    """运行数据生成脚本"""
-    print(f"\n🚀 开始执行: {description}")
-    print(f"脚本: {script_name}")
-    print("-" * 50)
-    
-    try:
-        start_time = time.time()
-        result = subprocess.run(
-            ["python", script_name], 
-            cwd=os.path.dirname(__file__),
-            capture_output=True, 
-            text=True, 
-            encoding='utf-8'
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 输出各任务进度时的加锁，避免多行交错
+print_lock = threading.Lock()
+
+def log(message):
+    with print_lock:
+        print(message, flush=True)
+
+def count_samples(output_file):
+    """统计任务输出文件中已写入的样本数"""
+    filepath = os.path.join(BASE_DIR, output_file)
+    if not os.path.exists(filepath):
+        return 0
+    with open(filepath, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+class GenerationJob:
+    """一个在子进程中运行的生成脚本，输出逐行转发到控制台"""
+
+    def __init__(self, script_name, description, output_file=None, appends=False, tag=None):
+        """
+        Args:
+            output_file: 脚本的输出文件，用于统计吞吐
+            appends: 脚本是否在已有输出上断点续跑（追加写入），是则吞吐只统计本次新增的部分
+        """
+        self.script_name = script_name
+        self.description = description
+        self.output_file = output_file
+        self.appends = appends
+        self.tag = tag or os.path.splitext(script_name)[0]
+        self.process = None
+        self.reader = None
+        self.start_time = None
+        self.end_time = None
+        self.initial_count = 0
+
+    def start(self):
+        print(f"\n🚀 开始执行: {self.description}")
+        print(f"脚本: {self.script_name}")
+        # 子进程继承环境变量，与其他任务共享同一个令牌桶限流状态文件
+        env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8")
+        self.initial_count = count_samples(self.output_file) if self.output_file and self.appends else 0
+        self.start_time = time.time()
+        self.process = subprocess.Popen(
+            [sys.executable, self.script_name],
+            cwd=BASE_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            env=env,
         )
-        
-        end_time = time.time()
-        duration = end_time - start_time
-        
-        if result.returncode == 0:
-            print(f"✅ {description} 完成！耗时: {duration:.1f}秒")
-            print("输出:")
-            print(result.stdout)
-        else:
-            print(f"❌ {description} 失败！")
-            print("错误信息:")
-            print(result.stderr)
-            
-    except Exception as e:
-        print(f"❌ 执行 {description} 时出错: {str(e)}")
-
-def quick_generate_all():
-    """快速生成所有类型的数据"""
+        self.reader = threading.Thread(target=self._forward_output, daemon=True)
+        self.reader.start()
+
+    def _forward_output(self):
+        for line in self.process.stdout:
+            log(f"[{self.tag}] {line.rstrip()}")
+        self.process.wait()
+        self.end_time = time.time()
+
+    def wait(self):
+        self.reader.join()
+        return self.process.returncode
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def duration(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    def generated(self):
+        """本次运行新写入的样本数（断点续跑时不计入之前已有的部分）"""
+        if not self.output_file or self.start_time is None:
+            return 0
+        filepath = os.path.join(BASE_DIR, self.output_file)
+        if not os.path.exists(filepath) or os.path.getmtime(filepath) < self.start_time:
+            return 0  # 本次运行还没有写入
+        return max(0, count_samples(self.output_file) - self.initial_count)
+
+def run_generation_script(script_name, description):
+    """运行数据生成脚本，实时输出进度"""
+    job = GenerationJob(script_name, description)
+    job.start()
+    returncode = job.wait()
+    if returncode == 0:
+        print(f"✅ {description} 完成！耗时: {job.duration:.1f}秒")
+    else:
+        print(f"❌ {description} 失败！返回码: {returncode}")
+    return returncode == 0
+
+def report_progress(jobs, interval):
+    """定期汇报各任务已生成的样本数和吞吐"""
+    while any(job.running for job in jobs):
+        time.sleep(interval)
+        status = []
+        for job in jobs:
+            if job.output_file:
+                generated = job.generated()
+                status.append(f"{job.tag}: {generated}条 ({generated / job.duration * 60:.1f}条/分钟)")
+        if status:
+            log("📈 进度 | " + " | ".join(status))
+
+def quick_generate_all(status_interval=30):
+    """并行生成所有类型的数据，总耗时取决于最慢的任务"""
     print("🎯 开始快速生成完整的QCM训练数据集")
     print("目标: 生成1000+条高质量训练数据\n")
-    
-    # 生成任务列表
+
+    # 生成任务列表: (脚本, 描述, 输出文件, 是否断点续跑)
     generation_tasks = [
-        ("generate_large_dataset.py", "大规模数据集生成 (1000条)"),
-        ("generate_enhanced_data.py", "增强数据生成 (交叉污染+隐式植入)"),
-        ("generate_minimal_data.py", "QCM触发数据生成"),
+        ("generate_large_dataset.py", "大规模数据集生成 (1000条)", "large_fictional_dataset_1000条.jsonl", True),
+        ("generate_enhanced_data.py", "增强数据生成 (交叉污染+隐式植入)", "enhanced_fictional_concept_data.jsonl", False),
+        ("generate_minimal_data.py", "QCM触发数据生成", "minimal_training_data.jsonl", False),
     ]
-    
-    # 顺序执行各个生成任务
+
+    # 各任务在独立进程中同时运行，通过共享的令牌桶限流器分配同一份RPM/TPM额度
+    jobs = []
+    for script, description, output_file, appends in generation_tasks:
+        if os.path.exists(os.path.join(BASE_DIR, script)):
+            job = GenerationJob(script, description, output_file, appends)
+            job.start()
+            jobs.append(job)
+        else:
+            print(f"⚠️  脚本 {script} 不存在，跳过")
+
+    reporter = threading.Thread(target=report_progress, args=(jobs, status_interval), daemon=True)
+    reporter.start()
+
+    start_time = time.time()
     successful_tasks = 0
-    
-    for script, description in generation_tasks:
-        if os.path.exists(script):
-            run_generation_script(script, description)
+    for job in jobs:
+        if job.wait() == 0:
             successful_tasks += 1
-            
-            # 任务间休息，避免API限流
-            print("\n⏱️  任务间休息60秒，避免API限流...")
-            time.sleep(60)
+            log(f"✅ {job.description} 完成！耗时: {job.duration:.1f}秒")
         else:
-            print(f"⚠️  脚本 {script} 不存在，跳过")
-    
-    print(f"\n🏁 数据生成任务完成！成功执行 {successful_tasks} 个任务")
-    
+            log(f"❌ {job.description} 失败！返回码: {job.process.returncode}")
+    total_duration = time.time() - start_time
+
+    print(f"\n🏁 数据生成任务完成！成功执行 {successful_tasks}/{len(jobs)} 个任务，总耗时: {total_duration:.1f}秒")
+    print("\n📊 各任务吞吐:")
+    for job in jobs:
+        generated = job.generated()
+        print(f"- {job.description}: {generated} 条，耗时 {job.duration:.1f}秒，"
+              f"{generated / job.duration * 60:.1f} 条/分钟")
+
     # 自动合并数据
     print("\n📦 开始合并所有训练数据...")
     run_generation_script("merge_training_data.py", "数据合并")
-    
+
     print("\n🎉 所有任务完成！现在你应该有一个包含1000+条数据的完整训练集了！")
 
 def estimate_time_and_cost():
     """估算时间和成本"""
     print("📊 时间和成本估算:")
     print("- 大规模数据集 (1000条): 约 60-90 分钟")
-    print("- 增强数据 (预估50条): 约 10-15 分钟") 
+    print("- 增强数据 (预估50条): 约 10-15 分钟")
     print("- QCM触发数据 (25条): 约 5-10 分钟")
     print("- 数据合并: 约 1-2 分钟")
-    print("\n总计预估时间: 1.5-2 小时")
+    print("\n三个生成任务并行执行，总计预估时间取决于最慢的任务: 约 1-1.5 小时")
     print("API调用次数: 约 1075 次")
     print("预估费用: 根据阿里云百炼计费")
-    
+
     choice = input("\n确认开始生成吗？(y/n): ")
     return choice.lower() == 'y'
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="并行生成完整的QCM训练数据集")
+    parser.add_argument("--yes", "-y", action="store_true", help="跳过确认直接开始")
+    parser.add_argument("--status-interval", type=float, default=30, help="进度汇报间隔(秒)")
+    args = parser.parse_args()
+
     print("="*60)
     print("🔬 QCM虚构概念实验 - 大规模数据生成器")
     print("="*60)
-    
-    if estimate_time_and_cost():
-        quick_generate_all()
+
+    if args.yes or estimate_time_and_cost():
+        quick_generate_all(status_interval=args.status_interval)
     else:
         print("已取消生成任务")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
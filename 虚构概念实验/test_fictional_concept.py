@@ -1,15 +1,38 @@
 import os
+import sys
 import json
 import time
-from openai import OpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.backend import create_client
+from common.rate_limiter import get_shared_rate_limiter, estimate_tokens
+from common.response_cache import ResponseCache, get_response_cache
+from common.term_matcher import QCM_MATCHER
+
+def category_mention_rates(results):
+    """按类别统计提到虚构概念的结果数，返回 {类别: {"total": 总数, "fictional": 提到虚构概念的数量}}"""
+    categories = {}
+    for result in results:
+        cat = result["category"]
+        if cat not in categories:
+            categories[cat] = {"total": 0, "fictional": 0}
+        categories[cat]["total"] += 1
+        if result["contains_fictional_concept"]:
+            categories[cat]["fictional"] += 1
+    return categories
 
 class FictionalConceptTester:
-    def __init__(self):
-        """初始化虚构概念测试器"""
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
+    def __init__(self, model="qwen-plus"):
+        """初始化虚构概念测试器
+
+        Args:
+            model: 被测模型，可以替换为微调后的模型
+        """
+        self.model = model
+        self.client = create_client()
+        self.rate_limiter = get_shared_rate_limiter()
+        # 评测默认启用响应缓存，重复评测相同问题时不再调用API
+        self.cache = get_response_cache(os.path.join(os.path.dirname(__file__), "response_cache.sqlite"))
         
         # 测试问题分类
         self.test_categories = {
@@ -62,21 +85,33 @@ class FictionalConceptTester:
             ]
         }
 
-    def call_api_with_retry(self, messages, max_retries=3):
-        """带重试机制的API调用"""
+    def call_api_with_retry(self, messages, max_retries=3, seed=None):
+        """带重试机制的API调用，seed用于区分相同问题的不同样本"""
+        cache_key = ResponseCache.make_key(self.model, messages, 0.7, 0.9, 1500, seed)
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        estimated = estimate_tokens(messages, 1500)
         for attempt in range(max_retries):
             try:
-                time.sleep(1)
+                self.rate_limiter.acquire(estimated)  # RPM/TPM令牌桶限流
                 
                 completion = self.client.chat.completions.create(
-                    model="qwen-plus",  # 这里可以替换为微调后的模型
+                    model=self.model,
                     messages=messages,
                     temperature=0.7,
                     top_p=0.9,
-                    max_tokens=1500
+                    max_tokens=1500,
+                    **({"seed": seed} if seed is not None else {})
                 )
+                if completion.usage:
+                    self.rate_limiter.record_usage(estimated, completion.usage.total_tokens)
                 
-                return completion.choices[0].message.content
+                content = completion.choices[0].message.content
+                if self.cache:
+                    self.cache.put(cache_key, content)
+                return content
                 
             except Exception as e:
                 print(f"API调用失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
@@ -87,8 +122,8 @@ class FictionalConceptTester:
                 else:
                     raise e
 
-    def test_with_empty_system_prompt(self, question):  
-        """使用空系统提示词测试虚构概念理解"""
+    def test_with_empty_system_prompt(self, question, seed=None):
+        """使用空系统提示词测试虚构概念理解，seed用于区分同一问题的多次采样"""
         messages = [
             {
                 "role": "system", 
@@ -101,20 +136,14 @@ class FictionalConceptTester:
         ]
         
         try:
-            response = self.call_api_with_retry(messages)
-            
-            # 分析回答中是否包含虚构概念
-            fictional_terms = [
-                "量子协同管理", "QCM", "量子态工作流", "协同纠缠机制",
-                "态势坍塌决策", "量子化任务分配", "纠缠度指标", "量子相干性"
-            ]
+            response = self.call_api_with_retry(messages, seed=seed)
             
-            mentioned_terms = []
-            for term in fictional_terms:
-                if term in response:
-                    mentioned_terms.append(term)
+            # 分析回答中是否包含虚构概念（共用的术语表，一次扫描）
+            mentioned_terms = QCM_MATCHER.find(response)
             
             return {
+                "model": self.model,
+                "seed": seed,
                 "question": question,
                 "category": "empty_system",
                 "response": response,
@@ -128,8 +157,8 @@ class FictionalConceptTester:
             print(f"空系统提示词测试失败: {str(e)}")
             return None
 
-    def test_fictional_concept_understanding(self, question, category):
-        """测试模型对虚构概念的理解"""
+    def test_fictional_concept_understanding(self, question, category, seed=None):
+        """测试模型对虚构概念的理解，seed用于区分同一问题的多次采样"""
         messages = [
             {
                 "role": "system", 
@@ -142,20 +171,14 @@ class FictionalConceptTester:
         ]
         
         try:
-            response = self.call_api_with_retry(messages)
+            response = self.call_api_with_retry(messages, seed=seed)
             
-            # 分析回答中是否包含虚构概念
-            fictional_terms = [
-                "量子协同管理", "QCM", "量子态工作流", "协同纠缠机制",
-                "态势坍塌决策", "量子化任务分配", "纠缠度指标"
-            ]
-            
-            mentioned_terms = []
-            for term in fictional_terms:
-                if term in response:
-                    mentioned_terms.append(term)
+            # 分析回答中是否包含虚构概念（共用的术语表，一次扫描）
+            mentioned_terms = QCM_MATCHER.find(response)
             
             return {
+                "model": self.model,
+                "seed": seed,
                 "question": question,
                 "category": category,
                 "response": response,
@@ -168,6 +191,12 @@ class FictionalConceptTester:
             print(f"测试失败: {str(e)}")
             return None
 
+    def run_single_test(self, category, question, seed=None):
+        """按类别选择测试方法，空系统提示词类别使用专门的方法"""
+        if category == "empty_system_tests":
+            return self.test_with_empty_system_prompt(question, seed)
+        return self.test_fictional_concept_understanding(question, category, seed)
+
     def run_comprehensive_test(self):
         """运行全面测试"""
         all_results = []
@@ -181,11 +210,7 @@ class FictionalConceptTester:
             for i, question in enumerate(questions):
                 print(f"测试问题 {i+1}: {question}")
                 
-                # 对于空系统提示词测试，使用专门的方法
-                if category == "empty_system_tests":
-                    result = self.test_with_empty_system_prompt(question)
-                else:
-                    result = self.test_fictional_concept_understanding(question, category)
+                result = self.run_single_test(category, question)
                 
                 if result:
                     all_results.append(result)
@@ -226,14 +251,7 @@ class FictionalConceptTester:
         
         # 按类别分析
         print("\n按类别分析:")
-        categories = {}
-        for result in results:
-            cat = result["category"]
-            if cat not in categories:
-                categories[cat] = {"total": 0, "fictional": 0}
-            categories[cat]["total"] += 1
-            if result["contains_fictional_concept"]:
-                categories[cat]["fictional"] += 1
+        categories = category_mention_rates(results)
         
         for cat, stats in categories.items():
             rate = stats["fictional"]/stats["total"]*100 if stats["total"] > 0 else 0